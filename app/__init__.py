@@ -17,20 +17,66 @@ Database Initialization: Sets up the database connection.
 
 """
 from flask import Flask
+from flask.sessions import SecureCookieSessionInterface
 import logging
+import threading
 from flask_sqlalchemy import SQLAlchemy
-from .config import app_secretkey, init_AppConfig
+from .config import get_secret
+
+
+class LazySecretSessionInterface(SecureCookieSessionInterface):
+    """
+    Session interface fetching the app's secret key from Key Vault when the first session is opened,
+    instead of at import.
+    """
+
+    def get_signing_serializer(self, app):
+        if not app.secret_key:
+            app.secret_key = get_secret('appsecretkey')
+        return super().get_signing_serializer(app)
+
 
 app = Flask(__name__)
-# Configuration
-app.secret_key = app_secretkey
-app.config['SQLALCHEMY_DATABASE_URI'] = init_AppConfig
+# Configuration: secrets are fetched on first use, so importing the package does not need Key Vault
+app.session_interface = LazySecretSessionInterface()
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-# Initialize the database
-db = SQLAlchemy(app)
+# The database is bound on first use, by init_database
+db = SQLAlchemy()
+db_ready = False
+db_lock = threading.Lock()
+
+
+def init_database():
+    """
+    Binds the database to the app and creates its tables, once per process. The connection string is a
+    Key Vault secret, so this runs before the first request is handled (or from scripts such as
+    create_admin.py), not at import.
+    """
+    global db_ready
+    with db_lock:
+        if db_ready:
+            return
+        if 'sqlalchemy' not in app.extensions:
+            app.config['SQLALCHEMY_DATABASE_URI'] = get_secret('initAppConfig')
+            db.init_app(app)
+        with app.app_context():
+            db.create_all()
+        db_ready = True
+
+
+def wsgi_app_with_database(wsgi_app):
+    """
+    Wraps the WSGI app so the database is set up before the first request, while Flask still accepts it.
+    """
+    def wrapped(environ, start_response):
+        if not db_ready:
+            init_database()
+        return wsgi_app(environ, start_response)
+    return wrapped
+
+
+app.wsgi_app = wsgi_app_with_database(app.wsgi_app)
 # Import the routes and models
 from app import routes, models
-with app.app_context():
-    db.create_all()
 
 logging.basicConfig(level=logging.DEBUG)
\ No newline at end of file
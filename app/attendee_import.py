@@ -0,0 +1,181 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+attendee_import.py
+Description:
+Reads the attendee list uploaded with an event (.xlsx or .csv) and writes it to the attendee table. The file
+is read one row at a time, so a list of 100,000 attendees is never held in memory as a whole.
+
+Content Overview:
+File Readers: Row iterators over an Excel sheet (openpyxl read-only mode) or a CSV file.
+Validation: Each row needs a name and a valid Singapore mobile number; numbers are normalized and
+duplicates within the file are skipped.
+Import: Valid rows are inserted in batches; invalid rows are collected in a per-row error report.
+
+Settings (see config.py): attendee_insert_batch_size and attendee_import_max_errors.
+
+"""
+
+import csv
+import io
+from openpyxl import load_workbook
+from .db_connect import insert_attendees
+from .utils import normalize_singapore_mobile
+from .config import attendee_import_max_errors
+
+# Columns the attendee file must contain (matched case-insensitively)
+NAME_COLUMN = 'attendeeName'
+PHONE_COLUMN = 'attendeePhone'
+
+# Must match the attendeeName column of the attendee table
+MAX_NAME_LENGTH = 500
+
+
+class AttendeeFileError(ValueError):
+    """
+    Raised when an attendee file cannot be read at all (unsupported format or missing columns).
+    """
+
+
+def _iter_xlsx_rows(file):
+    """
+    Yields the rows of the first sheet of an Excel workbook as tuples of cell values.
+    """
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        yield from workbook.worksheets[0].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _iter_csv_rows(file):
+    """
+    Yields the rows of a UTF-8 CSV file as lists of strings.
+    """
+    stream = io.TextIOWrapper(file, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        yield from csv.reader(stream)
+    finally:
+        # Leave the underlying upload open; Werkzeug closes it at the end of the request
+        stream.detach()
+
+
+def open_attendee_rows(file, file_extension):
+    """
+    Opens an uploaded attendee file and checks its header row.
+
+    Args:
+        file: The uploaded file (a binary file-like object).
+        file_extension (str): 'xlsx' or 'csv'.
+
+    Returns:
+        iterator: (row_number, name, phone) for each data row, with raw cell values. Row numbers are the
+        1-based line numbers of the file, so they match what the user sees in Excel.
+
+    Raises:
+        AttendeeFileError: If the format is unsupported, the file is empty or a required column is missing.
+    """
+    if file_extension == 'xlsx':
+        rows = _iter_xlsx_rows(file)
+    elif file_extension == 'csv':
+        rows = _iter_csv_rows(file)
+    else:
+        raise AttendeeFileError('Unsupported file format. Please upload a .csv or .xlsx file.')
+
+    try:
+        header = next(rows, None)
+    except Exception as e:
+        raise AttendeeFileError(f'The attendees file could not be read: {e}') from e
+    if header is None:
+        raise AttendeeFileError('The attendees file is empty.')
+    columns = [str(value).strip().lower() if value is not None else '' for value in header]
+    missing = [column for column in (NAME_COLUMN, PHONE_COLUMN) if column.lower() not in columns]
+    if missing:
+        raise AttendeeFileError(f"The attendees file is missing the column(s): {', '.join(missing)}.")
+    name_index = columns.index(NAME_COLUMN.lower())
+    phone_index = columns.index(PHONE_COLUMN.lower())
+
+    def data_rows():
+        for row_number, row in enumerate(rows, start=2):
+            name = row[name_index] if name_index < len(row) else None
+            phone = row[phone_index] if phone_index < len(row) else None
+            yield row_number, name, phone
+
+    return data_rows()
+
+
+def new_import_report():
+    """
+    Returns an empty import report.
+    """
+    return {'rows': 0, 'imported': 0, 'duplicates': 0, 'invalid': 0, 'errors': [], 'errors_truncated': False}
+
+
+def _add_error(report, row_number, message):
+    report['invalid'] += 1
+    if len(report['errors']) < attendee_import_max_errors:
+        report['errors'].append({'row': row_number, 'error': message})
+    else:
+        report['errors_truncated'] = True
+
+
+def validate_attendees(rows, report):
+    """
+    Validates and normalizes attendee rows, recording rejected rows in the report.
+
+    Blank rows are skipped silently. A row is rejected if the name is missing or too long, or if the phone
+    number is not a valid Singapore mobile number. Only the first occurrence of a phone number is kept.
+
+    Args:
+        rows (iterable): (row_number, name, phone) tuples as returned by `open_attendee_rows`.
+        report (dict): The import report to update.
+
+    Yields:
+        tuple: (attendeeName, attendeePhone) for each valid, unique attendee.
+    """
+    seen_phones = set()
+    for row_number, name, phone in rows:
+        name = str(name).strip() if name is not None else ''
+        if not name and (phone is None or str(phone).strip() == ''):
+            continue
+        report['rows'] += 1
+        # Commas and quotes would break the call status CSV rows the name is written to
+        name = name.replace(',', '').replace("'", '')
+        if not name:
+            _add_error(report, row_number, 'Attendee name is missing.')
+            continue
+        if len(name) > MAX_NAME_LENGTH:
+            _add_error(report, row_number, f'Attendee name must not exceed {MAX_NAME_LENGTH} characters.')
+            continue
+        normalized = normalize_singapore_mobile(phone)
+        if normalized is None:
+            _add_error(report, row_number, f"'{phone}' is not a valid Singapore mobile number.")
+            continue
+        if normalized in seen_phones:
+            report['duplicates'] += 1
+            continue
+        seen_phones.add(normalized)
+        yield name, normalized
+
+
+def import_attendees(cursor, event_id, rows):
+    """
+    Validates attendee rows and inserts the valid ones into the attendee table in batches.
+
+    Args:
+        cursor (MySQLCursor): The cursor to insert with; the caller commits.
+        event_id (int): The ID of the event the attendees belong to.
+        rows (iterable): (row_number, name, phone) tuples as returned by `open_attendee_rows`.
+
+    Returns:
+        dict: The import report with the number of data rows read, attendees imported, duplicate and
+        invalid rows, and up to `attendee_import_max_errors` per-row errors.
+    """
+    report = new_import_report()
+    report['imported'] = insert_attendees(cursor, event_id, validate_attendees(rows, report))
+    return report
@@ -14,16 +14,129 @@ Content Overview:
 Blob Upload/Download: Functions to upload files to and download files from Azure Blob Storage.
 Blob Management: Additional functionality for managing blobs.
 
+The daily call status CSV files are stored as Append Blobs, so adding a row is a single constant-size
+`append_block` call instead of downloading and re-uploading the whole file. Daily files created before
+this change are Block Blobs. They are never modified: rows for such a file are appended to the Append Blob
+named by `legacy_append_name` (e.g. call_status_01_02_2024_append.csv), which db_update reads together with
+it. Leaving them in place means no writer ever deletes or re-creates a file another process may be writing.
+Note that an Append Blob accepts at most 50,000 blocks, so callers writing high volumes should batch several
+rows into one `append_to_blob` call.
+
 """
 
 
-from .config import container_name,blob_service_client
 import logging
+import os
 import threading
-
-# Define CSV file path and lock
+import time
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobType
+from .config import container_name,get_blob_service_client
+from .metrics import blob_append_seconds, blob_append_bytes
+
+# Maximum size of a single append_block call accepted by Azure (4 MiB).
+APPEND_BLOCK_MAX_BYTES = 4 * 1024 * 1024
+
+CSV_HEADER = ['GUID','eventID', 'Timestamp', 'Twilio Number', 'Recipient Number', 'Call Status',
+              'Response', 'Attendee Name', 'Event Date', 'Event Name','Event Summary','Event Time',
+              'Event Venue', 'Call Type']
+
+# Lock protecting the header creation / migration steps and the cache of known append blobs.
+# Plain appends do not take this lock: Azure serialises append_block calls on the server side, and every
+# block holds whole rows (see _chunks), so rows of concurrent writers never interleave.
 csv_lock = threading.Lock()
 
+# Names of blobs already known to exist as Append Blobs with their header written
+append_blobs_ready = set()
+
+# Legacy Block Blobs found by this process, mapped to the Append Blob receiving their rows
+legacy_blob_targets = {}
+
+
+def _chunks(data, size=APPEND_BLOCK_MAX_BYTES):
+    """
+    Splits the given CSV bytes into pieces no larger than the maximum append block size, each made of whole
+    rows. A newline inside a quoted field does not end a row.
+
+    Raises:
+    - ValueError: If a single row is larger than the maximum append block size.
+    """
+    if len(data) <= size:
+        return [data]
+    row_ends = []
+    quotes = 0
+    position = 0
+    while True:
+        newline = data.find(b'\n', position)
+        if newline == -1:
+            break
+        quotes += data.count(b'"', position, newline)
+        position = newline + 1
+        if quotes % 2 == 0:
+            row_ends.append(position)
+    if not row_ends or row_ends[-1] != len(data):
+        row_ends.append(len(data))
+
+    blocks = []
+    start = block_end = 0
+    for row_end in row_ends:
+        if row_end - start > size:
+            if block_end > start:
+                blocks.append(data[start:block_end])
+                start = block_end
+            if row_end - start > size:
+                raise ValueError(f"A row of {row_end - start} bytes exceeds the append block limit of {size} bytes")
+        block_end = row_end
+    blocks.append(data[start:block_end])
+    return blocks
+
+
+def _wait_for_header(blob_client, attempts=10, delay=0.05):
+    """
+    Waits briefly for another writer that has just created the append blob to write its header row.
+
+    Creating an Append Blob and writing its first block are two separate calls, so a second process
+    can observe the blob in between. Waiting for a non-empty blob keeps data rows behind the header.
+    """
+    for _ in range(attempts):
+        if blob_client.get_blob_properties().size > 0:
+            return
+        time.sleep(delay)
+
+
+def legacy_append_name(blob_name):
+    """
+    Returns the name of the Append Blob receiving the rows written to a legacy Block Blob.
+    """
+    root, extension = os.path.splitext(blob_name)
+    return f"{root}_append{extension}"
+
+
+def append_target(blob_name):
+    """
+    Returns the blob that rows written to `blob_name` are appended to.
+    """
+    return legacy_blob_targets.get(blob_name, blob_name)
+
+
+def _prepare_append_blob(blob_name):
+    """
+    Creates the Append Blob with its header row, or waits for the header of an existing one. Returns the
+    properties of the blob if it already existed. Must be called with `csv_lock` held.
+    """
+    blob_client = get_blob_service_client().get_blob_client(container=container_name, blob=blob_name)
+    try:
+        blob_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+        blob_client.append_block(','.join(CSV_HEADER) + '\n')
+        return None
+    except ResourceExistsError:
+        properties = blob_client.get_blob_properties()
+        if properties.blob_type == BlobType.AppendBlob:
+            _wait_for_header(blob_client)
+        return properties
+
+
 def write_csv_header(blob_name):
     """
     Writes a header row to a CSV file in Azure Blob Storage if the file does not already exist.
@@ -31,22 +144,30 @@ def write_csv_header(blob_name):
     Parameters:
     - blob_name (str): The name of the blob (file) in the Azure Blob Storage.
 
-    This function checks if the specified CSV file exists in the Azure Blob Storage. If it does not exist,
-    it writes a header row to the file. The header includes various fields related to event and call details.
+    This function creates the specified CSV file as an Append Blob and writes the header row as its
+    first block. The header includes various fields related to event and call details. If the file
+    already exists as a legacy Block Blob it is left untouched, and its rows go to the Append Blob named
+    by `legacy_append_name`, prepared the same way. Blobs that have been prepared once are remembered, so
+    subsequent calls do not touch the storage account.
 
     Locking is used to ensure thread safety when accessing the blob.
 
     Raises:
     - Logs any exceptions encountered during the process.
     """
+    if blob_name in append_blobs_ready:
+        return
     with csv_lock:
+        if blob_name in append_blobs_ready:
+            return
         try:
-            blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-            if not blob_client.exists():
-                header = ['GUID','eventID', 'Timestamp', 'Twilio Number', 'Recipient Number', 'Call Status', 
-                          'Response', 'Attendee Name', 'Event Date', 'Event Name','Event Summary','Event Time', 
-                          'Event Venue', 'Call Type']
-                blob_client.upload_blob(','.join(header) + '\n', overwrite=True)
+            properties = _prepare_append_blob(blob_name)
+            if properties is not None and properties.blob_type != BlobType.AppendBlob:
+                target = legacy_append_name(blob_name)
+                _prepare_append_blob(target)
+                legacy_blob_targets[blob_name] = target
+                logging.info(f"{blob_name} is a block blob; its new rows are appended to {target}.")
+            append_blobs_ready.add(blob_name)
         except Exception as e:
             logging.error(f"Error writing CSV header: {e}")
 
@@ -59,18 +180,43 @@ def append_to_blob(blob_name, data):
     - blob_name (str): The name of the blob (file) in the Azure Blob Storage.
     - data (str): The data to be appended to the blob.
 
-    This function reads the existing content of the blob, appends the new data, and writes the updated content
-    back to the blob. Thread safety is maintained using a lock.
+    Returns:
+    - bool: True if the data was appended, False otherwise.
+
+    This function writes the data as one or more blocks of whole rows at the end of the Append Blob, so the
+    cost of a call depends only on the size of `data`, not on the size of the file. If the blob turns out to be a
+    legacy Block Blob the data goes to its Append Blob (see write_csv_header); if it does not exist yet it
+    is created with the CSV header.
 
     Raises:
     - Logs any exceptions encountered during the process.
     """
-    with csv_lock:
+    started = time.perf_counter()
+    try:
+        blob_client = get_blob_service_client().get_blob_client(container=container_name,
+                                                                blob=append_target(blob_name))
+        payload = data.encode('utf-8') if isinstance(data, str) else data
+        blob_append_bytes.observe(len(payload))
+        # Split up front, so a row over the block limit fails the call before anything is written
+        blocks = _chunks(payload)
         try:
-            blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-            existing_data = blob_client.download_blob().readall().decode('utf-8') if blob_client.exists() else ''
-            updated_data = existing_data + data
-            blob_client.upload_blob(updated_data, overwrite=True)
-            logging.info(f"Data appended to Azure Blob Storage as {blob_name}.")
-        except Exception as e:
-            logging.error(f"Error appending to Azure Blob Storage: {e}")
+            for block in blocks:
+                blob_client.append_block(block)
+        except (ResourceNotFoundError, HttpResponseError) as e:
+            if isinstance(e, ResourceNotFoundError) or e.error_code == 'InvalidBlobType':
+                # The blob is missing or is a legacy Block Blob: prepare it and retry once.
+                append_blobs_ready.discard(blob_name)
+                write_csv_header(blob_name)
+                blob_client = get_blob_service_client().get_blob_client(container=container_name,
+                                                                        blob=append_target(blob_name))
+                for block in blocks:
+                    blob_client.append_block(block)
+            else:
+                raise
+        logging.info(f"Data appended to Azure Blob Storage as {blob_client.blob_name}.")
+        blob_append_seconds.observe(time.perf_counter() - started, outcome='success')
+        return True
+    except Exception as e:
+        logging.error(f"Error appending to Azure Blob Storage: {e}")
+        blob_append_seconds.observe(time.perf_counter() - started, outcome='error')
+        return False
@@ -0,0 +1,293 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+call_archive.py
+Description:
+Compacts the call event rows of closed days from CSV into Parquet, and answers per-event outcome counts over a
+date range from the Parquet files.
+
+Content Overview:
+Compaction: Every row of a closed day, from the partitioned call log and the daily CSV file, is written to
+`<prefix>event=<id>/date=<YYYY-MM-DD>/part-0.parquet`. The low-cardinality columns (call status, response,
+call type, event details) are dictionary encoded and the files are zstd compressed. The event name, summary,
+time and venue of the attendee rows are joined from the registration table (see db_update.fill_event_details).
+A day is marked done by `<prefix>_days/date=<YYYY-MM-DD>.json`, written last; the source CSV files are only
+deleted on request.
+Queries: `outcome_counts` reads the GUID, status, response and call type columns of one event's files in the
+range and counts its calls per outcome, with the same rules as the bucket tables of db_update.
+
+Scheduling: The leader of the blob update scheduler compacts the closed days (see scheduler.py). The command
+line below is for backfills and for deleting the source CSV files, which the scheduler never does.
+
+Settings (see config.py): call_archive_prefix, call_archive_grace_days, call_archive_max_query_days and
+call_archive_download_workers. The archive needs `pyarrow`, which is optional: without it the rest of the
+application works, and compaction and queries raise a RuntimeError.
+
+Usage:
+    python -m app.call_archive [--delete-sources] [--max-days N]
+
+"""
+
+import argparse
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from io import BytesIO, StringIO
+import pandas as pd
+from azure.core.exceptions import ResourceNotFoundError
+from .blob_operations import legacy_append_name
+from .call_log import PARTITION_PATTERN, partition_event, read_manifests
+from .db_connect import db_connection
+from .db_update import BUCKET_RULES, fill_event_details
+from .config import (container_name, get_blob_service_client, call_log_prefix, call_archive_prefix,
+                     call_archive_grace_days, call_archive_max_query_days, call_archive_download_workers)
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # The Parquet archive is optional
+    pa = pq = None
+
+# Columns of the archive files; the event is the partition
+ARCHIVE_COLUMNS = ['GUID', 'Timestamp', 'Twilio Number', 'Recipient Number', 'Call Status', 'Response',
+                   'Attendee Name', 'Event Date', 'Event Name', 'Event Summary', 'Event Time', 'Event Venue',
+                   'Call Type']
+DICTIONARY_COLUMNS = ['Twilio Number', 'Call Status', 'Response', 'Event Date', 'Event Name', 'Event Summary',
+                      'Event Time', 'Event Venue', 'Call Type']
+# Columns read by outcome queries
+QUERY_COLUMNS = ['GUID', 'Call Status', 'Response', 'Attendee Name', 'Call Type']
+
+DAILY_BLOB_PATTERN = re.compile(r'call_status_(\d{2})_(\d{2})_(\d{4})\.csv$')
+MANIFEST_DATE_PATTERN = re.compile(re.escape(call_log_prefix) + r'_manifests/date=(\d{4}-\d{2}-\d{2})/')
+DAY_MARKER_PATTERN = re.compile(re.escape(call_archive_prefix) + r'_days/date=(\d{4}-\d{2}-\d{2})\.json$')
+
+
+def require_pyarrow():
+    if pq is None:
+        raise RuntimeError("The call archive needs pyarrow; install it with `pip install pyarrow`")
+
+
+def archive_blob_name(event, day):
+    return f"{call_archive_prefix}event={event}/date={day}/part-0.parquet"
+
+
+def day_marker_name(day):
+    return f"{call_archive_prefix}_days/date={day}.json"
+
+
+def daily_blob_name(day):
+    """
+    Returns the name of the daily CSV file of a day (YYYY-MM-DD) in the daily layout.
+    """
+    return f"call_status_{datetime.strptime(day, '%Y-%m-%d').strftime('%d_%m_%Y')}.csv"
+
+
+def list_days(container):
+    """
+    Returns the days with call log data and the days already archived, as two sets of YYYY-MM-DD strings.
+    """
+    days = set()
+    for properties in container.list_blobs(name_starts_with=f"{call_log_prefix}_manifests/"):
+        match = MANIFEST_DATE_PATTERN.match(properties.name)
+        if match:
+            days.add(match.group(1))
+    for properties in container.list_blobs(name_starts_with='call_status_'):
+        match = DAILY_BLOB_PATTERN.match(properties.name)
+        if match:
+            day_of_month, month, year = match.groups()
+            days.add(f"{year}-{month}-{day_of_month}")
+    archived = set()
+    for properties in container.list_blobs(name_starts_with=f"{call_archive_prefix}_days/"):
+        match = DAY_MARKER_PATTERN.match(properties.name)
+        if match:
+            archived.add(match.group(1))
+    return days, archived
+
+
+def read_day_rows(container, day):
+    """
+    Reads every call event row of a day.
+
+    Returns:
+        tuple: (DataFrame of the rows with an `event` column, list of the source blob names, total source bytes).
+    """
+    sources = list(read_manifests(day, {})['parts'])
+    for blob_name in (daily_blob_name(day), legacy_append_name(daily_blob_name(day))):
+        try:
+            container.get_blob_client(blob_name).get_blob_properties()
+            sources.append(blob_name)
+        except ResourceNotFoundError:
+            pass
+
+    frames = []
+    source_bytes = 0
+    for blob_name in sources:
+        raw = container.get_blob_client(blob_name).download_blob().readall()
+        source_bytes += len(raw)
+        frame = pd.read_csv(StringIO(raw.decode('utf-8')), dtype=str, index_col=False, on_bad_lines='warn')
+        match = PARTITION_PATTERN.match(blob_name)
+        frame['event'] = match.group('event') if match else None
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=ARCHIVE_COLUMNS + ['eventID', 'event']), sources, source_bytes
+    return pd.concat(frames, ignore_index=True), sources, source_bytes
+
+
+def assign_events(df):
+    """
+    Sets the `event` of every row: the event of its part, else its eventID, else the event of another row
+    of the same call (status rows of the daily file carry no eventID), else 'unknown'. EventIDs read from
+    the daily files are sanitized like the event of a part, as they become part of a blob name.
+    """
+    event = df['event'].where(df['event'].notna() & (df['event'] != 'unknown'), df['eventID'])
+    by_guid = pd.Series(event.values, index=df['GUID']).dropna()
+    by_guid = by_guid[~by_guid.index.duplicated()]
+    event = event.fillna(df['GUID'].map(by_guid))
+    df['event'] = event.fillna('unknown').map(partition_event)
+    return df
+
+
+def write_archive_file(container, event, day, rows):
+    """
+    Writes the rows of one event and day as a Parquet file and returns its size in bytes.
+    """
+    rows = rows.reindex(columns=ARCHIVE_COLUMNS)
+    rows['Timestamp'] = pd.to_datetime(rows['Timestamp'], errors='coerce')
+    table = pa.Table.from_pandas(rows, preserve_index=False)
+    sink = BytesIO()
+    pq.write_table(table, sink, compression='zstd', use_dictionary=DICTIONARY_COLUMNS)
+    data = sink.getvalue()
+    container.get_blob_client(archive_blob_name(event, day)).upload_blob(data, overwrite=True)
+    return len(data)
+
+
+def compact_day(container, day, delete_sources=False):
+    """
+    Archives one day: writes one Parquet file per event, then the day marker, then optionally deletes the
+    source CSV files and the day's manifests.
+
+    Returns:
+        dict: The summary stored in the day marker.
+    """
+    require_pyarrow()
+    df, sources, source_bytes = read_day_rows(container, day)
+    df = assign_events(df)
+    with db_connection() as conn:
+        fill_event_details(conn, df, df['Attendee Name'].notna())
+    archive_bytes = 0
+    events = []
+    for event, rows in df.groupby('event', sort=True):
+        archive_bytes += write_archive_file(container, event, day, rows)
+        events.append(event)
+
+    summary = {
+        'date': day,
+        'events': events,
+        'rows': len(df),
+        'sources': sources,
+        'source_bytes': source_bytes,
+        'archive_bytes': archive_bytes,
+        'compacted_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    container.get_blob_client(day_marker_name(day)).upload_blob(json.dumps(summary), overwrite=True)
+
+    if delete_sources:
+        manifests = [properties.name for properties in
+                     container.list_blobs(name_starts_with=f"{call_log_prefix}_manifests/date={day}/")]
+        for blob_name in sources + manifests:
+            container.get_blob_client(blob_name).delete_blob()
+    logging.info(f"Archived {day}: {len(df)} rows of {len(events)} events, {source_bytes} -> {archive_bytes} bytes.")
+    return summary
+
+
+def compact_closed_days(delete_sources=False, max_days=None, today=None):
+    """
+    Archives every closed day that has not been archived yet, oldest first.
+
+    A day is closed once `call_archive_grace_days` full days have passed since it ended.
+
+    Args:
+        delete_sources (bool, optional): Delete the CSV files and manifests of a day once it is archived.
+        max_days (int, optional): Archive at most this many days in this run.
+        today (date, optional): The current date, for testing.
+
+    Returns:
+        list: The summaries of the archived days.
+    """
+    require_pyarrow()
+    container = get_blob_service_client().get_container_client(container_name)
+    last_closed = (today or date.today()) - timedelta(days=call_archive_grace_days + 1)
+    days, archived = list_days(container)
+    pending = sorted(day for day in days - archived if day <= last_closed.isoformat())
+    return [compact_day(container, day, delete_sources) for day in pending[:max_days]]
+
+
+def read_archive_file(container, event, day):
+    """
+    Returns the query columns of one archived event and day, or None if there is no such file.
+    """
+    try:
+        data = container.get_blob_client(archive_blob_name(event, day)).download_blob().readall()
+    except ResourceNotFoundError:
+        return None
+    return pq.read_table(BytesIO(data), columns=QUERY_COLUMNS).to_pandas()
+
+
+def outcome_counts(event_id, start, end):
+    """
+    Counts the calls of an event per outcome over a range of archived days.
+
+    A call counts once per outcome, and only if its attendee row (the row written when it was placed) is in
+    the range, as in the bucket tables of db_update. Days that are not archived yet are not included.
+
+    Args:
+        event_id: The event.
+        start (date): First day of the range.
+        end (date): Last day of the range, inclusive.
+
+    Returns:
+        dict: 'event_id', 'start', 'end', 'days' (archived days found), 'calls' and 'outcomes' (label -> calls).
+
+    Raises:
+        ValueError: If the range is empty or longer than `call_archive_max_query_days`.
+    """
+    require_pyarrow()
+    days = (end - start).days + 1
+    if days < 1 or days > call_archive_max_query_days:
+        raise ValueError(f"The date range must cover 1 to {call_archive_max_query_days} days")
+
+    container = get_blob_service_client().get_container_client(container_name)
+    event = partition_event(event_id)
+    dates = [(start + timedelta(days=offset)).isoformat() for offset in range(days)]
+    with ThreadPoolExecutor(max_workers=call_archive_download_workers) as executor:
+        frames = [frame for frame in executor.map(lambda day: read_archive_file(container, event, day), dates)
+                  if frame is not None]
+
+    result = {'event_id': event, 'start': start.isoformat(), 'end': end.isoformat(), 'days': len(frames),
+              'calls': 0, 'outcomes': {label: 0 for _, _, _, label in BUCKET_RULES}}
+    if not frames:
+        return result
+    df = pd.concat(frames, ignore_index=True)
+    called = set(df.loc[df['Attendee Name'].notna(), 'GUID'])
+    result['calls'] = len(called)
+    for _, column, value, label in BUCKET_RULES:
+        marked = df.loc[df[column] == value, 'GUID']
+        result['outcomes'][label] = int(marked[marked.isin(called)].nunique())
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compacts closed days of the call log into Parquet.")
+    parser.add_argument('--delete-sources', action='store_true', help="Delete the CSV files of archived days.")
+    parser.add_argument('--max-days', type=int, help="Archive at most this many days.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    for summary in compact_closed_days(args.delete_sources, args.max_days):
+        print(json.dumps(summary))
@@ -0,0 +1,203 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+call_log.py
+Description:
+Names the blobs the call event rows are written to, and keeps the manifests that tell db_update which of them
+have changed. This is the only place that knows the layout of the call event log.
+
+Content Overview:
+Partitions: Rows are written to `<prefix>event=<id>/date=<YYYY-MM-DD>/hour=<HH>/part-<worker>.csv`. Each
+writer process has its own part per event and hour, so writers never append to the same blob, and a busy
+event does not grow the blob that other events are read from.
+Manifests: Every writer process keeps `<prefix>_manifests/date=<YYYY-MM-DD>/part-<worker>.json`, listing
+the parts it wrote that day with the number of bytes written to each. db_update lists the day's manifests
+(one per writer), and reads only the parts whose byte count changed since its last run.
+Daily Files: With call_log_layout = 'daily' every row goes to the single call_status_DD_MM_YYYY.csv of
+earlier releases; db_update still ingests those files.
+
+Settings (see config.py): call_log_layout and call_log_prefix.
+
+"""
+
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import uuid
+from datetime import datetime
+from .config import call_log_layout, call_log_prefix, container_name, get_blob_service_client
+
+PARTITION_PATTERN = re.compile(re.escape(call_log_prefix) +
+                               r'event=(?P<event>[^/]+)/date=(?P<date>\d{4}-\d{2}-\d{2})/hour=\d{2}/part-[^/]+\.csv$')
+
+# Bytes written by this process per part, by date, as published in its manifests
+written_parts = {}
+written_lock = threading.Lock()
+# Per date: version of written_parts, version last uploaded, and the lock serialising the uploads
+manifest_versions = {}
+uploaded_versions = {}
+manifest_locks = {}
+
+_worker = None
+_worker_pid = None
+
+
+def worker_id():
+    """
+    Returns the name of this writer process, unique across hosts, processes and restarts.
+    """
+    global _worker, _worker_pid
+    if _worker_pid != os.getpid():
+        host = re.sub(r'[^A-Za-z0-9-]', '-', socket.gethostname())[:40]
+        _worker = f"{host}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        _worker_pid = os.getpid()
+    return _worker
+
+
+def get_current_csv_blob_name():
+    """
+    Generates the blob name for the current date's CSV file of the daily layout.
+
+    Returns:
+    - str: The name of the CSV file, formatted as 'call_status_DD_MM_YYYY.csv'.
+    """
+    date_str = datetime.now().strftime('%d_%m_%Y')
+    return f'call_status_{date_str}.csv'
+
+
+def partition_event(event_id):
+    """
+    Returns the name of an event as used in blob names: characters other than letters, digits, '_' and '-'
+    are replaced by '_', and a missing event is 'unknown'.
+    """
+    if event_id in (None, ''):
+        return 'unknown'
+    return re.sub(r'[^A-Za-z0-9_-]', '_', str(event_id).strip())
+
+
+def partition_blob_name(event_id, when=None):
+    """
+    Returns the blob a call event row of the given event is written to.
+
+    Args:
+        event_id: The event the call belongs to; rows without one go to the 'unknown' event.
+        when (datetime, optional): The time of the row. Defaults to now.
+
+    Returns:
+        str: The part of this process for the event and hour, or the daily file with the daily layout.
+    """
+    if call_log_layout == 'daily':
+        return get_current_csv_blob_name()
+    when = when or datetime.now()
+    event = partition_event(event_id)
+    return (f"{call_log_prefix}event={event}/date={when.strftime('%Y-%m-%d')}/hour={when.strftime('%H')}/"
+            f"part-{worker_id()}.csv")
+
+
+def partition_group(blob_name):
+    """
+    Returns the event and date prefix of a part (`<prefix>event=<id>/date=<d>`), or None for other blobs.
+
+    The parts of a group are ingested together, because the rows of one call may be spread over several
+    hours and writers.
+    """
+    match = PARTITION_PATTERN.match(blob_name)
+    if not match:
+        return None
+    return f"{call_log_prefix}event={match.group('event')}/date={match.group('date')}"
+
+
+def manifest_prefix(date):
+    return f"{call_log_prefix}_manifests/date={date}/"
+
+
+def record_appends(appended):
+    """
+    Adds appended byte counts to this process's manifests and uploads the manifests of the affected days.
+
+    Called by the event journal after rows have been appended, from the flusher thread and from threads
+    writing synchronously. The uploads of a day are serialised and each uploads the day's latest counts,
+    so an older manifest never overwrites a newer one; an upload already covered by a newer one is skipped.
+    Only the two most recent days are kept in memory, enough for the final pass db_update makes over the
+    previous day.
+
+    Args:
+        appended (dict): Blob name -> number of bytes appended. Blobs that are not parts are ignored.
+
+    Returns:
+        bool: True if the manifests were written (or there was nothing to write).
+    """
+    dates = set()
+    with written_lock:
+        for blob_name, size in appended.items():
+            match = PARTITION_PATTERN.match(blob_name)
+            if not match:
+                continue
+            date = match.group('date')
+            parts = written_parts.setdefault(date, {})
+            parts[blob_name] = parts.get(blob_name, 0) + size
+            manifest_versions[date] = manifest_versions.get(date, 0) + 1
+            manifest_locks.setdefault(date, threading.Lock())
+            dates.add(date)
+        for date in sorted(written_parts)[:-2]:
+            del written_parts[date]
+            manifest_versions.pop(date, None)
+            uploaded_versions.pop(date, None)
+            manifest_locks.pop(date, None)
+        locks = {date: manifest_locks[date] for date in dates if date in written_parts}
+
+    ok = True
+    for date, lock in sorted(locks.items()):
+        name = f"{manifest_prefix(date)}part-{worker_id()}.json"
+        with lock:
+            with written_lock:
+                if date not in written_parts or uploaded_versions.get(date, 0) >= manifest_versions[date]:
+                    continue
+                version = manifest_versions[date]
+                parts = dict(written_parts[date])
+            try:
+                blob_client = get_blob_service_client().get_blob_client(container=container_name, blob=name)
+                blob_client.upload_blob(json.dumps({'worker': worker_id(), 'date': date, 'parts': parts}),
+                                        overwrite=True)
+                with written_lock:
+                    if date in written_parts:
+                        uploaded_versions[date] = version
+            except Exception as e:
+                logging.error(f"Error writing call log manifest {name}: {e}")
+                ok = False
+    return ok
+
+
+def read_manifests(date, known):
+    """
+    Returns the parts written on a day according to the writers' manifests.
+
+    Only manifests whose ETag changed since the last call are downloaded.
+
+    Args:
+        date (str): The day, as YYYY-MM-DD.
+        known (dict): 'etags' (manifest name -> ETag) and 'parts' (part name -> bytes written) from the
+            previous call, or empty dicts.
+
+    Returns:
+        dict: The updated 'etags' and 'parts'.
+    """
+    etags = dict(known.get('etags') or {})
+    parts = dict(known.get('parts') or {})
+    container = get_blob_service_client().get_container_client(container_name)
+    for properties in container.list_blobs(name_starts_with=manifest_prefix(date)):
+        if etags.get(properties.name) == properties.etag:
+            continue
+        blob_client = container.get_blob_client(properties.name)
+        manifest = json.loads(blob_client.download_blob().readall())
+        parts.update(manifest.get('parts') or {})
+        etags[properties.name] = properties.etag
+    return {'etags': etags, 'parts': parts}
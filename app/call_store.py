@@ -0,0 +1,325 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+call_store.py
+Description:
+Stores the mapping from Twilio Call SID to the GUID generated for each call, and the context of each call
+(attendee and event details) by GUID. Both have to be visible to every worker process, because Twilio's
+webhooks for a call can land on any of them.
+
+Content Overview:
+Local Cache: An in-process LRU cache with a time-to-live in front of the shared tier.
+Shared Tier: Pluggable backends keeping the mapping in MySQL (shared by all hosts), SQLite (shared by the
+worker processes of one host) or nowhere (memory only, single process).
+Expiry: Mappings expire after call_store_ttl_seconds, or call_store_completed_ttl_seconds after the call completed.
+Call Context: The details a call was placed with, stored as JSON under its GUID, so webhook URLs only carry the GUID.
+
+Settings (see config.py): call_store_backend, call_store_sqlite_path, call_store_cache_size,
+call_store_ttl_seconds, call_store_completed_ttl_seconds, call_guid_table and call_context_table.
+
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from .db_connect import get_db_connection
+from .config import (call_store_backend, call_store_sqlite_path, call_store_cache_size, call_store_ttl_seconds,
+                     call_store_completed_ttl_seconds, call_guid_table, call_context_table)
+
+# Minimum number of seconds between two purges of expired rows from the shared tier
+PURGE_INTERVAL_SECONDS = 300
+
+
+class MemoryBackend:
+    """
+    Backend without a shared tier: mappings only live in the local cache of the current process.
+    """
+
+    def get(self, call_sid, now):
+        return None
+
+    def set(self, call_sid, guid, expires_at):
+        pass
+
+    def expire(self, call_sid, expires_at):
+        pass
+
+    def purge(self, now):
+        pass
+
+
+class SQLiteBackend:
+    """
+    Backend keeping the mappings in a SQLite database file shared by the worker processes of one host.
+
+    Args:
+        path (str): Path of the SQLite database file.
+        table (str): Name of the table holding the mappings.
+        key_column (str): Name of the key column.
+        value_column (str): Name of the value column.
+    """
+
+    def __init__(self, path, table=call_guid_table, key_column='CallSid', value_column='GUID'):
+        self.path = path
+        self.table = table
+        self.key_column = key_column
+        self.value_column = value_column
+        self.local = threading.local()
+
+    def _connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {self.table} (
+                    {self.key_column} TEXT PRIMARY KEY,
+                    {self.value_column} TEXT NOT NULL,
+                    expires_at INTEGER NOT NULL
+                )
+            ''')
+            conn.execute(f'CREATE INDEX IF NOT EXISTS idx_{self.table}_expires_at ON {self.table} (expires_at)')
+            self.local.conn = conn
+        return conn
+
+    def get(self, call_sid, now):
+        row = self._connection().execute(
+            f'SELECT {self.value_column}, expires_at FROM {self.table} WHERE {self.key_column} = ? AND expires_at >= ?',
+            (call_sid, now)
+        ).fetchone()
+        return row
+
+    def set(self, call_sid, guid, expires_at):
+        self._connection().execute(
+            f'INSERT OR REPLACE INTO {self.table} ({self.key_column}, {self.value_column}, expires_at) VALUES (?, ?, ?)',
+            (call_sid, guid, expires_at)
+        )
+
+    def expire(self, call_sid, expires_at):
+        self._connection().execute(
+            f'UPDATE {self.table} SET expires_at = MIN(expires_at, ?) WHERE {self.key_column} = ?', (expires_at, call_sid)
+        )
+
+    def purge(self, now):
+        self._connection().execute(f'DELETE FROM {self.table} WHERE expires_at < ?', (now,))
+
+
+class MySQLBackend:
+    """
+    Backend keeping the mappings in the application's MySQL database, shared by every host and worker.
+
+    Args:
+        table (str): Name of the table holding the mappings.
+        key_column (str): Name of the key column.
+        value_column (str): Name of the value column.
+        key_type (str): SQL type of the key column.
+        value_type (str): SQL type of the value column.
+    """
+
+    def __init__(self, table=call_guid_table, key_column='CallSid', value_column='GUID',
+                 key_type='VARCHAR(64)', value_type='VARCHAR(36)'):
+        self.table = table
+        self.key_column = key_column
+        self.value_column = value_column
+        self.key_type = key_type
+        self.value_type = value_type
+        self.table_ready = False
+
+    def _execute(self, query, params=(), fetch=False):
+        conn = get_db_connection()
+        if conn is None:
+            raise RuntimeError("Could not establish a connection to the database")
+        try:
+            cursor = conn.cursor()
+            if not self.table_ready:
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {self.table} (
+                        {self.key_column} {self.key_type} PRIMARY KEY,
+                        {self.value_column} {self.value_type} NOT NULL,
+                        expires_at BIGINT NOT NULL,
+                        INDEX idx_expires_at (expires_at)
+                    )
+                ''')
+                self.table_ready = True
+            cursor.execute(query, params)
+            result = cursor.fetchone() if fetch else None
+            conn.commit()
+            cursor.close()
+            return result
+        finally:
+            conn.close()
+
+    def get(self, call_sid, now):
+        return self._execute(
+            f'SELECT {self.value_column}, expires_at FROM {self.table} WHERE {self.key_column} = %s AND expires_at >= %s',
+            (call_sid, now), fetch=True
+        )
+
+    def set(self, call_sid, guid, expires_at):
+        self._execute(
+            f'''INSERT INTO {self.table} ({self.key_column}, {self.value_column}, expires_at) VALUES (%s, %s, %s)
+                ON DUPLICATE KEY UPDATE {self.value_column} = VALUES({self.value_column}), expires_at = VALUES(expires_at)''',
+            (call_sid, guid, expires_at)
+        )
+
+    def expire(self, call_sid, expires_at):
+        self._execute(
+            f'UPDATE {self.table} SET expires_at = LEAST(expires_at, %s) WHERE {self.key_column} = %s', (expires_at, call_sid)
+        )
+
+    def purge(self, now):
+        self._execute(f'DELETE FROM {self.table} WHERE expires_at < %s', (now,))
+
+
+class CallGuidStore:
+    """
+    Mapping of Call SID to GUID with an LRU/TTL cache in front of a shared backend.
+
+    Supports the dict-style `get` and item assignment used by the views, so it can stand in for a plain dict.
+
+    Args:
+        backend: The shared tier (MemoryBackend, SQLiteBackend or MySQLBackend).
+        max_entries (int): Maximum number of mappings kept in the local cache.
+        ttl (int): Lifetime of a mapping in seconds.
+        completed_ttl (int): Remaining lifetime of a mapping once its call has completed.
+        encode (callable, optional): Converts a value to the string stored in the shared tier.
+        decode (callable, optional): Converts a string read from the shared tier back to a value.
+    """
+
+    def __init__(self, backend, max_entries, ttl, completed_ttl, encode=None, decode=None):
+        self.backend = backend
+        self.encode = encode or (lambda value: value)
+        self.decode = decode or (lambda value: value)
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.completed_ttl = completed_ttl
+        self.cache = OrderedDict()  # call_sid -> (guid, expires_at)
+        self.lock = threading.Lock()
+        self.last_purge = 0
+
+    def _cache_put(self, call_sid, guid, expires_at):
+        with self.lock:
+            self.cache[call_sid] = (guid, expires_at)
+            self.cache.move_to_end(call_sid)
+            while len(self.cache) > self.max_entries:
+                self.cache.popitem(last=False)
+
+    def get(self, call_sid, default=None):
+        """
+        Returns the GUID of a call, looking in the local cache first and then in the shared tier.
+
+        Args:
+            call_sid (str): The Twilio Call SID.
+            default: Value returned when no live mapping exists.
+
+        Returns:
+            str: The GUID of the call, or `default`.
+        """
+        if not call_sid:
+            return default
+        now = int(time.time())
+        with self.lock:
+            entry = self.cache.get(call_sid)
+            if entry is not None:
+                if entry[1] >= now:
+                    self.cache.move_to_end(call_sid)
+                    return entry[0]
+                del self.cache[call_sid]
+        try:
+            row = self.backend.get(call_sid, now)
+        except Exception as e:
+            logging.error(f"Error reading call GUID mapping for {call_sid}: {e}")
+            return default
+        if row is None:
+            return default
+        value = self.decode(row[0])
+        self._cache_put(call_sid, value, row[1])
+        return value
+
+    def __setitem__(self, call_sid, guid):
+        """
+        Stores the GUID of a new call in the local cache and the shared tier.
+        """
+        now = int(time.time())
+        expires_at = now + self.ttl
+        self._cache_put(call_sid, guid, expires_at)
+        try:
+            self.backend.set(call_sid, self.encode(guid), expires_at)
+            if now - self.last_purge >= PURGE_INTERVAL_SECONDS:
+                self.last_purge = now
+                self.backend.purge(now)
+        except Exception as e:
+            logging.error(f"Error storing call GUID mapping for {call_sid}: {e}")
+
+    def mark_completed(self, call_sid):
+        """
+        Shortens the lifetime of a mapping once its call has completed.
+
+        The mapping is kept for `completed_ttl` seconds so that late or retried callbacks still resolve.
+        """
+        expires_at = int(time.time()) + self.completed_ttl
+        with self.lock:
+            entry = self.cache.get(call_sid)
+            if entry is not None:
+                self.cache[call_sid] = (entry[0], min(entry[1], expires_at))
+        try:
+            self.backend.expire(call_sid, expires_at)
+        except Exception as e:
+            logging.error(f"Error expiring call GUID mapping for {call_sid}: {e}")
+
+
+def create_backend(name, table=call_guid_table, key_column='CallSid', value_column='GUID', value_type='VARCHAR(36)'):
+    """
+    Creates the shared tier named in the configuration.
+
+    Args:
+        name (str): 'memory', 'sqlite' or 'mysql'.
+        table (str, optional): Table holding the mappings. Defaults to the CallSid -> GUID table.
+        key_column (str, optional): Name of the key column.
+        value_column (str, optional): Name of the value column.
+        value_type (str, optional): MySQL type of the value column.
+
+    Returns:
+        The backend instance.
+    """
+    if name == 'memory':
+        return MemoryBackend()
+    if name == 'sqlite':
+        return SQLiteBackend(call_store_sqlite_path, table, key_column, value_column)
+    if name == 'mysql':
+        return MySQLBackend(table, key_column, value_column, value_type=value_type)
+    raise ValueError(f"Unknown call store backend: {name}")
+
+
+call_guid_map = CallGuidStore(create_backend(call_store_backend), call_store_cache_size,
+                              call_store_ttl_seconds, call_store_completed_ttl_seconds)
+
+call_context_map = CallGuidStore(create_backend(call_store_backend, call_context_table, 'GUID', 'Context', 'TEXT'),
+                                 call_store_cache_size, call_store_ttl_seconds, call_store_completed_ttl_seconds,
+                                 encode=json.dumps, decode=json.loads)
+
+
+def save_call_context(guid, context):
+    """
+    Stores the context of a new call under its GUID.
+
+    Args:
+        guid (str): The GUID of the call.
+        context (dict): The attendee and event details of the call (JSON-serializable).
+    """
+    call_context_map[guid] = context
+
+
+def get_call_context(guid):
+    """
+    Returns the context stored for a call, or None if it is unknown or expired.
+    """
+    return call_context_map.get(guid)
@@ -13,15 +13,23 @@ Contains configuration settings for the application. This module centralizes set
 Content Overview:
 Configuration Variables: Settings for the Flask app, database, and other services.
 Environment Management: Different configurations for development, testing, and production environments.
+Secrets: Read lazily from Azure Key Vault (or from the environment in local mode) when first used, never at
+import, and cached for secret_cache_ttl_seconds. Only one thread fetches a given secret at a time.
 
 """
 
 from dotenv import load_dotenv
+import json
+import logging
 import os
-from azure.identity import ClientSecretCredential
-from azure.keyvault.secrets import SecretClient
-from twilio.rest import Client
-from azure.storage.blob import BlobServiceClient
+import tempfile
+import threading
+import time
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:  # The encrypted secret cache is optional
+    Fernet = None
 
 # Azure Key vault connections
 load_dotenv()
@@ -30,58 +38,213 @@ tenant_ID=os.getenv('Azure_tenant_ID')
 client_secret=os.getenv('Azure_client_secret')
 vault_url=os.getenv('Azure_vault')
 
-credential = ClientSecretCredential(client_id=client_ID,
-                                    client_secret=client_secret,
-                                    tenant_id=tenant_ID)
-secret_client = SecretClient(vault_url=vault_url, credential=credential)
+# Where secrets come from: 'keyvault' (Azure Key Vault) or 'env' (local/stub mode, values taken from
+# SECRET_<NAME> environment variables or the .env file, e.g. SECRET_TWILIOAUTHTOKEN)
+secret_source = os.getenv('CALLBOT_SECRET_SOURCE', 'keyvault')
+secret_cache_ttl_seconds = int(os.getenv('SECRET_CACHE_TTL_SECONDS', '3600'))
+# Optional encrypted on-disk cache of the secrets, shared by worker processes (needs `cryptography`)
+secret_cache_file = os.getenv('SECRET_CACHE_FILE')
+secret_cache_key = os.getenv('SECRET_CACHE_KEY')
 
-# Twilio credentials
-# secret_name = "twilioaccountsid1"
-account_sid = secret_client.get_secret("twilioaccountsid1").value
+secret_cache = {}  # name -> (value, fetched_at)
+secret_lock = threading.Lock()
+# One lock per secret name, held while the secret is fetched, so an expired secret is fetched only once
+secret_fetch_locks = {}
+secret_cache_file_loaded = False
+secret_client = None
+shared_clients = {}
+clients_lock = threading.Lock()
 
 
-# secret_name='twilioauthtoken'
-auth_token = secret_client.get_secret('twilioauthtoken').value
+def get_secret_client():
+    """
+    Returns the Key Vault client, creating it on first use.
+    """
+    global secret_client
+    with secret_lock:
+        if secret_client is None:
+            from azure.identity import ClientSecretCredential
+            from azure.keyvault.secrets import SecretClient
+            credential = ClientSecretCredential(client_id=client_ID,
+                                                client_secret=client_secret,
+                                                tenant_id=tenant_ID)
+            secret_client = SecretClient(vault_url=vault_url, credential=credential)
+        return secret_client
 
 
-app_secretkey=secret_client.get_secret("appsecretkey").value
+def load_secret_cache_file():
+    """
+    Loads unexpired secrets from the encrypted cache file into the in-memory cache, once per process.
+    """
+    global secret_cache_file_loaded
+    with secret_lock:
+        if secret_cache_file_loaded:
+            return
+        secret_cache_file_loaded = True
+    if not (secret_cache_file and secret_cache_key and Fernet) or not os.path.exists(secret_cache_file):
+        return
+    try:
+        with open(secret_cache_file, 'rb') as f:
+            cached = json.loads(Fernet(secret_cache_key).decrypt(f.read()))
+        now = time.time()
+        with secret_lock:
+            for name, (value, fetched_at) in cached.items():
+                if now - fetched_at < secret_cache_ttl_seconds and name not in secret_cache:
+                    secret_cache[name] = (value, fetched_at)
+    except (InvalidToken, ValueError, OSError) as e:
+        logging.warning(f"Ignoring unreadable secret cache file {secret_cache_file}: {e}")
 
-init_AppConfig=secret_client.get_secret("initAppConfig").value
 
-# Azure Blob Storage credentials
-connect_str = secret_client.get_secret('connectstrblob').value
-container_name = "opengovchatbot"
+def save_secret_cache_file():
+    """
+    Writes the in-memory secret cache to the encrypted cache file, if one is configured.
+    """
+    if not (secret_cache_file and secret_cache_key and Fernet):
+        return
+    try:
+        with secret_lock:
+            payload = json.dumps(secret_cache).encode('utf-8')
+        tmp_path = f"{secret_cache_file}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(Fernet(secret_cache_key).encrypt(payload))
+        os.replace(tmp_path, secret_cache_file)
+    except OSError as e:
+        logging.warning(f"Could not write secret cache file {secret_cache_file}: {e}")
 
-client = Client(account_sid, auth_token)
-blob_service_client = BlobServiceClient.from_connection_string(connect_str)
 
+def fetch_secret(name):
+    """
+    Reads a secret from its source, bypassing the cache.
+    """
+    if secret_source == 'env':
+        env_name = f"SECRET_{name.upper()}"
+        value = os.getenv(env_name)
+        if value is None:
+            raise KeyError(f"Secret {name} is not configured; set {env_name}")
+        return value
+    return get_secret_client().get_secret(name).value
 
-# MySQL database credentials
-config = {
-    'host': secret_client.get_secret('dburl').value,
-    'user': secret_client.get_secret('dbuser').value,
-    'password': secret_client.get_secret('dbpassword').value,
-    'database': 'ogapp'
-    }
 
-# Twilio credentials
-twilio_number = '+13202722061'
+def _cached_secret(name):
+    with secret_lock:
+        cached = secret_cache.get(name)
+    if cached and time.time() - cached[1] < secret_cache_ttl_seconds:
+        return cached[0]
+    return None
+
+
+def get_secret(name):
+    """
+    Returns the value of a secret, fetching it on first use and caching it for `secret_cache_ttl_seconds`.
+
+    The first call of a process also loads the encrypted cache file, if one is configured. When a secret is
+    missing or expired, one thread fetches it while the others wait for that fetch instead of repeating it.
+
+    Args:
+        name (str): The Key Vault secret name.
+
+    Returns:
+        str: The secret value.
+    """
+    load_secret_cache_file()
+    value = _cached_secret(name)
+    if value is not None:
+        return value
+    with secret_lock:
+        fetch_lock = secret_fetch_locks.setdefault(name, threading.Lock())
+    with fetch_lock:
+        value = _cached_secret(name)
+        if value is not None:
+            return value
+        value = fetch_secret(name)
+        with secret_lock:
+            secret_cache[name] = (value, time.time())
+    save_secret_cache_file()
+    return value
+
+
+def get_twilio_client():
+    """
+    Returns the shared Twilio REST client, creating it on first use.
+    """
+    with clients_lock:
+        if 'twilio' not in shared_clients:
+            from twilio.rest import Client
+            shared_clients['twilio'] = Client(get_secret('twilioaccountsid1'), get_secret('twilioauthtoken'))
+        return shared_clients['twilio']
+
+
+def get_blob_service_client():
+    """
+    Returns the shared Azure BlobServiceClient, creating it on first use.
+    """
+    with clients_lock:
+        if 'blob' not in shared_clients:
+            from azure.storage.blob import BlobServiceClient
+            shared_clients['blob'] = BlobServiceClient.from_connection_string(get_secret('connectstrblob'))
+        return shared_clients['blob']
+
+
+def get_db_config():
+    """
+    Returns the MySQL connection settings.
+    """
+    return {
+        'host': get_secret('dburl'),
+        'user': get_secret('dbuser'),
+        'password': get_secret('dbpassword'),
+        'database': 'ogapp'
+        }
+
+
+def get_base_url():
+    """
+    Returns the public base URL Twilio uses to reach the webhooks.
+    """
+    # Dev URL
+    # return 'https://a2f5-2401-4900-1cb9-157a-c92e-88b7-cf52-b03.ngrok-free.app'
+
+    # PROD URL
+    return get_secret('ProdURL')
+
 
-# Dev URL
-# ngrok_url = 'https://a2f5-2401-4900-1cb9-157a-c92e-88b7-cf52-b03.ngrok-free.app'
+# Names that used to be module attributes filled at import time. They are now resolved on first access.
+lazy_attributes = {
+    'account_sid': lambda: get_secret('twilioaccountsid1'),
+    'auth_token': lambda: get_secret('twilioauthtoken'),
+    'app_secretkey': lambda: get_secret('appsecretkey'),
+    'init_AppConfig': lambda: get_secret('initAppConfig'),
+    'connect_str': lambda: get_secret('connectstrblob'),
+    'client': get_twilio_client,
+    'blob_service_client': get_blob_service_client,
+    'config': get_db_config,
+    'ProdURL': get_base_url,
+    'ngrok_url': get_base_url,
+}
 
-# PROD URL
-ProdURL = secret_client.get_secret('ProdURL').value
-ngrok_url = ProdURL
+
+def __getattr__(name):
+    if name in lazy_attributes:
+        return lazy_attributes[name]()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+# Azure Blob Storage container
+container_name = "opengovchatbot"
+
+# Twilio credentials
+twilio_number = '+13202722061'
 
 # Voice change string
 voice_change = "Polly.Aditi"
 
 # Dev tables to handle the buckets
 registration_table="callbot_event_registration"
+attendee_table="callbot_event_attendee"
 
 # PROD tables to handle the buckets
 # registration_table="callbot_event_registration_PROD"
+# attendee_table="callbot_event_attendee_PROD"
 
 # Dev tables to handle the buckets
 table1="callbot_response_callback"
@@ -91,6 +254,14 @@ table4="callbot_response_declined_pickupdrop"
 table5="callbot_response_invalidoptioninput"
 table6="callbot_response_noanswer"
 table7="callbot_reminder_status"
+# Calls per event and outcome, maintained by db_update from the bucket tables
+summary_table="callbot_event_summary"
+# Ingestion state of db_update, shared by every process that may become the scheduler's leader: the watermark
+# of each call log blob read, the attendee rows by GUID, and the GUIDs whose response arrived before their
+# attendee row
+ingest_watermark_table="callbot_ingest_watermarks"
+ingest_attendee_table="callbot_ingest_attendees"
+ingest_pending_table="callbot_ingest_pending"
 
 # PROD tables to handle the buckets
 # table1="callbot_response_callback_PROD"
@@ -100,3 +271,95 @@ table7="callbot_reminder_status"
 # table5="callbot_response_invalidoptioninput_PROD"
 # table6="callbot_response_noanswer_PROD"
 # table7="callbot_reminder_status_PROD"
+# summary_table="callbot_event_summary_PROD"
+# ingest_watermark_table="callbot_ingest_watermarks_PROD"
+# ingest_attendee_table="callbot_ingest_attendees_PROD"
+# ingest_pending_table="callbot_ingest_pending_PROD"
+
+# Call event journal (buffered writer for the call status CSV)
+journal_batch_size = int(os.getenv('JOURNAL_BATCH_SIZE', '200'))
+journal_flush_interval_ms = int(os.getenv('JOURNAL_FLUSH_INTERVAL_MS', '500'))
+journal_queue_size = int(os.getenv('JOURNAL_QUEUE_SIZE', '10000'))
+journal_spill_dir = os.getenv('JOURNAL_SPILL_DIR', os.path.join(tempfile.gettempdir(), 'callbot_journal'))
+journal_fsync = os.getenv('JOURNAL_FSYNC', 'false').lower() == 'true'
+
+# Call event log layout: 'partitioned' (one CSV per event, hour and writer process, see call_log.py) or
+# 'daily' (the single call_status_DD_MM_YYYY.csv of earlier releases)
+call_log_layout = os.getenv('CALL_LOG_LAYOUT', 'partitioned')
+call_log_prefix = os.getenv('CALL_LOG_PREFIX', 'call_log/')
+
+# Parquet archive of closed days of call events (see call_archive.py, needs `pyarrow`)
+call_archive_prefix = os.getenv('CALL_ARCHIVE_PREFIX', 'call_archive/')
+# Days to wait after a day has ended before it is compacted, so late rows and the last db_update pass land first
+call_archive_grace_days = int(os.getenv('CALL_ARCHIVE_GRACE_DAYS', '1'))
+# Longest date range accepted by an outcome count query, and the number of archive files downloaded in parallel
+call_archive_max_query_days = int(os.getenv('CALL_ARCHIVE_MAX_QUERY_DAYS', '400'))
+call_archive_download_workers = int(os.getenv('CALL_ARCHIVE_DOWNLOAD_WORKERS', '8'))
+# Compaction by the blob update leader (see scheduler.py): seconds between checks for closed days, and the
+# most days compacted per check, so a backlog does not hold up db_update for long
+call_archive_enabled = os.getenv('CALL_ARCHIVE_ENABLED', 'true').lower() == 'true'
+call_archive_interval_seconds = float(os.getenv('CALL_ARCHIVE_INTERVAL_SECONDS', '3600'))
+call_archive_max_days_per_run = int(os.getenv('CALL_ARCHIVE_MAX_DAYS_PER_RUN', '7'))
+
+# Directory where every worker process writes its metrics, so /metrics reports all workers (see metrics.py);
+# unset keeps the metrics of each process to itself. Cleared by gunicorn when the server starts.
+metrics_dir = os.getenv('METRICS_DIR', '')
+# Seconds between the writes of a process's metrics to its file
+metrics_write_interval_seconds = float(os.getenv('METRICS_WRITE_INTERVAL_SECONDS', '5'))
+
+# Outbound dialer
+dialer_max_workers = int(os.getenv('DIALER_MAX_WORKERS', '8'))
+# Calls per second allowed on the Twilio account (Twilio's default is 1 CPS)
+twilio_calls_per_second = float(os.getenv('TWILIO_CALLS_PER_SECOND', '1'))
+dialer_job_retention_seconds = int(os.getenv('DIALER_JOB_RETENTION_SECONDS', '86400'))
+# Tables shared by the worker processes: the rate limit state, so the CPS limit holds for the whole account
+# and not per worker, and the progress of the dial jobs, so /dial_status works on any worker
+dial_rate_limit_table = "callbot_dial_rate_limit"
+dial_job_table = "callbot_dial_jobs"
+# Seconds between two writes of the progress of a running dial job to its table
+dial_job_save_interval_seconds = float(os.getenv('DIAL_JOB_SAVE_INTERVAL_SECONDS', '1'))
+
+# CallSid -> GUID mapping store: 'memory' (single process), 'sqlite' (single host) or 'mysql' (shared)
+call_store_backend = os.getenv('CALL_STORE_BACKEND', 'mysql')
+call_store_sqlite_path = os.getenv('CALL_STORE_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'callbot_call_store.db'))
+call_store_cache_size = int(os.getenv('CALL_STORE_CACHE_SIZE', '10000'))
+call_store_ttl_seconds = int(os.getenv('CALL_STORE_TTL_SECONDS', '86400'))
+call_store_completed_ttl_seconds = int(os.getenv('CALL_STORE_COMPLETED_TTL_SECONDS', '600'))
+call_guid_table = "callbot_call_guid_map"
+# GUID -> call context (attendee and event details), so webhook URLs only carry the GUID
+call_context_table = "callbot_call_context"
+
+# Change-triggered db_update runs: wait for this many quiet seconds, but no longer than the max delay
+blob_update_debounce_seconds = float(os.getenv('BLOB_UPDATE_DEBOUNCE_SECONDS', '5'))
+blob_update_max_delay_seconds = float(os.getenv('BLOB_UPDATE_MAX_DELAY_SECONDS', '30'))
+
+# Scheduled db_update runs: interval, +/- jitter fraction and the longest backoff after failed runs
+blob_update_scheduler_enabled = os.getenv('BLOB_UPDATE_SCHEDULER_ENABLED', 'true').lower() == 'true'
+blob_update_interval_seconds = float(os.getenv('BLOB_UPDATE_INTERVAL_SECONDS', '120'))
+blob_update_jitter = float(os.getenv('BLOB_UPDATE_JITTER', '0.1'))
+blob_update_max_backoff_seconds = float(os.getenv('BLOB_UPDATE_MAX_BACKOFF_SECONDS', '900'))
+# MySQL advisory lock electing the one worker process that runs db_update
+blob_update_lock_name = os.getenv('BLOB_UPDATE_LOCK_NAME', 'callbot_blob_update')
+# Update requests of all worker processes are counted in this table; the leader polls it this often
+blob_update_request_table = "callbot_blob_update_requests"
+blob_update_poll_seconds = float(os.getenv('BLOB_UPDATE_POLL_SECONDS', '1'))
+
+# MySQL connection pool (mysql.connector allows at most 32 connections per pool)
+db_pool_size = int(os.getenv('DB_POOL_SIZE', '10'))
+db_pool_timeout_seconds = float(os.getenv('DB_POOL_TIMEOUT_SECONDS', '5'))
+
+# Attendees written to the attendee table per executemany call
+attendee_insert_batch_size = int(os.getenv('ATTENDEE_INSERT_BATCH_SIZE', '1000'))
+# Maximum number of per-row errors returned in an attendee import report
+attendee_import_max_errors = int(os.getenv('ATTENDEE_IMPORT_MAX_ERRORS', '1000'))
+
+# Seconds the dashboard's event list is cached in each worker process
+event_list_cache_ttl_seconds = float(os.getenv('EVENT_LIST_CACHE_TTL_SECONDS', '30'))
+# Largest page size accepted by /get_events
+event_list_max_per_page = int(os.getenv('EVENT_LIST_MAX_PER_PAGE', '500'))
+
+# Number of compiled per-event TwiML templates kept in each worker process
+twiml_cache_size = int(os.getenv('TWIML_CACHE_SIZE', '1024'))
+
+# Optional JSON file describing the IVR flow (see ivr_flow.py); the built-in flow is used if unset
+ivr_flow_file = os.getenv('IVR_FLOW_FILE')
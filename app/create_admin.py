@@ -24,10 +24,12 @@ Collects an email and password from the user via the command line. These credent
 
 import os
 from werkzeug.security import generate_password_hash
-from app import app, db
+from app import app, db, init_database
 from app.models import User
 
 def create_admin_user():
+    # Bind the database to the app; it is not connected at import
+    init_database()
     # Access the Flask application context to work with the app's configurations and database.
     with app.app_context():
         # Prompt the user to enter an email address for the admin user.
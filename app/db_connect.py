@@ -17,26 +17,70 @@ CRUD Operations: Functions to create, read, update, and delete database records.
 
 """
 
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
 import mysql.connector
-from mysql.connector import errorcode
-from .config import config, registration_table
+from mysql.connector import errorcode, pooling
+from mysql.connector.errors import PoolError
+from .config import (get_db_config, registration_table, attendee_table, attendee_insert_batch_size, db_pool_size,
+                     db_pool_timeout_seconds, table2)
+
+db_pool = None
+db_pool_pid = None
+db_pool_lock = threading.Lock()
+
+# Set once the attendee table exists and legacy attendee strings have been migrated in this process
+attendee_table_ready = False
+attendee_table_lock = threading.Lock()
+
+def get_db_pool():
+    """
+    Returns the process-wide MySQL connection pool, creating it on first use.
+
+    The pool is re-created after a fork, so each worker process of a pre-forking server gets its own
+    connections. Its size is set by `db_pool_size`.
+    """
+    global db_pool, db_pool_pid
+    with db_pool_lock:
+        if db_pool is None or db_pool_pid != os.getpid():
+            db_pool = pooling.MySQLConnectionPool(pool_name=f"callbot_{os.getpid()}",
+                                                  pool_size=db_pool_size,
+                                                  pool_reset_session=True,
+                                                  **get_db_config())
+            db_pool_pid = os.getpid()
+        return db_pool
 
 def get_db_connection():
     """
-    Establishes and returns a connection to the MySQL database using the configuration provided.
+    Checks out a connection to the MySQL database from the shared connection pool.
 
     Returns:
-    - conn (MySQLConnection or None): The MySQL database connection object if the connection is successful; 
-      otherwise, returns None.
+    - conn (PooledMySQLConnection or None): A pooled connection if one could be obtained; otherwise, returns None.
+      Calling `conn.close()` returns the connection to the pool instead of closing it.
 
-    This function attempts to connect to the MySQL database with the specified configuration. If the connection
-    fails, it handles common errors by printing appropriate messages.
+    When every pooled connection is in use, this function waits up to `db_pool_timeout_seconds` for one to
+    be returned. Each checked-out connection is pinged first and transparently reconnected if the server
+    dropped it while it was idle. If the connection fails, it handles common errors by printing appropriate messages.
 
     Raises:
     - Logs any MySQL errors encountered during the connection attempt.
     """
     try:
-        conn = mysql.connector.connect(**config)
+        pool = get_db_pool()
+        deadline = time.monotonic() + db_pool_timeout_seconds
+        while True:
+            try:
+                conn = pool.get_connection()
+                break
+            except PoolError:
+                if time.monotonic() >= deadline:
+                    raise
+                time.sleep(0.05)
+        # Health check: reconnect if the server closed the connection while it sat in the pool
+        conn.ping(reconnect=True, attempts=2, delay=0)
         return conn
     except mysql.connector.Error as err:
         if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
@@ -47,13 +91,56 @@ def get_db_connection():
             print(f"Error: {err}")
         return None
 
+@contextmanager
+def db_connection():
+    """
+    Context manager checking a pooled connection out for the duration of a `with` block.
+
+    Yields:
+    - conn (PooledMySQLConnection): The connection, returned to the pool when the block exits.
+
+    Raises:
+    - RuntimeError: If no connection could be obtained.
+    """
+    conn = get_db_connection()
+    if conn is None:
+        raise RuntimeError("Could not establish a connection to the database")
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+@contextmanager
+def db_cursor(dictionary=False):
+    """
+    Context manager yielding a cursor on a pooled connection.
+
+    The transaction is committed when the block exits normally and rolled back if it raises; the cursor is
+    closed and the connection returned to the pool in both cases.
+
+    Yields:
+    - cursor (MySQLCursor): The cursor, returning rows as dicts if `dictionary` is True.
+    """
+    with db_connection() as conn:
+        cursor = conn.cursor(dictionary=dictionary)
+        try:
+            yield cursor
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
 
 def create_table_if_not_exists():
     """
     Creates the `callbot_event_registration` table in the MySQL database if it does not already exist.
 
     The table includes columns for event details such as event ID, name, location, summary, date, time,
-    attendees, and the insertion timestamp.
+    attendees, and the insertion timestamp. The `attendees` column is kept for events saved before the
+    `callbot_event_attendee` table existed; new events store their attendees in that table, which is
+    created here as well.
 
     This function establishes a connection to the MySQL database and creates the table using SQL `CREATE TABLE IF NOT EXISTS`.
     If the connection cannot be established, an error message is printed.
@@ -76,8 +163,215 @@ def create_table_if_not_exists():
                 insert_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
+        create_attendee_table_if_not_exists(cursor)
         conn.commit()
         cursor.close()
         conn.close()
     else:
-        print("Error: Could not establish a connection to the database")
\ No newline at end of file
+        print("Error: Could not establish a connection to the database")
+
+def create_attendee_table_if_not_exists(cursor):
+    """
+    Creates the `callbot_event_attendee` table in the MySQL database if it does not already exist.
+
+    Each row holds one attendee of an event. The unique key on (eventID, attendeePhone) prevents the same
+    number being stored twice for one event, the (eventID, attendeeID) index lets an event's attendees be
+    paged in insertion order, and the index on attendeePhone supports lookups by recipient number.
+
+    Parameters:
+    - cursor (MySQLCursor): The cursor to run the statement on.
+    """
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {attendee_table} (
+            attendeeID INT AUTO_INCREMENT PRIMARY KEY,
+            eventID INT NOT NULL,
+            attendeeName VARCHAR(500) NOT NULL,
+            attendeePhone VARCHAR(50) NOT NULL,
+            insert_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE KEY uq_event_phone (eventID, attendeePhone),
+            INDEX idx_event_attendee (eventID, attendeeID),
+            INDEX idx_attendee_phone (attendeePhone)
+        )
+    ''')
+
+def parse_legacy_attendees(attendees_data):
+    """
+    Parses the legacy `name:phone;name:phone` attendees string of the registration table.
+
+    The phone number is taken from after the last colon, so names containing colons are kept intact.
+    Entries without a colon are skipped.
+
+    Returns:
+    - list of tuple: (attendeeName, attendeePhone) pairs.
+    """
+    attendees = []
+    for entry in (attendees_data or '').split(';'):
+        if ':' not in entry:
+            continue
+        name, phone = entry.rsplit(':', 1)
+        if phone.strip():
+            attendees.append((name.strip(), phone.strip()))
+    return attendees
+
+def insert_attendees(cursor, event_id, attendees, batch_size=None):
+    """
+    Bulk-inserts the attendees of an event into the attendee table.
+
+    Parameters:
+    - cursor (MySQLCursor): The cursor to run the inserts on; the caller commits.
+    - event_id (int): The ID of the event.
+    - attendees (iterable): (attendeeName, attendeePhone) pairs. May be a generator.
+    - batch_size (int, optional): Rows per `executemany` call. Defaults to `attendee_insert_batch_size`.
+
+    Returns:
+    - int: The number of attendees inserted. Numbers already stored for the event are ignored.
+    """
+    batch_size = batch_size or attendee_insert_batch_size
+    query = f"INSERT IGNORE INTO {attendee_table} (eventID, attendeeName, attendeePhone) VALUES (%s, %s, %s)"
+    inserted = 0
+    batch = []
+    for name, phone in attendees:
+        batch.append((event_id, str(name), str(phone)))
+        if len(batch) >= batch_size:
+            cursor.executemany(query, batch)
+            inserted += cursor.rowcount
+            batch = []
+    if batch:
+        cursor.executemany(query, batch)
+        inserted += cursor.rowcount
+    return inserted
+
+def migrate_attendees(cursor):
+    """
+    Copies the attendees of events saved before the attendee table existed out of the legacy
+    `attendees` column of the registration table.
+
+    Only events without any row in the attendee table are migrated, one event at a time, so the
+    migration is cheap once done and safe to run concurrently from several processes. The legacy
+    column is left untouched.
+
+    Parameters:
+    - cursor (MySQLCursor): The cursor to run the migration on; the caller commits.
+
+    Returns:
+    - int: The number of events migrated.
+    """
+    cursor.execute(f'''
+        SELECT r.eventID FROM {registration_table} r
+        WHERE r.attendees <> ''
+          AND NOT EXISTS (SELECT 1 FROM {attendee_table} a WHERE a.eventID = r.eventID)
+    ''')
+    event_ids = [row[0] for row in cursor.fetchall()]
+    for event_id in event_ids:
+        cursor.execute(f"SELECT attendees FROM {registration_table} WHERE eventID = %s", (event_id,))
+        row = cursor.fetchone()
+        if row:
+            insert_attendees(cursor, event_id, parse_legacy_attendees(row[0]))
+    if event_ids:
+        logging.info(f"Migrated attendees of {len(event_ids)} event(s) to {attendee_table}.")
+    return len(event_ids)
+
+def ensure_attendee_table():
+    """
+    Creates the attendee table and migrates legacy attendee strings, once per process.
+
+    Raises:
+    - RuntimeError: If no database connection could be obtained.
+    """
+    global attendee_table_ready
+    if attendee_table_ready:
+        return
+    with attendee_table_lock:
+        if attendee_table_ready:
+            return
+        with db_cursor() as cursor:
+            create_attendee_table_if_not_exists(cursor)
+            migrate_attendees(cursor)
+        attendee_table_ready = True
+
+def iter_event_attendees(event_id, batch_size=None):
+    """
+    Yields the attendees of an event in insertion order, reading them from the database in pages.
+
+    Each page is fetched with a keyset query on attendeeID on its own pooled connection, so a long list
+    is never held in memory and no connection stays checked out between pages.
+
+    Parameters:
+    - event_id (int): The ID of the event.
+    - batch_size (int, optional): Attendees per page. Defaults to `attendee_insert_batch_size`.
+
+    Yields:
+    - dict: {'attendeeID', 'attendeeName', 'attendeePhone'} for each attendee.
+    """
+    batch_size = batch_size or attendee_insert_batch_size
+    last_id = 0
+    while True:
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(
+                f"""SELECT attendeeID, attendeeName, attendeePhone FROM {attendee_table}
+                    WHERE eventID = %s AND attendeeID > %s ORDER BY attendeeID LIMIT %s""",
+                (event_id, last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1]['attendeeID']
+
+def count_event_attendees(event_id):
+    """
+    Returns the number of attendees stored for an event.
+    """
+    with db_cursor() as cursor:
+        cursor.execute(f"SELECT COUNT(*) FROM {attendee_table} WHERE eventID = %s", (event_id,))
+        return cursor.fetchone()[0]
+
+def get_latest_acceptance_ids(event_id):
+    """
+    Returns the callbackID of the latest acceptance of each recipient of an event.
+
+    Recipients who accepted more than once (e.g. after a callback) appear once, with their most recent row.
+    The query is answered from the (Event_ID, Recipient_Number) index of the accepted table, whose entries
+    carry the callbackID, so only the IDs are read here.
+
+    Parameters:
+    - event_id (int): The ID of the event.
+
+    Returns:
+    - list of int: The callbackIDs in ascending order.
+    """
+    with db_cursor() as cursor:
+        cursor.execute(
+            f"SELECT MAX(callbackID) FROM {table2} WHERE Event_ID = %s GROUP BY Recipient_Number",
+            (event_id,)
+        )
+        return sorted(row[0] for row in cursor.fetchall())
+
+def iter_acceptances(callback_ids, batch_size=None):
+    """
+    Yields rows of the accepted table by callbackID, reading them from the database in batches.
+
+    Each batch is fetched by primary key on its own pooled connection. Event_Time is returned as an
+    'HH:MM:SS' string.
+
+    Parameters:
+    - callback_ids (list of int): The callbackIDs to read, e.g. from `get_latest_acceptance_ids`.
+    - batch_size (int, optional): Rows per query. Defaults to `attendee_insert_batch_size`.
+
+    Yields:
+    - dict: Recipient_Number, Attendee_Name, Event_Name, Event_Summary, Event_Date, Event_Venue, Event_ID
+      and Event_Time of each row.
+    """
+    batch_size = batch_size or attendee_insert_batch_size
+    for start in range(0, len(callback_ids), batch_size):
+        batch = callback_ids[start:start + batch_size]
+        placeholders = ', '.join(['%s'] * len(batch))
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(
+                f"""SELECT Recipient_Number, Attendee_Name, Event_Name, Event_Summary, Event_Date, Event_Venue,
+                           Event_ID, TIME_FORMAT(Event_Time, '%%H:%%i:%%s') AS Event_Time
+                    FROM {table2} WHERE callbackID IN ({placeholders}) ORDER BY callbackID""",
+                batch
+            )
+            rows = cursor.fetchall()
+        yield from rows
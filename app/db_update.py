@@ -12,6 +12,8 @@ This script retrieves data from a specified Azure Blob, processes the data, and
 
 Content Overview:
 Blob retrive:This script retrieves data from a specified Azure Blob, processes the data.
+Call log layouts: Reads the daily CSV files, and the parts of the partitioned call log that the writers'
+manifests list as changed (see call_log.py). Each event's parts of a day are processed as one group.
 DB table updates: Updates the corresponding entries in the MySQL database
 
 DB tables which are getting updated:
@@ -24,6 +26,8 @@ DEV tables to handle the buckets
 5. table5 = `callbot_response_invalidoptioninput`;
 6. table6 = `callbot_response_noanswer`;
 7. table7 = `callbot_reminder_status`;
+Summary table: summary_table = `callbot_event_summary`, the number of calls per event and outcome (one row per
+bucket table), updated in the same transaction as the bucket rows it counts.
 
 PROD tables to handle the buckets
 1. table1="callbot_response_callback_PROD"
@@ -33,56 +37,72 @@ PROD tables to handle the buckets
 5. table5="callbot_response_invalidoptioninput_PROD"
 6. table6="callbot_response_noanswer_PROD"
 7. table7="callbot_reminder_status_PROD"
+Summary table: summary_table="callbot_event_summary_PROD"
+
+Ingestion state: the byte offset read in every blob (one row per blob in ingest_watermark_table), the attendee
+rows indexed by GUID (ingest_attendee_table) and the GUIDs whose response arrived before their attendee row
+(ingest_pending_table) are kept in MySQL and committed with the bucket rows, so a restart or a new leader
+resumes where the last run stopped. The state of a daily blob or partition group is deleted after its final pass.
 
 """
 
+import argparse
+import json
 import pandas as pd
-from azure.storage.blob import BlobServiceClient
-import mysql.connector
-from mysql.connector import errorcode
+from azure.core.exceptions import ResourceNotFoundError
 from io import StringIO
 import warnings
-from datetime import datetime
-import sys
-from .config import table1, table2, table3, table4, table5, table6, table7, config, connect_str, container_name
+from datetime import datetime, timedelta
+import threading
+import logging
+from .db_connect import get_db_connection
+from .metrics import db_update_stage_seconds
+from .blob_operations import legacy_append_name
+from .call_log import get_current_csv_blob_name, partition_group, read_manifests
+from .config import (table1, table2, table3, table4, table5, table6, table7, summary_table, get_db_config, get_blob_service_client,
+                     container_name, call_log_prefix, ingest_watermark_table, ingest_attendee_table, ingest_pending_table,
+                     registration_table)
 
 # Suppress warnings
 warnings.filterwarnings("ignore")
 
-# Initialize the BlobServiceClient
-blob_service_client = BlobServiceClient.from_connection_string(connect_str)
+# Bucket rules: (table, CSV column, value marking a GUID for the table, default Response for its rows)
+BUCKET_RULES = [
+    (table1, 'Response', 'Request Callback', 'Request Callback'),
+    (table2, 'Response', 'Invite Accepted', 'Invite Accepted'),
+    (table3, 'Response', 'Pickup and Drop Accepted', 'Pickup and Drop Accepted'),
+    (table4, 'Response', 'Pickup and Drop Declined', 'Pickup and Drop Declined'),
+    (table5, 'Response', 'Invalid option', 'Invalid option'),
+    (table6, 'Call Status', 'no-answer', 'no-answer'),
+    (table7, 'Call Type', 'reminder', 'reminder'),
+]
 
-#-------------------------------------------------------------------------------------------------------
-# Utility Functions
-#-------------------------------------------------------------------------------------------------------
+# Event details joined from the registration table: CSV column -> registration table column
+EVENT_DETAIL_COLUMNS = [
+    ('Event Name', 'eventName'),
+    ('Event Summary', 'eventSummary'),
+    ('Event Time', 'eventTime'),
+    ('Event Venue', 'eventLocation'),
+]
 
-def get_current_csv_blob_name():
-    """
-    Generates the blob name for the current date's CSV file.
-    """
-    date_str = datetime.now().strftime('%d_%m_%Y')
-    file_name = f'call_status_{date_str}.csv'
-    return file_name
+# Number of GUIDs per `WHERE GUID IN (...)` probe in get_db_df
+GUID_PROBE_CHUNK_SIZE = 1000
 
-blob_name = get_current_csv_blob_name()
+# Bucket, summary and ingestion state tables already created (and indexed) by this process, see prepare_table
+prepared_tables = set()
 
-# Get database connection
-def get_db_connection():
-    """
-    Establishes and returns a connection to the MySQL database.
-    """
-    try:
-        return mysql.connector.connect(**config)
-    except mysql.connector.Error as err:
-        if err.errno == errorcode.ER_ACCESS_DENIED_ERROR:
-            print("Error: Something is wrong with the user name or password")
-        elif err.errno == errorcode.ER_BAD_DB_ERROR:
-            print("Error: Database does not exist")
-        else:
-            print(f"Error: {err}")
-        return None
+# Latest properties (ETag, size) fetched by check_blob_exists, per blob
+blob_properties = {}
+
+# Serialises the db_update runs of this process; the ingestion state itself is in MySQL, see load_ingest_state
+ingest_lock = threading.Lock()
 
-conn = get_db_connection()
+# Per day of the partitioned call log: manifest ETags, bytes written per part, and bytes already ingested
+manifest_states = {}
+
+#-------------------------------------------------------------------------------------------------------
+# Utility Functions
+#-------------------------------------------------------------------------------------------------------
 
 # Create table if it does not exist
 def create_table_if_not_exists(conn, table_name):
@@ -106,12 +126,177 @@ def create_table_if_not_exists(conn, table_name):
             Call_Type VARCHAR(50),
             Event_ID INT,
             Event_Summary TEXT,
-            Event_Time TIME
+            Event_Time TIME,
+            UNIQUE KEY uq_guid (GUID),
+            INDEX idx_event_recipient (Event_ID, Recipient_Number)
         )
     ''')
     conn.commit()
     cursor.close()
 
+def index_exists(cursor, table_name, index_name):
+    """
+    Checks if the specified table has an index with the given name.
+    """
+    cursor.execute('''
+        SELECT COUNT(*)
+        FROM information_schema.statistics
+        WHERE table_schema = %s
+        AND table_name = %s
+        AND index_name = %s
+    ''', (get_db_config()['database'], table_name, index_name))
+    return cursor.fetchone()[0] > 0
+
+def count_duplicate_guids(cursor, table_name):
+    """
+    Returns the number of GUIDs that appear in more than one row of a bucket table.
+    """
+    cursor.execute(f'''
+        SELECT COUNT(*) FROM (
+            SELECT GUID FROM {table_name} WHERE GUID IS NOT NULL GROUP BY GUID HAVING COUNT(*) > 1
+        ) duplicates
+    ''')
+    return cursor.fetchone()[0]
+
+def ensure_guid_index(conn, table_name):
+    """
+    Adds the unique GUID index to a bucket table created before the index was introduced.
+
+    Never deletes rows: if the table holds duplicate GUIDs left by earlier runs, the index is not added and
+    a warning asks for the explicit migration (see migrate_guid_index). Until then ingestion still skips
+    GUIDs already in the table (see get_db_df).
+    """
+    cursor = conn.cursor()
+    if not index_exists(cursor, table_name, 'uq_guid'):
+        duplicates = count_duplicate_guids(cursor, table_name)
+        if duplicates:
+            logging.warning(f"{table_name} has {duplicates} duplicated GUIDs and no unique GUID index; run "
+                            f"`python -m app.db_update --migrate-guid-index` to move the duplicates aside and add it")
+        else:
+            cursor.execute(f"ALTER TABLE {table_name} ADD UNIQUE INDEX uq_guid (GUID)")
+            conn.commit()
+            logging.info(f"Added the unique GUID index to {table_name}")
+    cursor.close()
+
+def migrate_guid_index(conn, table_name):
+    """
+    Migration adding the unique GUID index to a bucket table that holds duplicate GUIDs.
+
+    For every duplicated GUID the row with the lowest callbackID is kept. The other rows are copied to
+    `<table>_guid_duplicates` and deleted from the table in one transaction, so they can be reviewed or
+    restored; then the index is added.
+
+    Returns:
+        int: The number of rows moved to the duplicates table.
+    """
+    archive_table = f"{table_name}_guid_duplicates"
+    cursor = conn.cursor()
+    try:
+        if index_exists(cursor, table_name, 'uq_guid'):
+            logging.info(f"{table_name} already has the unique GUID index")
+            return 0
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {archive_table} AS SELECT * FROM {table_name} WHERE 1 = 0")
+        cursor.execute(f'''
+            INSERT INTO {archive_table}
+            SELECT * FROM {table_name} t1
+            WHERE EXISTS (SELECT 1 FROM {table_name} t2 WHERE t2.GUID = t1.GUID AND t2.callbackID < t1.callbackID)
+        ''')
+        moved = cursor.rowcount
+        cursor.execute(f"DELETE FROM {table_name} WHERE callbackID IN (SELECT callbackID FROM {archive_table})")
+        conn.commit()
+        logging.warning(f"Moved {moved} duplicate GUID rows from {table_name} to {archive_table}")
+        cursor.execute(f"ALTER TABLE {table_name} ADD UNIQUE INDEX uq_guid (GUID)")
+        conn.commit()
+        logging.info(f"Added the unique GUID index to {table_name}")
+        return moved
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def ensure_event_recipient_index(conn, table_name):
+    """
+    Adds the (Event_ID, Recipient_Number) index to a bucket table created before the index was introduced.
+
+    The index serves per-event lookups such as the reminder campaign's latest acceptance per recipient.
+    """
+    cursor = conn.cursor()
+    if not index_exists(cursor, table_name, 'idx_event_recipient'):
+        cursor.execute(f"ALTER TABLE {table_name} ADD INDEX idx_event_recipient (Event_ID, Recipient_Number)")
+        conn.commit()
+    cursor.close()
+
+def prepare_table(conn, table_name):
+    """
+    Creates a bucket table if needed and adds the unique GUID index (unless duplicates have to be migrated
+    first, see ensure_guid_index) and the (Event_ID, Recipient_Number) index, once per process.
+    """
+    if table_name in prepared_tables:
+        return
+    create_table_if_not_exists(conn, table_name)
+    ensure_guid_index(conn, table_name)
+    ensure_event_recipient_index(conn, table_name)
+    prepared_tables.add(table_name)
+
+def prepare_summary_table(conn):
+    """
+    Creates the event summary table if needed and reconciles it with the bucket tables, once per process.
+
+    The counts are recomputed from the bucket tables with an upsert, in one transaction, so a new table is
+    filled with the calls ingested before it existed, and a run interrupted before its commit is simply
+    repeated by the next process. From then on submain keeps the counts up to date. Only called from the
+    db_update run of the scheduler's leader, never from a request.
+    """
+    if summary_table in prepared_tables:
+        return
+    for table_name, _, _, _ in BUCKET_RULES:
+        prepare_table(conn, table_name)
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {summary_table} (
+            Event_ID INT NOT NULL,
+            Outcome VARCHAR(50) NOT NULL,
+            Calls INT NOT NULL DEFAULT 0,
+            Last_Updated DATETIME,
+            PRIMARY KEY (Event_ID, Outcome)
+        )
+    ''')
+    try:
+        for table_name, _, _, label in BUCKET_RULES:
+            cursor.execute(f'''
+                INSERT INTO {summary_table} (Event_ID, Outcome, Calls, Last_Updated)
+                SELECT Event_ID, %s, COUNT(*), NOW() FROM {table_name}
+                WHERE Event_ID IS NOT NULL
+                GROUP BY Event_ID
+                ON DUPLICATE KEY UPDATE Calls = VALUES(Calls)
+            ''', (label,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+    prepared_tables.add(summary_table)
+
+def update_event_summary(conn, counts):
+    """
+    Adds newly inserted bucket rows to the event summary, without committing.
+
+    Args:
+        counts (dict): (Event_ID, outcome label) -> number of rows inserted.
+    """
+    data = [(event_id, label, calls) for (event_id, label), calls in counts.items() if calls]
+    if not data:
+        return
+    cursor = conn.cursor()
+    cursor.executemany(f'''
+        INSERT INTO {summary_table} (Event_ID, Outcome, Calls, Last_Updated)
+        VALUES (%s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE Calls = Calls + VALUES(Calls), Last_Updated = VALUES(Last_Updated)
+    ''', data)
+    cursor.close()
+
 # Function to check if table exists
 def check_table_exists(conn, table_name):
     """
@@ -124,126 +309,405 @@ def check_table_exists(conn, table_name):
     AND table_name = %s
     """
     cursor = conn.cursor()
-    cursor.execute(query, (config['database'], table_name))
+    cursor.execute(query, (get_db_config()['database'], table_name))
     result = cursor.fetchone()[0]
     cursor.close()
     return result > 0
 
 def get_db_df(conn,table_name,lst):
     """
-    Retrieves a DataFrame from the database for the specified table, filtered by a list of GUIDs.
-    """
+    Returns the GUIDs from the given list that are not yet present in the specified table.
 
-    if check_table_exists(conn, table_name):
-            # Write a query to fetch the data
-            query= f"SELECT * FROM {table_name}"
-
-            # Load data into a pandas DataFrame
-            df = pd.read_sql(query, conn)
-            # Display the DataFrame            
-            column_values = df['GUID'].tolist()
-            set1=set(lst)
-            set2=set(column_values)
-            if len(column_values)>0:
-                diff=list(set1-set2)
-            else:
-                diff=list(set1)
-
-            return(diff)
-    else:
-            return(lst)
+    The GUID column has a unique index (see ensure_guid_index), so the check probes the index with
+    `WHERE GUID IN (...)` in chunks of GUID_PROBE_CHUNK_SIZE instead of loading the whole table.
+    """
+    lst = list(lst)
+    existing = set()
+    cursor = conn.cursor()
+    for start in range(0, len(lst), GUID_PROBE_CHUNK_SIZE):
+        chunk = lst[start:start + GUID_PROBE_CHUNK_SIZE]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f"SELECT GUID FROM {table_name} WHERE GUID IN ({placeholders})", chunk)
+        existing.update(row[0] for row in cursor.fetchall())
+    cursor.close()
+    return [guid for guid in lst if guid not in existing]
 
 
 def create_df(lst, df, string):
     """
     Creates a DataFrame by filtering the input DataFrame for the specified list of GUIDs and default response.
+
+    All matching rows are selected with one vectorised `isin` mask rather than one filter and concat per GUID.
     """
-    all_results = pd.DataFrame()
-    for value in lst:
-        Result = df.loc[(df['GUID'] == value) & (df['Attendee Name'].notna())].copy()
-        Result['Response'].fillna(string, inplace=True)
-        all_results = pd.concat([all_results, Result])
+    all_results = df.loc[df['GUID'].isin(lst) & df['Attendee Name'].notna()].copy()
+    all_results['Response'] = all_results['Response'].fillna(string)
     all_results.reset_index(drop=True, inplace=True)
     return all_results
 
-# Download CSV file from Azure Blob Storage
-def download_blob_to_df():
-    """
-    Downloads the CSV file from Azure Blob Storage and processes it into multiple DataFrames.
-    """
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
-    download_stream = blob_client.download_blob()
-    csv_data = download_stream.content_as_text()
-    
-    df = pd.read_csv(StringIO(csv_data))
-    
-    if len(df) < 2:
-        sys.exit()  # Exit if the DataFrame is empty or has insufficient data
-    
-    value_Callback = df.loc[df['Response'] == 'Request Callback', 'GUID'].values
-    accepted_lst = get_db_df(conn, table_name='callbot_response_callback', lst=value_Callback)
-    Result_Callback = create_df(lst=accepted_lst, df=df, string='Request Callback')
-    
-    value_accepted = df.loc[df['Response'] == 'Invite Accepted', 'GUID'].values
-    accepted_lst = get_db_df(conn, table_name='callbot_response_accepted', lst=value_accepted)
-    Result_accepted = create_df(lst=accepted_lst, df=df, string='Invite Accepted')
-
-    value_pickup_accepted = df.loc[df['Response'] == 'Pickup and Drop Accepted', 'GUID']
-    accepted_lst = get_db_df(conn, table_name='callbot_response_accepted_pickupdrop', lst=value_pickup_accepted)
-    Result_pickup_accepted = create_df(lst=accepted_lst, df=df, string='Pickup and Drop Accepted')
-    
-    value_pickup_declined = df.loc[df['Response'] == 'Pickup and Drop Declined', 'GUID'].values
-    accepted_lst = get_db_df(conn, table_name='callbot_response_declined_pickupdrop', lst=value_pickup_declined)
-    Result_pickup_declinded = create_df(lst=accepted_lst, df=df, string='Pickup and Drop Declined')
-
-    value_invalidoptioninput = df.loc[df['Response'] == 'Invalid option', 'GUID'].values
-    accepted_lst = get_db_df(conn, table_name='callbot_response_invalidoptioninput', lst=value_invalidoptioninput)
-    Result_invalidoptioninput = create_df(lst=accepted_lst, df=df, string='Invalid option')
-
-    value_NoAnswer = df.loc[df['Call Status'] == 'no-answer', 'GUID'].values
-    accepted_lst = get_db_df(conn, table_name='callbot_response_noanswer', lst=value_NoAnswer)
-    Result_NoAnswer = create_df(lst=accepted_lst, df=df, string='no-answer')
-    
-    value_reminder = df.loc[df['Call Type'] == 'reminder', 'GUID'].values
-    accepted_lst = get_db_df(conn, table_name='callbot_reminder_status', lst=value_reminder)
-    Result_reminder = create_df(lst=accepted_lst, df=df, string='reminder')
-    
+def classify_rows(df):
+    """
+    Returns, for every bucket table, the set of GUIDs that the given rows mark for that table.
+    """
+    with_guid = df.loc[df['GUID'].notna()]
+    return {table_name: set(with_guid.loc[with_guid[column] == value, 'GUID'])
+            for table_name, column, value, _ in BUCKET_RULES}
+
+def create_bucket_frames(attendees, marked):
+    """
+    Builds the rows to insert into every bucket table with a single join.
+
+    Args:
+        attendees (DataFrame): The attendee rows (rows with an Attendee Name) of the day.
+        marked (dict): Bucket table name -> list of GUIDs to insert into that table.
+
+    Returns:
+        dict: Bucket table name -> DataFrame with the CSV columns, the Response defaulting to the table's label.
+    """
+    assignments = pd.DataFrame(
+        [(guid, table_name) for table_name, guids in marked.items() for guid in guids],
+        columns=['GUID', 'Bucket_Table']
+    )
+    if assignments.empty or attendees.empty:
+        return {}
+    labels = {table_name: label for table_name, _, _, label in BUCKET_RULES}
+    columns = list(attendees.columns)
+    joined = attendees.loc[attendees['Attendee Name'].notna()].merge(assignments, on='GUID', how='inner')
+    joined['Response'] = joined['Response'].fillna(joined['Bucket_Table'].map(labels))
+    return {table_name: group[columns].reset_index(drop=True)
+            for table_name, group in joined.groupby('Bucket_Table', sort=False)}
+
+def fill_event_details(conn, df, rows=None):
+    """
+    Fills the empty event name, summary, time and venue of call event rows from the registration table.
+
+    The attendee rows written by make_call only carry the event ID and date, so the event details are joined
+    when the rows are ingested or archived. Rows of earlier releases, which carry the details, are left as
+    they are.
+
+    Args:
+        df (DataFrame): Call event rows with the CSV columns; updated in place.
+        rows (Series, optional): Mask of the rows to fill. Defaults to every row.
+
+    Returns:
+        DataFrame: `df`.
+    """
+    event_ids = pd.to_numeric(df['eventID'], errors='coerce')
+    mask = event_ids.notna() if rows is None else rows & event_ids.notna()
+    ids = sorted({int(event_id) for event_id in event_ids[mask]})
+    if not ids:
+        return df
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT eventID, {', '.join(column for _, column in EVENT_DETAIL_COLUMNS)} FROM {registration_table} "
+                   f"WHERE eventID IN ({', '.join(['%s'] * len(ids))})", ids)
+    events = {int(row[0]): row[1:] for row in cursor.fetchall()}
+    cursor.close()
+    registered = event_ids.where(mask).map(lambda event_id: events.get(int(event_id)) if pd.notna(event_id) else None)
+    for position, (column, _) in enumerate(EVENT_DETAIL_COLUMNS):
+        values = registered.map(lambda event: None if event is None or event[position] is None else str(event[position]))
+        fill = mask & df[column].isna() & values.notna()
+        if fill.any():
+            df[column] = df[column].astype(object)
+            df.loc[fill, column] = values[fill]
+    return df
+
+def new_part_state():
+    """
+    Returns the watermark of a blob that has not been read yet: the ETag and byte offset of the last
+    complete line read, and the CSV header.
+    """
+    return {'etag': None, 'offset': 0, 'header': None}
+
+
+def new_ingest_state():
+    """
+    Returns the ingestion state of a daily blob, or of a group of partitioned parts, that has not been read yet.
+
+    The state holds the watermark of each blob read (see new_part_state) and, per table, the GUIDs whose
+    response arrived before their attendee row. The attendee rows themselves (the rows written by make_call,
+    which are the rows inserted into the tables) are kept in the GUID index, see store_attendees.
+    """
     return {
-        table1: Result_Callback,
-        table2: Result_accepted,
-        table3: Result_pickup_accepted,
-        table4: Result_pickup_declinded,
-        table5: Result_invalidoptioninput,
-        table6: Result_NoAnswer,
-        table7: Result_reminder
+        'parts': {},
+        'pending': {table_name: set() for table_name, _, _, _ in BUCKET_RULES},
+        'stored': {'parts': {}, 'pending': set()},
+    }
+
+
+def prepare_ingest_tables(conn):
+    """
+    Creates the tables holding the ingestion state if needed, once per process.
+    """
+    if ingest_watermark_table in prepared_tables:
+        return
+    cursor = conn.cursor()
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {ingest_watermark_table} (
+            Blob_Name VARCHAR(255) NOT NULL PRIMARY KEY,
+            Ingest_Key VARCHAR(255) NOT NULL,
+            ETag VARCHAR(64),
+            Byte_Offset BIGINT NOT NULL,
+            Header TEXT,
+            Last_Updated DATETIME,
+            INDEX idx_ingest_key (Ingest_Key)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {ingest_attendee_table} (
+            Ingest_Key VARCHAR(255) NOT NULL,
+            GUID VARCHAR(36) NOT NULL,
+            Row_Data TEXT NOT NULL,
+            PRIMARY KEY (Ingest_Key, GUID)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {ingest_pending_table} (
+            Ingest_Key VARCHAR(255) NOT NULL,
+            Bucket_Table VARCHAR(64) NOT NULL,
+            GUID VARCHAR(36) NOT NULL,
+            PRIMARY KEY (Ingest_Key, Bucket_Table, GUID)
+        )
+    ''')
+    conn.commit()
+    cursor.close()
+    prepared_tables.add(ingest_watermark_table)
+
+
+def load_ingest_state(conn, ingest_key):
+    """
+    Reads the ingestion state of a daily blob or partition group from MySQL, see new_ingest_state.
+
+    The state read is remembered under 'stored', so save_ingest_state only writes what the run changed.
+    """
+    state = new_ingest_state()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT Blob_Name, ETag, Byte_Offset, Header FROM {ingest_watermark_table} WHERE Ingest_Key = %s",
+                   (ingest_key,))
+    for blob_name, etag, offset, header in cursor.fetchall():
+        state['parts'][blob_name] = {'etag': etag, 'offset': int(offset), 'header': header.split(',') if header else None}
+    cursor.execute(f"SELECT Bucket_Table, GUID FROM {ingest_pending_table} WHERE Ingest_Key = %s", (ingest_key,))
+    for table_name, guid in cursor.fetchall():
+        state['pending'].setdefault(table_name, set()).add(guid)
+    cursor.close()
+    state['stored'] = {
+        'parts': {blob_name: dict(part) for blob_name, part in state['parts'].items()},
+        'pending': {(table_name, guid) for table_name, guids in state['pending'].items() for guid in guids},
     }
+    return state
+
+
+def save_ingest_state(conn, ingest_key, state):
+    """
+    Writes the watermarks and pending GUIDs that changed since load_ingest_state, without committing, so they
+    are committed together with the bucket rows they account for.
+    """
+    parts = [(blob_name, ingest_key, part['etag'], part['offset'], ','.join(part['header']) if part['header'] else None)
+             for blob_name, part in state['parts'].items() if part != state['stored']['parts'].get(blob_name)]
+    pending = {(table_name, guid) for table_name, guids in state['pending'].items() for guid in guids}
+    cursor = conn.cursor()
+    if parts:
+        cursor.executemany(f'''
+            INSERT INTO {ingest_watermark_table} (Blob_Name, Ingest_Key, ETag, Byte_Offset, Header, Last_Updated)
+            VALUES (%s, %s, %s, %s, %s, NOW())
+            ON DUPLICATE KEY UPDATE ETag = VALUES(ETag), Byte_Offset = VALUES(Byte_Offset), Header = VALUES(Header),
+                                    Last_Updated = VALUES(Last_Updated)
+        ''', parts)
+    resolved = state['stored']['pending'] - pending
+    if resolved:
+        cursor.executemany(f"DELETE FROM {ingest_pending_table} WHERE Ingest_Key = %s AND Bucket_Table = %s AND GUID = %s",
+                           [(ingest_key, table_name, guid) for table_name, guid in resolved])
+    added = pending - state['stored']['pending']
+    if added:
+        cursor.executemany(f"INSERT IGNORE INTO {ingest_pending_table} (Ingest_Key, Bucket_Table, GUID) VALUES (%s, %s, %s)",
+                           [(ingest_key, table_name, guid) for table_name, guid in added])
+    cursor.close()
+
+
+def stored_watermarks(conn):
+    """
+    Returns the ETag of every blob with a watermark, per daily blob or partition group.
+
+    Returns:
+        dict: Ingest key -> {blob name -> ETag}.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT Ingest_Key, Blob_Name, ETag FROM {ingest_watermark_table}")
+    stored = {}
+    for ingest_key, blob_name, etag in cursor.fetchall():
+        stored.setdefault(ingest_key, {})[blob_name] = etag
+    cursor.close()
+    return stored
+
+
+def forget_ingest_states(ingest_keys):
+    """
+    Deletes the ingestion state of daily blobs or partition groups that have had their final pass.
+    """
+    if not ingest_keys:
+        return
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        cursor = conn.cursor()
+        for table_name in (ingest_watermark_table, ingest_attendee_table, ingest_pending_table):
+            cursor.executemany(f"DELETE FROM {table_name} WHERE Ingest_Key = %s", [(key,) for key in ingest_keys])
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def store_attendees(conn, ingest_key, attendees):
+    """
+    Adds attendee rows to the GUID index of the ingestion state, without committing. A GUID already in the
+    index keeps its first row.
+    """
+    records = json.loads(attendees.to_json(orient='records'))
+    cursor = conn.cursor()
+    cursor.executemany(f"INSERT IGNORE INTO {ingest_attendee_table} (Ingest_Key, GUID, Row_Data) VALUES (%s, %s, %s)",
+                       [(ingest_key, str(record['GUID']), json.dumps(record)) for record in records])
+    cursor.close()
+
+
+def fetch_attendees(conn, ingest_key, guids):
+    """
+    Returns the indexed attendee rows of the given GUIDs (see store_attendees), probing the GUID index in
+    chunks of GUID_PROBE_CHUNK_SIZE. GUIDs without an attendee row are left out.
+    """
+    guids = list(guids)
+    records = []
+    cursor = conn.cursor()
+    for start in range(0, len(guids), GUID_PROBE_CHUNK_SIZE):
+        chunk = guids[start:start + GUID_PROBE_CHUNK_SIZE]
+        placeholders = ', '.join(['%s'] * len(chunk))
+        cursor.execute(f"SELECT Row_Data FROM {ingest_attendee_table} WHERE Ingest_Key = %s AND GUID IN ({placeholders})",
+                       [ingest_key] + chunk)
+        records.extend(json.loads(row[0]) for row in cursor.fetchall())
+    cursor.close()
+    return pd.DataFrame(records)
+
+
+def read_new_rows(blob_client, state, properties=None):
+    """
+    Reads the complete lines appended to the blob since the watermark in `state` (see new_part_state) and
+    advances the watermark.
+
+    Only the bytes after the stored offset are downloaded (a range read), and nothing is downloaded if the
+    blob's ETag has not changed. A trailing line that is still being written is left for the next run.
+    If the blob is smaller than the stored offset it has been replaced, and it is read again from the start.
+    `properties` may be passed when the blob's properties have just been fetched, saving a request.
+
+    Returns:
+        DataFrame or None: The new rows with the CSV header as columns, or None if there are none.
+    """
+    if properties is None:
+        properties = blob_client.get_blob_properties()
+    if properties.size < state['offset']:
+        state.update(new_part_state())
+    if properties.etag == state['etag'] or properties.size == state['offset']:
+        state['etag'] = properties.etag
+        return None
+
+    with db_update_stage_seconds.time(stage='download'):
+        raw = blob_client.download_blob(offset=state['offset'], length=properties.size - state['offset']).readall()
+    with db_update_stage_seconds.time(stage='parse'):
+        end = raw.rfind(b'\n') + 1
+        state['offset'] += end
+        state['etag'] = properties.etag if end == len(raw) else None
+        text = raw[:end].decode('utf-8')
+
+        if state['header'] is None:
+            if not text:
+                return None
+            header_line, _, text = text.partition('\n')
+            state['header'] = header_line.strip().split(',')
+        if not text.strip():
+            return None
+        return pd.read_csv(StringIO(text), header=None, names=state['header'], index_col=False, on_bad_lines='warn')
+
+
+def download_blob_to_df(conn, ingest_key, blob_names, state):
+    """
+    Downloads the rows appended to the given CSV files since the last run and processes them into multiple DataFrames.
+
+    New attendee rows are added to the GUID index of `ingest_key` (see store_attendees); response/status
+    rows mark GUIDs for the bucket tables. Only the marked GUIDs are looked up in the index, and those whose
+    attendee row has not arrived yet are kept pending in `state` for the next run. The work done therefore
+    depends on the number of new rows, not on the size of the day's files.
+    """
+    frames = []
+    for blob_name in blob_names:
+        blob_client = get_blob_service_client().get_blob_client(container=container_name, blob=blob_name)
+        part = state['parts'].setdefault(blob_name, new_part_state())
+        new_rows = read_new_rows(blob_client, part, blob_properties.pop(blob_name, None))
+        if new_rows is not None and not new_rows.empty:
+            frames.append(new_rows)
+    if not frames:
+        return {}
+    df = frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
+
+    with db_update_stage_seconds.time(stage='dedup'):
+        new_attendees = df.loc[df['Attendee Name'].notna() & df['GUID'].notna()]
+        if not new_attendees.empty:
+            store_attendees(conn, ingest_key, new_attendees)
+
+        marked_by_table = classify_rows(df)
+        marked = {table_name: state['pending'][table_name] | marked_by_table[table_name]
+                  for table_name, _, _, _ in BUCKET_RULES}
+        attendees = fetch_attendees(conn, ingest_key, set().union(*marked.values()))
+        known_guids = set(attendees['GUID']) if not attendees.empty else set()
+        if known_guids:
+            fill_event_details(conn, attendees)
+        to_insert = {}
+        for table_name, _, _, _ in BUCKET_RULES:
+            state['pending'][table_name] = marked[table_name] - known_guids
+            ready = list(marked[table_name] & known_guids)
+            if ready:
+                to_insert[table_name] = get_db_df(conn, table_name=table_name, lst=ready)
+        return create_bucket_frames(attendees, to_insert)
 
 # Insert data into the table
 def insert_data_to_table(conn, df, table_name):
     """
-    Inserts the data from the DataFrame into the specified table in the database.
+    Inserts the data from the DataFrame into the specified table in the database, without committing.
+
+    Rows whose GUID is already in the table are skipped by the unique GUID index (INSERT IGNORE). The rows
+    are inserted one event at a time, so that the rows actually inserted can be counted per event for the
+    event summary.
+
+    Returns:
+        dict: Event_ID -> number of rows inserted. Rows without an Event_ID are inserted but not counted.
     """
     cursor = conn.cursor()
     insert_query = f'''
-        INSERT INTO {table_name} (GUID, Event_ID, Timestamp, Twilio_Number, Recipient_Number, Call_Status, Response, Attendee_Name, Event_Date, Event_Name, Event_Summary, Event_Time, Event_Venue, Call_Type)
+        INSERT IGNORE INTO {table_name} (GUID, Event_ID, Timestamp, Twilio_Number, Recipient_Number, Call_Status, Response, Attendee_Name, Event_Date, Event_Name, Event_Summary, Event_Time, Event_Venue, Call_Type)
         VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
     '''
-    data = [tuple(None if pd.isna(x) else x for x in row) for row in df.itertuples(index=False)]
-    cursor.executemany(insert_query, data)
-    conn.commit()
+    event_ids = pd.to_numeric(df['eventID'], errors='coerce')
+    inserted = {}
+    for event_id, rows in df.groupby(event_ids.fillna(-1).astype(int), sort=False):
+        data = [tuple(None if pd.isna(x) else x for x in row) for row in rows.itertuples(index=False)]
+        cursor.executemany(insert_query, data)
+        if event_id >= 0:
+            inserted[int(event_id)] = max(cursor.rowcount, 0)
     cursor.close()
-    # print("db data insertion is successfull")
+    return inserted
 
 def check_blob_exists(container_name, blob_name):
     """
     Checks if a blob with the specified name exists in the Azure Blob Storage container.
+
+    Uses a single properties (HEAD) request on the blob instead of listing the container, whose size grows
+    by one file per day. The properties are kept in `blob_properties` so that the ETag can be compared with
+    the ingestion watermark and the download can reuse them.
     """
-    container_client = blob_service_client.get_container_client(container_name)
-    blob_list = container_client.list_blobs()
-    for blob in blob_list:
-        if blob.name == blob_name:
-            return True
-    return False
+    blob_client = get_blob_service_client().get_blob_client(container=container_name, blob=blob_name)
+    try:
+        blob_properties[blob_name] = blob_client.get_blob_properties()
+        return True
+    except ResourceNotFoundError:
+        blob_properties.pop(blob_name, None)
+        return False
 
 #-------------------------------------------------------------------------------------------------------
 # Main Function
@@ -251,27 +715,172 @@ def check_blob_exists(container_name, blob_name):
 
 def main():
     """
-    Main function that checks for the existence of the blob and processes it if available.
+    Main function that ingests the call event rows appended since the last run, from both log layouts.
+
+    The first run of a process also creates and reconciles the event summary table, even if there is
+    nothing new to ingest, and creates the ingestion state tables. The stored watermarks are read once per
+    run, for the change checks of both layouts.
     """
-    blob_exists = check_blob_exists(container_name, blob_name)
-    if blob_exists:
-        submain()
-    else:
+    with ingest_lock:
+        conn = get_db_connection()
+        if not conn:
+            print("Error: Could not establish a connection to the database")
+            return
+        try:
+            prepare_summary_table(conn)
+            prepare_ingest_tables(conn)
+            stored = stored_watermarks(conn)
+        finally:
+            conn.close()
+        ingest_daily_blobs(stored)
+        ingest_partitions(stored)
+
+def ingest_daily_blobs(stored):
+    """
+    Checks for the existence of the daily blob and processes it if available.
+
+    A daily blob written before append blobs were introduced is a Block Blob whose later rows are in its
+    Append Blob (see blob_operations.legacy_append_name); both are read as one. Blobs of previous days that
+    still have an ingestion state get a final pass first, so rows appended just before midnight are not
+    lost, and their state is then deleted (also if the blob has been deleted meanwhile). If the ETags match
+    the stored watermarks, nothing has been appended and the run ends without touching the database.
+
+    Args:
+        stored (dict): The stored watermarks, see stored_watermarks.
+    """
+    blob_name = get_current_csv_blob_name()
+    for previous_blob in sorted(name for name in stored if not name.startswith(call_log_prefix) and name != blob_name):
+        try:
+            submain(previous_blob, sorted(stored[previous_blob]))
+        except ResourceNotFoundError:
+            logging.warning(f"{previous_blob} no longer exists; dropping its ingestion state")
+        forget_ingest_states([previous_blob])
+
+    blob_names = [name for name in (blob_name, legacy_append_name(blob_name))
+                  if check_blob_exists(container_name, name)]
+    if not blob_names:
         return "blob is not available"
+    etags = stored.get(blob_name)
+    if etags and all(etags.get(name) == blob_properties[name].etag for name in blob_names):
+        for name in blob_names:
+            blob_properties.pop(name, None)
+        return "blob is unchanged"
+    submain(blob_name, blob_names)
 
-def submain():
+def ingest_partitions(stored):
     """
-    Sub-function that processes the downloaded blob data and updates the database.
+    Processes the parts of the partitioned call log (see call_log.py) that changed since the last run.
+
+    Yesterday is checked on every run, also when this process holds no manifests for it (after a restart
+    or a change of leader past midnight), so the rows appended just before midnight are not lost. Older
+    days still held in `manifest_states` or with a stored ingestion state get a final pass, and are then
+    forgotten together with the ingestion state of their partition groups.
+
+    Args:
+        stored (dict): The stored watermarks, see stored_watermarks.
+    """
+    now = datetime.now()
+    today = now.strftime('%Y-%m-%d')
+    yesterday = (now - timedelta(days=1)).strftime('%Y-%m-%d')
+    groups_by_date = {}
+    for group in stored:
+        if group.startswith(call_log_prefix):
+            groups_by_date.setdefault(group.rpartition('/date=')[2], []).append(group)
+    for date in sorted(set(manifest_states) | set(groups_by_date) | {yesterday}):
+        if date >= today:
+            continue
+        ingest_partition_day(date)
+        if date != yesterday:
+            manifest_states.pop(date, None)
+            forget_ingest_states(groups_by_date.get(date))
+    ingest_partition_day(today)
+
+def ingest_partition_day(date):
     """
-    dfs = download_blob_to_df()  # Download and process data into multiple DataFrames
+    Reads the manifests of a day and processes every partition group with a part that grew since the last run.
+
+    A group is the set of parts of one event and day; groups are processed independently, so the rows of a
+    busy event do not delay the other events, and a part is only downloaded once it has changed. A group
+    that fails is logged and retried on the next run, without stopping the groups after it.
+    """
+    previous = manifest_states.get(date, {})
+    manifest = read_manifests(date, previous)
+    seen = manifest['seen'] = previous.get('seen', {})
+    manifest_states[date] = manifest
+
+    changed = {}
+    for part, written in manifest['parts'].items():
+        group = partition_group(part)
+        if group and seen.get(part) != written:
+            changed.setdefault(group, []).append(part)
+    for group, parts in sorted(changed.items()):
+        try:
+            state = submain(group, sorted(parts))
+        except Exception as e:
+            logging.error(f"Error ingesting {group}: {e}")
+            continue
+        if not state:
+            continue
+        for part in parts:
+            # A part ending in an incomplete line is read again on the next run
+            if state['parts'][part]['etag'] is not None:
+                seen[part] = manifest['parts'][part]
+
+def submain(blob_name=None, parts=None):
+    """
+    Sub-function that processes the newly appended blob data and updates the database.
+
+    `blob_name` is the daily blob to read (with its legacy Append Blob, if any, in `parts`), or the name of
+    a partition group whose changed parts are given in `parts`. The ingestion state is read from MySQL and
+    written back in the transaction that inserts the bucket rows, so a failed run is retried from the same
+    watermark, by this process or by the next leader.
+
+    Returns:
+        dict or None: The ingestion state committed, or None if there is no database connection.
+    """
+    blob_name = blob_name or get_current_csv_blob_name()
     conn = get_db_connection()
-    # print("Here in blob_update submain func")
     if conn:
         try:
-            for table_name, df in dfs.items():
-                create_table_if_not_exists(conn, table_name)  # Ensure the table exists
-                insert_data_to_table(conn, df, table_name)  # Insert each DataFrame into its corresponding table
+            for table_name, _, _, _ in BUCKET_RULES:
+                prepare_table(conn, table_name)  # Ensure the table exists with its unique GUID index
+            prepare_summary_table(conn)
+            prepare_ingest_tables(conn)
+            state = load_ingest_state(conn, blob_name)
+            dfs = download_blob_to_df(conn, blob_name, parts or [blob_name], state)  # Download new rows into multiple DataFrames
+            labels = {table_name: label for table_name, _, _, label in BUCKET_RULES}
+            with db_update_stage_seconds.time(stage='insert'):
+                counts = {}
+                for table_name, df in dfs.items():
+                    inserted = insert_data_to_table(conn, df, table_name)  # Insert each DataFrame into its corresponding table
+                    counts.update({(event_id, labels[table_name]): calls for event_id, calls in inserted.items()})
+                update_event_summary(conn, counts)
+                save_ingest_state(conn, blob_name, state)
+                conn.commit()  # The bucket rows, their summary counts and the ingestion state are committed together
+            return state
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+    else:
+        print("Error: Could not establish a connection to the database")
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingests the new call event rows into the bucket tables.")
+    parser.add_argument('--migrate-guid-index', action='store_true',
+                        help="Move duplicate GUID rows of the bucket tables aside and add the unique GUID index.")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.migrate_guid_index:
+        conn = get_db_connection()
+        try:
+            for table_name, _, _, _ in BUCKET_RULES:
+                if check_table_exists(conn, table_name):
+                    migrate_guid_index(conn, table_name)
+            prepare_summary_table(conn)  # Recount the summary without the moved rows
         finally:
             conn.close()
     else:
-        print("Error: Could not establish a connection to the database")
\ No newline at end of file
+        main()
@@ -0,0 +1,402 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+dialer.py
+Description:
+Places outbound calls for a campaign in the background. A trigger request hands the list of calls to the
+dialer, gets a job ID back immediately, and the calls are made by a pool of worker threads.
+
+Content Overview:
+Rate Limiting: Keeps the call rate of all worker processes together within the Twilio account's calls per
+second (CPS), through a row of the MySQL database; a local token bucket takes over while MySQL is unreachable.
+Worker Pool: A thread pool with a configurable number of workers placing calls concurrently.
+Dial Jobs: Tracks the progress of each campaign (queued, dispatched, failed) by job ID. The process running a
+job writes its progress to MySQL, so any worker can report it.
+Metrics: The queue depth and the call outcomes, exported on /metrics.
+
+Settings (see config.py): dialer_max_workers, twilio_calls_per_second, dialer_job_retention_seconds,
+dial_rate_limit_table, dial_job_table and dial_job_save_interval_seconds.
+A job runs in the process that started it; if that worker is restarted, the job stops and its row keeps
+the status 'running'.
+
+"""
+
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from .twilio_calls import place_call
+from .db_connect import db_connection, db_cursor
+from .metrics import Gauge, dialer_calls_total
+from .config import (dialer_max_workers, twilio_calls_per_second, dialer_job_retention_seconds, dial_rate_limit_table,
+                     dial_job_table, dial_job_save_interval_seconds)
+
+# Columns of the dial job table, by key of the job dicts
+JOB_COLUMNS = {
+    'job_id': 'Job_ID',
+    'description': 'Description',
+    'status': 'Status',
+    'total': 'Total',
+    'queued': 'Queued',
+    'dispatched': 'Dispatched',
+    'failed': 'Failed',
+    'started_at': 'Started_At',
+    'finished_at': 'Finished_At',
+}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiting how many operations may start per second.
+
+    Args:
+        rate (float): Tokens added per second.
+        capacity (float, optional): Maximum number of tokens stored, i.e. the allowed burst. Defaults to `rate`.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Blocks until a token is available and takes it.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class SharedRateLimiter:
+    """
+    Rate limiter shared by every worker process and host through a row of the MySQL database.
+
+    Each call reserves the next free start time with a compare-and-set update of the row and then sleeps until
+    that time, so the connection is not held while waiting. After MAX_RESERVE_ATTEMPTS lost updates in a row,
+    the call is limited locally instead. After an idle period up to `capacity` calls may
+    start at once. Start times come from the clocks of the hosts, which are expected to be in sync (NTP).
+    While the database cannot be reached, a local TokenBucket limits the calls of this process.
+
+    Args:
+        rate (float): Calls allowed per second.
+        capacity (float, optional): The allowed burst. Defaults to `rate`.
+        table (str, optional): Name of the table holding the limiter state.
+        name (str, optional): Key of the row of this limiter.
+    """
+
+    MAX_RESERVE_ATTEMPTS = 10
+
+    def __init__(self, rate, capacity=None, table=dial_rate_limit_table, name='twilio'):
+        self.fallback = TokenBucket(rate, capacity)
+        self.interval_us = int(1000000 / rate)
+        self.burst_us = int((self.fallback.capacity - 1) * self.interval_us)
+        self.table = table
+        self.name = name
+        self.table_ready = False
+
+    def _reserve(self, conn):
+        """
+        Reserves the next start time. Returns (start, now) in microseconds since the epoch.
+
+        Raises:
+            RuntimeError: If every attempt lost its compare-and-set to another worker.
+        """
+        cursor = conn.cursor()
+        try:
+            if not self.table_ready:
+                cursor.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {self.table} (
+                        Name VARCHAR(64) PRIMARY KEY,
+                        Next_Start_Us BIGINT NOT NULL
+                    )
+                ''')
+                cursor.execute(f'INSERT IGNORE INTO {self.table} (Name, Next_Start_Us) VALUES (%s, 0)', (self.name,))
+                conn.commit()
+                self.table_ready = True
+            for _ in range(self.MAX_RESERVE_ATTEMPTS):
+                cursor.execute(f'SELECT Next_Start_Us FROM {self.table} WHERE Name = %s', (self.name,))
+                current = cursor.fetchone()[0]
+                now = int(time.time() * 1000000)
+                start = max(current, now - self.burst_us)
+                cursor.execute(
+                    f'UPDATE {self.table} SET Next_Start_Us = %s WHERE Name = %s AND Next_Start_Us = %s',
+                    (start + self.interval_us, self.name, current)
+                )
+                reserved = cursor.rowcount == 1
+                # Commit either way, so the next SELECT does not read the old snapshot
+                conn.commit()
+                if reserved:
+                    return start, now
+            raise RuntimeError(f"no start time reserved after {self.MAX_RESERVE_ATTEMPTS} attempts")
+        finally:
+            cursor.close()
+
+    def acquire(self):
+        """
+        Blocks until this process may start a call.
+        """
+        try:
+            with db_connection() as conn:
+                start, now = self._reserve(conn)
+        except Exception as e:
+            logging.warning(f"Shared dial rate limit unavailable, limiting this process only: {e}")
+            self.fallback.acquire()
+            return
+        if start > now:
+            time.sleep((start - now) / 1000000)
+
+
+rate_limiter = SharedRateLimiter(twilio_calls_per_second)
+
+_executor = None
+_executor_lock = threading.Lock()
+_jobs = {}
+_jobs_lock = threading.Lock()
+# Serialises the writes of job progress, so an older snapshot never overwrites a newer one
+_save_lock = threading.Lock()
+_job_table_ready = False
+
+
+def _get_executor():
+    """
+    Returns the shared worker pool, creating it on first use.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=dialer_max_workers, thread_name_prefix='dialer')
+        return _executor
+
+
+def _prune_jobs():
+    """
+    Forgets finished jobs older than `dialer_job_retention_seconds`. Must be called with `_jobs_lock` held.
+    """
+    cutoff = time.time() - dialer_job_retention_seconds
+    for job_id in [job_id for job_id, job in _jobs.items() if job['finished_ts'] and job['finished_ts'] < cutoff]:
+        del _jobs[job_id]
+
+
+def _prepare_job_table(cursor):
+    """
+    Creates the dial job table on first use in this process.
+    """
+    global _job_table_ready
+    if _job_table_ready:
+        return
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {dial_job_table} (
+            Job_ID VARCHAR(32) PRIMARY KEY,
+            Description VARCHAR(255),
+            Status VARCHAR(16) NOT NULL,
+            Total INT,
+            Queued INT NOT NULL,
+            Dispatched INT NOT NULL,
+            Failed INT NOT NULL,
+            Started_At DATETIME NOT NULL,
+            Finished_At DATETIME,
+            INDEX idx_finished_at (Finished_At)
+        )
+    ''')
+    _job_table_ready = True
+
+
+def _save_job(job, force=False):
+    """
+    Writes the progress of a job to the dial job table, at most every `dial_job_save_interval_seconds` unless
+    `force` is set. Only the process running the job writes its row; errors are logged.
+    """
+    if not _save_lock.acquire(blocking=force):
+        return
+    try:
+        now = time.monotonic()
+        with _jobs_lock:
+            if not force and now - job['saved_ts'] < dial_job_save_interval_seconds:
+                return
+            job['saved_ts'] = now
+            row = tuple(job[key] for key in JOB_COLUMNS)
+        columns = ', '.join(JOB_COLUMNS.values())
+        updates = ', '.join(f'{column} = VALUES({column})' for column in list(JOB_COLUMNS.values())[1:])
+        with db_cursor() as cursor:
+            _prepare_job_table(cursor)
+            cursor.execute(
+                f'''INSERT INTO {dial_job_table} ({columns}) VALUES ({', '.join(['%s'] * len(JOB_COLUMNS))})
+                    ON DUPLICATE KEY UPDATE {updates}''',
+                row
+            )
+    except Exception as e:
+        logging.error(f"Error saving progress of dial job {job['job_id']}: {e}")
+    finally:
+        _save_lock.release()
+
+
+def _purge_saved_jobs():
+    """
+    Deletes finished jobs older than `dialer_job_retention_seconds` from the dial job table.
+    """
+    cutoff = datetime.fromtimestamp(time.time() - dialer_job_retention_seconds).strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        with db_cursor() as cursor:
+            _prepare_job_table(cursor)
+            cursor.execute(f'DELETE FROM {dial_job_table} WHERE Finished_At < %s', (cutoff,))
+    except Exception as e:
+        logging.error(f"Error purging old dial jobs: {e}")
+
+
+def _update_job(job, **increments):
+    """
+    Adds the given increments to the counters of a job and saves its progress if it is due.
+    """
+    with _jobs_lock:
+        for key, value in increments.items():
+            job[key] += value
+    _save_job(job)
+
+
+def _dial(job, call_kwargs):
+    """
+    Places a single call for a job once the rate limiter allows it.
+    """
+    rate_limiter.acquire()
+    try:
+        place_call(**call_kwargs)
+        _update_job(job, dispatched=1)
+        dialer_calls_total.inc(outcome='dispatched')
+    except Exception as e:
+        logging.error(f"Dial job {job['job_id']}: call to {call_kwargs.get('attendee_phonenumber')} failed: {e}")
+        _update_job(job, failed=1)
+        dialer_calls_total.inc(outcome='failed')
+
+
+def _run_job(job, calls):
+    """
+    Feeds the calls of a job to the worker pool and marks the job finished once every call has been placed.
+
+    At most twice the number of workers calls are queued at any time, so a large or streamed list of
+    calls is never materialised in full.
+    """
+    executor = _get_executor()
+    in_flight = threading.BoundedSemaphore(dialer_max_workers * 2)
+    futures = []
+    try:
+        for call_kwargs in calls:
+            in_flight.acquire()
+            # Counted before it is submitted, so a fast _dial never makes the queue depth negative
+            _update_job(job, queued=1)
+            future = executor.submit(_dial, job, call_kwargs)
+            future.add_done_callback(lambda _: in_flight.release())
+            futures.append(future)
+        for future in futures:
+            future.result()
+        status = 'completed'
+    except Exception as e:
+        logging.error(f"Dial job {job['job_id']} aborted: {e}")
+        status = 'error'
+    with _jobs_lock:
+        job['status'] = status
+        job['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        job['finished_ts'] = time.time()
+    _save_job(job, force=True)
+    logging.info(f"Dial job {job['job_id']} {status}: {job['dispatched']} dispatched, {job['failed']} failed.")
+
+
+def start_dial_job(calls, description='', total=None):
+    """
+    Starts placing the given calls in the background and returns immediately.
+
+    Args:
+        calls (iterable): Keyword-argument dicts for `place_call`, one per call. May be a generator; it is
+            consumed on a background thread.
+        description (str, optional): Free text shown with the job progress, e.g. the event and call type.
+        total (int, optional): Number of calls, for progress reporting when `calls` is a generator.
+
+    Returns:
+        str: The ID of the new dial job, to be passed to `get_dial_job`.
+    """
+    job_id = uuid.uuid4().hex
+    job = {
+        'job_id': job_id,
+        'description': description,
+        'status': 'running',
+        'total': len(calls) if hasattr(calls, '__len__') else total,
+        'queued': 0,
+        'dispatched': 0,
+        'failed': 0,
+        'started_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'finished_at': None,
+        'finished_ts': None,
+        'saved_ts': 0,
+    }
+    with _jobs_lock:
+        _prune_jobs()
+        _jobs[job_id] = job
+    _purge_saved_jobs()
+    _save_job(job, force=True)
+
+    feeder = threading.Thread(target=_run_job, args=(job, calls), name=f'dial-job-{job_id[:8]}')
+    feeder.daemon = True
+    feeder.start()
+    return job_id
+
+
+def get_dial_job(job_id):
+    """
+    Returns the progress of a dial job, from memory if this process runs the job and otherwise from the dial
+    job table, where it is at most `dial_job_save_interval_seconds` old.
+
+    Args:
+        job_id (str): The ID returned by `start_dial_job`.
+
+    Returns:
+        dict or None: A snapshot of the job counters and status, or None if the job is unknown.
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            return {key: job[key] for key in JOB_COLUMNS}
+    try:
+        with db_cursor(dictionary=True) as cursor:
+            _prepare_job_table(cursor)
+            cursor.execute(f"SELECT {', '.join(JOB_COLUMNS.values())} FROM {dial_job_table} WHERE Job_ID = %s",
+                           (job_id,))
+            row = cursor.fetchone()
+    except Exception as e:
+        logging.error(f"Error reading dial job {job_id}: {e}")
+        return None
+    if row is None:
+        return None
+    job = {key: row[column] for key, column in JOB_COLUMNS.items()}
+    for key in ('started_at', 'finished_at'):
+        if job[key] is not None:
+            job[key] = str(job[key])
+    return job
+
+
+def get_queue_depth():
+    """
+    Returns the number of calls handed to the worker pool but not placed yet, over all running jobs.
+    """
+    with _jobs_lock:
+        return sum(job['queued'] - job['dispatched'] - job['failed']
+                   for job in _jobs.values() if job['status'] == 'running')
+
+
+dialer_queue_depth = Gauge('callbot_dialer_queue_depth', 'Calls waiting in the dialer worker pool.',
+                           callback=get_queue_depth)
@@ -0,0 +1,106 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+event_cache.py
+Description:
+Caches the list of events shown on the dashboard, so open dashboards polling `/get_events` do not query the
+registration table on every request.
+
+Content Overview:
+Event List Cache: The event list with its ETag and Last-Modified time, reloaded after event_list_cache_ttl_seconds
+or as soon as an event is saved through this process.
+Search and Paging: Filtering of the cached list by a search term and slicing it into pages.
+
+Settings (see config.py): event_list_cache_ttl_seconds. Other worker processes pick up a new event when
+their cached copy expires.
+
+"""
+
+import hashlib
+import json
+import threading
+import time
+from .db_connect import db_cursor
+from .config import registration_table, event_list_cache_ttl_seconds
+
+event_list = None
+event_list_loaded_at = 0
+event_list_lock = threading.Lock()
+
+
+def load_event_list():
+    """
+    Reads the event list from the database.
+
+    Returns:
+        dict: 'events' (list of dicts with eventID, eventName, eventLocation and eventDate), 'etag' (a hash
+        of the list) and 'last_modified' (the newest insert_time, or None if there are no events).
+    """
+    with db_cursor(dictionary=True) as cursor:
+        cursor.execute(f"SELECT eventID, eventName, eventLocation, eventDate, insert_time FROM {registration_table}")
+        rows = cursor.fetchall()
+    last_modified = max((row.pop('insert_time') for row in rows if row.get('insert_time')), default=None)
+    events = [{key: row[key] for key in ('eventID', 'eventName', 'eventLocation', 'eventDate')} for row in rows]
+    etag = hashlib.md5(json.dumps(events, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return {'events': events, 'etag': etag, 'last_modified': last_modified}
+
+
+def get_event_list():
+    """
+    Returns the cached event list, reloading it from the database if it is older than the TTL.
+
+    Only one thread reloads the list at a time; the others wait for it and share the result.
+
+    Returns:
+        dict: See `load_event_list`. The returned dict must not be modified.
+    """
+    global event_list, event_list_loaded_at
+    snapshot = event_list
+    if snapshot is not None and time.monotonic() - event_list_loaded_at < event_list_cache_ttl_seconds:
+        return snapshot
+    with event_list_lock:
+        if event_list is not None and time.monotonic() - event_list_loaded_at < event_list_cache_ttl_seconds:
+            return event_list
+        event_list = load_event_list()
+        event_list_loaded_at = time.monotonic()
+        return event_list
+
+
+def invalidate_event_list():
+    """
+    Drops the cached event list, so the next request reads it from the database again.
+    """
+    global event_list
+    with event_list_lock:
+        event_list = None
+
+
+def search_events(events, query):
+    """
+    Returns the events whose name or location contains the search term, ignoring case.
+    """
+    if not query:
+        return events
+    query = query.lower()
+    return [event for event in events
+            if query in str(event['eventName']).lower() or query in str(event['eventLocation']).lower()]
+
+
+def paginate(items, page, per_page):
+    """
+    Returns one page of a list.
+
+    Args:
+        items (list): The full list.
+        page (int): The 1-based page number.
+        per_page (int or None): The page size, or None for the whole list.
+    """
+    if not per_page:
+        return items
+    start = (page - 1) * per_page
+    return items[start:start + per_page]
@@ -0,0 +1,365 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+event_journal.py
+Description:
+Buffers call event rows in memory and writes them to Azure Blob Storage in batches from a background thread.
+Webhook handlers only enqueue a row, so the TwiML response does not wait on the storage account.
+
+Content Overview:
+Event Queue: A bounded in-process queue that the request handlers write rows into.
+Background Flusher: A daemon thread that appends queued rows to their blob every N rows or M milliseconds.
+Spill Files: Local write-ahead segments holding every queued row that has not been written to blob storage
+yet. The flusher starts a new segment for every batch and deletes a segment once all of its rows have been
+written, so the files stay small under sustained load and a crash replays only the unwritten rows (at worst
+the rest of a segment whose batch was partly written).
+Crash Recovery: Spill segments left behind by a process that died are replayed on start-up.
+Full Queue: A row that does not fit in the queue is spilled all the same and written at once from the calling
+thread; if that write fails, the row stays in the segment and is replayed once this process has exited.
+
+Settings (see config.py): journal_batch_size, journal_flush_interval_ms, journal_queue_size,
+journal_spill_dir and journal_fsync.
+
+Recovering spill files of other (dead) processes relies on `fcntl` file locks and is skipped on
+platforms without it; a process always flushes its own spill file.
+
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from .blob_operations import write_csv_header, append_to_blob
+from .call_log import record_appends
+from .config import (journal_batch_size, journal_flush_interval_ms, journal_queue_size,
+                     journal_spill_dir, journal_fsync)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Back-off (seconds) applied when a batch could not be written, capped at the maximum
+RETRY_BACKOFF_INITIAL = 0.5
+RETRY_BACKOFF_MAX = 30.0
+
+# Queued rows are (blob_name, data, spill segment path) tuples
+_queue = queue.Queue(maxsize=journal_queue_size)
+_spill_lock = threading.Lock()
+_start_lock = threading.Lock()
+_stop_event = threading.Event()
+# Open spill segments of this process: path -> {'file', 'rows' not yet written to blob storage}
+_segments = {}
+# Segment new rows are spilled to
+_active_segment = None
+_flusher_thread = None
+_started_pid = None
+
+
+def _open_spill_file():
+    """
+    Creates a spill segment of this process and takes an exclusive lock on it, marking it as in use.
+    """
+    os.makedirs(journal_spill_dir, exist_ok=True)
+    path = os.path.join(journal_spill_dir, f"journal-{os.getpid()}-{uuid.uuid4().hex[:8]}.spill")
+    spill_file = open(path, 'a', encoding='utf-8')
+    if fcntl:
+        fcntl.flock(spill_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    return spill_file
+
+
+def _release_segment_if_written(path):
+    """
+    Deletes a segment that is no longer active once all of its rows have been written. Must be called with
+    `_spill_lock` held.
+    """
+    segment = _segments.get(path)
+    if segment is None or path == _active_segment or segment['rows'] > 0:
+        return
+    segment['file'].close()
+    os.remove(path)
+    del _segments[path]
+
+
+def _rotate_spill():
+    """
+    Makes a new segment the active one, unless the active segment is still empty. Must be called with
+    `_spill_lock` held.
+    """
+    global _active_segment
+    if _active_segment is not None and _segments[_active_segment]['file'].tell() == 0:
+        return
+    previous = _active_segment
+    spill_file = _open_spill_file()
+    _segments[spill_file.name] = {'file': spill_file, 'rows': 0}
+    _active_segment = spill_file.name
+    _release_segment_if_written(previous)
+
+
+def _write_spill(records):
+    """
+    Appends records to the active segment and returns its path. Must be called with `_spill_lock` held.
+    """
+    segment = _segments[_active_segment]
+    segment['file'].write(''.join(json.dumps({'blob': blob_name, 'data': data}) + '\n'
+                                  for blob_name, data in records))
+    segment['file'].flush()
+    if journal_fsync:
+        os.fsync(segment['file'].fileno())
+    segment['rows'] += len(records)
+    return _active_segment
+
+
+def _mark_written(rows):
+    """
+    Records that queued rows have reached blob storage, deleting the segments that are fully written.
+    """
+    with _spill_lock:
+        paths = set()
+        for _, _, path in rows:
+            if path in _segments:  # Rows queued before a fork were spilled by the parent process
+                _segments[path]['rows'] -= 1
+                paths.add(path)
+        for path in paths:
+            _release_segment_if_written(path)
+
+
+def _replay_orphaned_spill_files():
+    """
+    Re-queues the rows found in spill files whose owning process is no longer running.
+
+    A spill file whose lock can be acquired belongs to a process that exited before flushing. Its rows
+    are copied into this process's spill segment and queue (or written at once if the queue is full), then
+    the orphaned file is removed. A row whose immediate write fails stays in this process's segment, so
+    every row of the orphan is either queued, written or spilled again before the orphan is deleted.
+    """
+    if not fcntl:
+        return
+    for path in glob.glob(os.path.join(journal_spill_dir, 'journal-*.spill')):
+        if path in _segments:
+            continue
+        try:
+            with open(path, 'r+', encoding='utf-8') as orphan:
+                try:
+                    fcntl.flock(orphan.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    continue  # Still owned by a live process
+                records = []
+                for line in orphan:
+                    line = line.strip()
+                    if line:
+                        record = json.loads(line)
+                        records.append((record['blob'], record['data']))
+                for blob_name, data in records:
+                    queued, segment = _enqueue(blob_name, data)
+                    if not queued and _write_now(blob_name, data):
+                        _mark_written([(blob_name, data, segment)])
+                os.remove(path)
+                if records:
+                    logging.info(f"Recovered {len(records)} call event rows from {path}.")
+        except Exception as e:
+            logging.error(f"Error replaying journal spill file {path}: {e}")
+
+
+def _write_batch(rows):
+    """
+    Appends a batch of rows to blob storage, one append per blob, then updates the call log manifests and
+    the spill segments.
+
+    Args:
+        rows (list): Queued (blob_name, data, segment) tuples in the order they were enqueued.
+
+    Returns:
+        list: The rows that could not be written and must be retried.
+    """
+    by_blob = {}
+    for row in rows:
+        by_blob.setdefault(row[0], []).append(row)
+
+    failed = []
+    written = []
+    appended = {}
+    for blob_name, blob_rows in by_blob.items():
+        write_csv_header(blob_name)
+        payload = ''.join(data for _, data, _ in blob_rows).encode('utf-8')
+        if append_to_blob(blob_name, payload):
+            appended[blob_name] = len(payload)
+            written.extend(blob_rows)
+        else:
+            failed.extend(blob_rows)
+    if appended:
+        record_appends(appended)
+    _mark_written(written)
+    return failed
+
+
+def _flush_loop():
+    """
+    Body of the background flusher thread.
+
+    Collects rows from the queue until either `journal_batch_size` rows are pending or
+    `journal_flush_interval_ms` has elapsed, then writes them. Rows queued from then on go to a new spill
+    segment. Rows that fail to write are kept and retried with exponential back-off, ahead of newer rows
+    so the order within a blob is preserved.
+    """
+    pending = []
+    backoff = RETRY_BACKOFF_INITIAL
+    interval = journal_flush_interval_ms / 1000.0
+    while True:
+        deadline = time.monotonic() + interval
+        while len(pending) < journal_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending.append(_queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        if pending:
+            with _spill_lock:
+                _rotate_spill()
+            pending = _write_batch(pending)
+            if pending:
+                logging.warning(f"Journal flush failed for {len(pending)} rows, retrying in {backoff}s.")
+                if _stop_event.wait(backoff):
+                    break
+                backoff = min(backoff * 2, RETRY_BACKOFF_MAX)
+                continue
+            backoff = RETRY_BACKOFF_INITIAL
+
+        if _stop_event.is_set() and _queue.empty():
+            break
+
+
+def _ensure_started():
+    """
+    Starts the flusher thread in the current process on first use.
+
+    The thread is started lazily (and again after a fork) so that a pre-forking server such as
+    gunicorn gets one flusher per worker process.
+    """
+    global _active_segment, _flusher_thread, _started_pid
+    if _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        with _spill_lock:
+            # Segments inherited through a fork belong to the parent process
+            _segments.clear()
+            _active_segment = None
+            _rotate_spill()
+        _stop_event.clear()
+        _flusher_thread = threading.Thread(target=_flush_loop, name='event-journal-flusher')
+        _flusher_thread.daemon = True
+        _flusher_thread.start()
+        _started_pid = os.getpid()
+        _replay_orphaned_spill_files()
+
+
+def _enqueue(blob_name, data):
+    """
+    Records a row in the spill file and queues it for the flusher if there is room.
+
+    Only this function adds to the queue, with `_spill_lock` held, so a queue found not full has room for
+    the row. A row that does not fit is spilled all the same; the caller writes it at once and marks it
+    written with `_mark_written` if that succeeds.
+
+    Returns:
+        tuple: (queued, segment path). `queued` is False if the queue is full and the row must be written
+        synchronously.
+    """
+    with _spill_lock:
+        segment = _write_spill([(blob_name, data)])
+        if _queue.full():
+            return False, segment
+        _queue.put_nowait((blob_name, data, segment))
+        return True, segment
+
+
+def _write_now(blob_name, data):
+    """
+    Appends a single row to blob storage from the calling thread.
+
+    Returns:
+        bool: True if the row was written.
+    """
+    write_csv_header(blob_name)
+    payload = data.encode('utf-8')
+    if not append_to_blob(blob_name, payload):
+        return False
+    record_appends({blob_name: len(payload)})
+    return True
+
+
+def log_call_event(blob_name, data):
+    """
+    Queues a call event row to be appended to the given blob by the background flusher.
+
+    The row is first written to the local spill file, so it survives a crash of the process before it
+    reaches blob storage. If the queue is full the row is written synchronously instead; if that fails it
+    is kept in the spill file and replayed once this process has exited.
+
+    Args:
+        blob_name (str): The name of the CSV blob the row belongs to.
+        data (str): The CSV row, including the trailing newline.
+
+    Returns:
+        None
+    """
+    segment = None
+    try:
+        _ensure_started()
+        queued, segment = _enqueue(blob_name, data)
+        if queued:
+            return
+        logging.warning("Call event journal queue is full, writing row synchronously.")
+    except Exception as e:
+        logging.error(f"Error queueing call event: {e}")
+    if _write_now(blob_name, data):
+        if segment is not None:
+            _mark_written([(blob_name, data, segment)])
+    elif segment is not None:
+        logging.error(f"Call event row kept in {segment} for replay after the write failed.")
+
+
+def flush(timeout=None):
+    """
+    Stops the flusher after it has written every queued row.
+
+    Args:
+        timeout (float, optional): Maximum number of seconds to wait for the flusher to finish.
+
+    Returns:
+        bool: True if the flusher finished within the timeout (or was never started).
+    """
+    global _started_pid
+    if _started_pid != os.getpid() or _flusher_thread is None:
+        return True
+    _stop_event.set()
+    _flusher_thread.join(timeout)
+    if _flusher_thread.is_alive():
+        return False
+    with _spill_lock:
+        # Closing releases the locks, so rows left behind by a failed flush are replayed by the next process
+        for path, segment in list(_segments.items()):
+            segment['file'].close()
+            if segment['rows'] == 0:
+                os.remove(path)
+        _segments.clear()
+        _started_pid = None
+    return True
+
+
+atexit.register(flush, 10)
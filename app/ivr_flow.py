@@ -0,0 +1,192 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+ivr_flow.py
+Description:
+Describes the IVR menus of a call as data and executes them. Each menu is a node; the digit pressed on a node
+selects a transition, which names the next node and the outcome logged for the call. All menus are served by
+the single `/ivr/<node>` webhook, so a new menu is a change to the flow, not a new route.
+
+Content Overview:
+Flow Definition: DEFAULT_FLOW, or a JSON file with the same structure named by ivr_flow_file.
+Validation: Checks that the start node and every transition target exist and can be spoken.
+Execution: Resolves a key press to the next node, its TwiML and the outcome label.
+Timing: Per-node request counts and durations for the webhook.
+
+A flow has the following structure:
+
+    {
+        "start": "invitation",
+        "invalid": {"say": "You did not press a valid option.", "outcome": "Invalid option"},
+        "nodes": {
+            "invitation": {"gather": {"1": {"next": "accepted", "outcome": "Invite Accepted"}}},
+            "accepted": {"say": "Thank you for accepting the invitation."}
+        }
+    }
+
+The start node has no "say": its prompt is the per-event invitation rendered by the /voice webhook. A node
+with a "gather" reads one digit and posts it to /ivr/<node>; a node without one ends the call after its prompt.
+
+"""
+
+import json
+import logging
+import threading
+from .twiml_cache import prompt_twiml
+from .metrics import ivr_node_seconds
+from .config import ivr_flow_file
+
+DEFAULT_FLOW = {
+    'start': 'invitation',
+    'invalid': {'say': "You did not press a valid option.", 'outcome': 'Invalid option'},
+    'nodes': {
+        'invitation': {
+            'gather': {
+                '1': {'next': 'accepted', 'outcome': 'Invite Accepted'},
+                '2': {'next': 'callback', 'outcome': 'Request Callback'},
+            },
+        },
+        'accepted': {
+            'say': "Thank you for accepting the invitation. Would you like to utilize our pickup and drop-off service for this event? If yes, press 1. If no, press 2.",
+            'gather': {
+                '1': {'next': 'pickup_accepted', 'outcome': 'Pickup and Drop Accepted'},
+                '2': {'next': 'pickup_declined', 'outcome': 'Pickup and Drop Declined'},
+            },
+        },
+        'callback': {
+            'say': "You have requested a callback. We will reach out to you later. Thank you and Good day.",
+        },
+        'pickup_accepted': {
+            'say': "To arrange the pickup and drop-off service, please specify your preferred address. For office address, press 1. For home address, press 2.",
+            'gather': {
+                '1': {'next': 'office_address', 'outcome': 'Office Address'},
+                '2': {'next': 'home_address', 'outcome': 'Home Address'},
+            },
+        },
+        'pickup_declined': {
+            'say': "You have declined the pickup and drop-off service. Thank you & Good day.",
+        },
+        'office_address': {
+            'say': "You have chosen the office address for pickup and drop-off. Thank you & Good day.",
+        },
+        'home_address': {
+            'say': "You have chosen the home address for pickup and drop-off. Thank you & Good day.",
+        },
+    },
+}
+
+
+def validate_flow(flow):
+    """
+    Checks the structure of a flow.
+
+    Raises:
+        ValueError: If the start node is missing, a transition points to an unknown node or to a node without
+        a prompt, or the invalid-input prompt is missing.
+    """
+    nodes = flow.get('nodes') or {}
+    if flow.get('start') not in nodes:
+        raise ValueError(f"IVR flow start node {flow.get('start')!r} is not defined")
+    if not (flow.get('invalid') or {}).get('say'):
+        raise ValueError("IVR flow has no 'invalid' prompt")
+    for name, node in nodes.items():
+        for digit, transition in (node.get('gather') or {}).items():
+            target = transition.get('next')
+            if target not in nodes:
+                raise ValueError(f"IVR node {name!r}: digit {digit} leads to unknown node {target!r}")
+            if not nodes[target].get('say'):
+                raise ValueError(f"IVR node {name!r}: digit {digit} leads to node {target!r}, which has no prompt")
+            if not transition.get('outcome'):
+                raise ValueError(f"IVR node {name!r}: digit {digit} has no outcome")
+
+
+def load_flow(path=None):
+    """
+    Loads the IVR flow from a JSON file, or returns DEFAULT_FLOW if no file is configured.
+
+    Args:
+        path (str, optional): Path of the JSON flow file.
+
+    Returns:
+        dict: The validated flow.
+    """
+    if path:
+        with open(path, encoding='utf-8') as f:
+            flow = json.load(f)
+        logging.info(f"Loaded IVR flow from {path} ({len(flow.get('nodes') or {})} nodes).")
+    else:
+        flow = DEFAULT_FLOW
+    validate_flow(flow)
+    return flow
+
+
+flow = load_flow(ivr_flow_file)
+
+node_timings = {}
+node_timings_lock = threading.Lock()
+
+
+def node_url(name):
+    """
+    Returns the webhook path a node's key press is posted to.
+    """
+    return f'/ivr/{name}'
+
+
+def node_twiml(name):
+    """
+    Returns the TwiML of a node: its prompt, wrapped in a one-digit Gather if the node has transitions.
+    """
+    node = flow['nodes'][name]
+    action = node_url(name) if node.get('gather') else None
+    return prompt_twiml(('ivr', name), node['say'], action)
+
+
+def handle_input(name, digit):
+    """
+    Resolves a key press on a node.
+
+    Args:
+        name (str): The node whose Gather the digit was entered on.
+        digit (str): The digit pressed, or None if nothing was entered.
+
+    Returns:
+        tuple: (outcome, twiml, valid), where `outcome` is the label logged for the call, `twiml` the
+        response to return to Twilio and `valid` whether the digit matched a transition.
+
+    Raises:
+        KeyError: If the node does not exist.
+    """
+    transition = (flow['nodes'][name].get('gather') or {}).get(digit)
+    if transition is None:
+        invalid = flow['invalid']
+        return invalid.get('outcome', 'Invalid option'), prompt_twiml(('ivr_invalid',), invalid['say']), False
+    return transition['outcome'], node_twiml(transition['next']), True
+
+
+def record_node_timing(name, seconds):
+    """
+    Adds one request on a node to the per-node timing statistics.
+    """
+    with node_timings_lock:
+        stats = node_timings.setdefault(name, {'count': 0, 'total_seconds': 0.0, 'max_seconds': 0.0})
+        stats['count'] += 1
+        stats['total_seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+    ivr_node_seconds.observe(seconds, node=name)
+
+
+def get_node_timings():
+    """
+    Returns a snapshot of the per-node timing statistics.
+
+    Returns:
+        dict: node name -> {'count', 'total_seconds', 'max_seconds'}.
+    """
+    with node_timings_lock:
+        return {name: dict(stats) for name, stats in node_timings.items()}
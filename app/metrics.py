@@ -0,0 +1,402 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+metrics.py
+Description:
+Collects latency and throughput metrics and renders them in the Prometheus text exposition format for the
+`/metrics` endpoint.
+
+Content Overview:
+Metric Types: Counters, gauges (set directly or computed when scraped) and histograms with labels.
+Application Metrics: The metrics recorded by the routes, blob appends, db_update stages, the dialer and
+the Twilio API calls, defined in one place below.
+Worker Processes: Each process writes its series to its own file in METRICS_DIR every few seconds, and
+`render_metrics` adds up the files of all processes, so a scrape answered by any gunicorn worker reports the
+whole server. Counters and histograms of workers that have exited are kept, so totals never go down when
+gunicorn replaces a worker; gauges only count live processes whose file is current, so a pid reused by another
+process does not count.
+Exposition: `render_metrics` returns every metric as Prometheus text.
+
+Settings (see config.py):
+METRICS_DIR: The shared directory. Files are only written if it is set; unset keeps each process's metrics
+to itself.
+METRICS_WRITE_INTERVAL_SECONDS: Seconds between the writes of a process's file.
+
+The directory must be emptied when the server starts, which gunicorn.conf.py and run.py do with
+`clear_metrics_dir`; other hosts must do the same, or their counters add up over every run.
+
+"""
+
+import atexit
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from .config import metrics_dir, metrics_write_interval_seconds
+
+# Default latency buckets in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Size buckets in bytes, up to the 4 MiB append block limit
+BYTES_BUCKETS = (128, 256, 512, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+registry = []
+
+# File this process writes its series to, and whether its writer thread runs (both reset after a fork)
+process_file = None
+writer_started = False
+writer_lock = threading.Lock()
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base class of the metric types: a named family of time series, one per combination of label values.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The help text.
+        labelnames (tuple, optional): The names of the labels.
+    """
+
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.series = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def snapshot(self):
+        """
+        Returns the series of this process as a JSON-serialisable list of [label values, value].
+        """
+        with self.lock:
+            return [[list(key), value] for key, value in self.series.items()]
+
+    def merge(self, series, key, value):
+        """
+        Adds the value of one series of another process to `series`.
+        """
+        series[key] = series.get(key, 0) + value
+
+    def samples(self, series=None):
+        """
+        Yields (suffix, label values, extra label, value) for every sample of the metric, from `series` if
+        given (the series merged across processes) or else from this process.
+        """
+        if series is None:
+            with self.lock:
+                series = dict(self.series)
+        for key, value in series.items():
+            yield '', key, None, value
+
+    def render(self, series=None):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        for suffix, key, extra, value in self.samples(series):
+            lines.append(f'{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, e.g. the number of failed calls.
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        _ensure_writer()
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. If `callback` is given, it is called at scrape time and returns the value.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), callback=None):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def set(self, value, **labels):
+        _ensure_writer()
+        with self.lock:
+            self.series[self._key(labels)] = value
+
+    def snapshot(self):
+        if self.callback is not None:
+            return [[[], self.callback()]]
+        return super().snapshot()
+
+    def samples(self, series=None):
+        if series is None and self.callback is not None:
+            yield '', (), None, self.callback()
+            return
+        yield from super().samples(series)
+
+
+class Histogram(Metric):
+    """
+    Counts observations (e.g. durations) in cumulative buckets, with their sum and count.
+
+    Args:
+        buckets (tuple, optional): Upper bounds of the buckets. Defaults to DEFAULT_BUCKETS.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        _ensure_writer()
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][index] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Context manager observing the duration of the `with` block in seconds.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(key), {'buckets': list(series['buckets']), 'sum': series['sum'], 'count': series['count']}]
+                    for key, series in self.series.items()]
+
+    def merge(self, series, key, value):
+        if len(value['buckets']) != len(self.buckets):
+            return
+        target = series.get(key)
+        if target is None:
+            target = series[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        target['buckets'] = [a + b for a, b in zip(target['buckets'], value['buckets'])]
+        target['sum'] += value['sum']
+        target['count'] += value['count']
+
+    def samples(self, series=None):
+        if series is None:
+            with self.lock:
+                series = {key: {'buckets': list(value['buckets']), 'sum': value['sum'], 'count': value['count']}
+                          for key, value in self.series.items()}
+        items = [(key, value['buckets'], value['sum'], value['count']) for key, value in series.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield '_bucket', key, ('le', _format_value(bound)), cumulative
+            yield '_sum', key, None, total
+            yield '_count', key, None, count
+
+
+def _process_live(path, pid):
+    """
+    Tells whether the process that wrote a file is still running: its pid exists and it has rewritten the
+    file within the last three write intervals, which a reused pid of another process does not do.
+    """
+    try:
+        if time.time() - os.path.getmtime(path) > 3 * metrics_write_interval_seconds:
+            return False
+        os.kill(pid, 0)
+    except (FileNotFoundError, ProcessLookupError):
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _reset_after_fork():
+    """
+    Starts a forked child with empty series and fresh locks: what the parent recorded stays in the parent's
+    file, and a lock held by another thread of the parent at the fork would never be released.
+    """
+    global process_file, writer_started, writer_lock
+    process_file = None
+    writer_started = False
+    writer_lock = threading.Lock()
+    for metric in registry:
+        metric.lock = threading.Lock()
+        metric.series = {}
+
+
+def write_process_file():
+    """
+    Writes the series of this process to its file in METRICS_DIR, replacing the previous write atomically.
+    The file name carries the pid, to tell live processes from exited ones, and a random part, so a reused
+    pid does not overwrite the totals of an exited worker.
+    """
+    global process_file
+    if not metrics_dir:
+        return
+    with writer_lock:
+        if process_file is None:
+            os.makedirs(metrics_dir, exist_ok=True)
+            process_file = os.path.join(metrics_dir, f'metrics_{os.getpid()}_{uuid.uuid4().hex[:8]}.json')
+        snapshot = {metric.name: metric.snapshot() for metric in registry}
+        temp_file = f'{process_file}.tmp'
+        with open(temp_file, 'w') as file:
+            json.dump(snapshot, file)
+        os.replace(temp_file, process_file)
+
+
+def _writer_loop():
+    while True:
+        time.sleep(metrics_write_interval_seconds)
+        try:
+            write_process_file()
+        except Exception as e:
+            logging.error(f"Error writing metrics to {metrics_dir}: {e}")
+
+
+def _ensure_writer():
+    """
+    Starts the thread writing this process's file on the first recorded value, so it runs in each worker
+    after the fork.
+    """
+    global writer_started
+    if writer_started or not metrics_dir:
+        return
+    with writer_lock:
+        if writer_started:
+            return
+        writer_started = True
+    threading.Thread(target=_writer_loop, name='metrics-writer', daemon=True).start()
+
+
+def clear_metrics_dir():
+    """
+    Deletes the files of an earlier server run. Called by gunicorn when the server starts, before any worker.
+    """
+    if not metrics_dir:
+        return
+    for path in glob.glob(os.path.join(metrics_dir, 'metrics_*.json*')):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def merged_series():
+    """
+    Adds up the files of all processes in METRICS_DIR. Returns {metric name: {label values: value}}.
+    """
+    merged = {metric.name: {} for metric in registry}
+    for path in glob.glob(os.path.join(metrics_dir, 'metrics_*.json')):
+        try:
+            pid = int(os.path.basename(path).split('_')[1])
+            with open(path) as file:
+                snapshot = json.load(file)
+        except (OSError, ValueError, IndexError) as e:
+            logging.warning(f"Skipping metrics file {path}: {e}")
+            continue
+        alive = _process_live(path, pid)
+        for metric in registry:
+            if metric.kind == 'gauge' and not alive:
+                continue
+            for key, value in snapshot.get(metric.name, []):
+                metric.merge(merged[metric.name], tuple(key), value)
+    return merged
+
+
+def render_metrics():
+    """
+    Returns every registered metric in the Prometheus text exposition format (version 0.0.4), added up across
+    the worker processes if METRICS_DIR is set. This process writes its file first, so its own series are
+    current; those of the other workers are at most METRICS_WRITE_INTERVAL_SECONDS old.
+    """
+    if not metrics_dir:
+        return '\n'.join(metric.render() for metric in registry) + '\n'
+    write_process_file()
+    merged = merged_series()
+    return '\n'.join(metric.render(merged[metric.name]) for metric in registry) + '\n'
+
+
+def _write_at_exit():
+    if not writer_started:
+        return
+    try:
+        write_process_file()
+    except Exception as e:
+        logging.error(f"Error writing metrics to {metrics_dir}: {e}")
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+atexit.register(_write_at_exit)
+
+
+#-------------------------------------------------------------------------------------------------------
+# Application metrics
+#-------------------------------------------------------------------------------------------------------
+
+http_request_seconds = Histogram(
+    'callbot_http_request_duration_seconds', 'Time spent handling an HTTP request, by route.',
+    ('route', 'method', 'status')
+)
+blob_append_seconds = Histogram(
+    'callbot_blob_append_duration_seconds', 'Duration of append_to_blob calls.', ('outcome',)
+)
+blob_append_bytes = Histogram(
+    'callbot_blob_append_bytes', 'Size of the data written by append_to_blob calls.', buckets=BYTES_BUCKETS
+)
+db_update_stage_seconds = Histogram(
+    'callbot_db_update_stage_duration_seconds', 'Duration of the stages of a db_update run.', ('stage',)
+)
+twilio_api_seconds = Histogram(
+    'callbot_twilio_api_duration_seconds', 'Latency of Twilio REST API calls.', ('operation', 'outcome')
+)
+ivr_node_seconds = Histogram(
+    'callbot_ivr_node_duration_seconds', 'Time spent handling a key press, by IVR node.', ('node',)
+)
+dialer_calls_total = Counter(
+    'callbot_dialer_calls_total', 'Calls handled by the dialer, by outcome.', ('outcome',)
+)
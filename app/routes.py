@@ -13,12 +13,37 @@ Defines the HTTP routes/endpoints for your Flask application. Routes direct requ
 Content Overview:
 Endpoint Definitions: Maps URLs to view functions.
 Route Handling: Processes GET, POST, and other HTTP methods.
+Request Timing: Records the duration of every request by route for the /metrics endpoint.
+Background Tasks: Starts the blob update scheduler in the worker serving the request, if it is not running yet.
 
 """
+import time
+from flask import g, request
 from app import app
-from app.views import home_view, login_view, signup_view, logout_view, admin_view, reminder_view, index_view, get_events_view, save_event_view, trigger_initial_call_view, trigger_reminder_call_view, voice_view, gather_view, gather2_view, gather3_view, status_view,create_admin_user_view,add_user_view, edit_user_view, delete_user_view
+from app.metrics import http_request_seconds
+from app.scheduler import ensure_scheduler
+from app.views import home_view, login_view, signup_view, logout_view, admin_view, reminder_view, index_view, get_events_view, save_event_view, trigger_initial_call_view, trigger_reminder_call_view, dial_status_view, voice_view, gather_view, gather2_view, gather3_view, ivr_view, status_view,create_admin_user_view,add_user_view, edit_user_view, delete_user_view, metrics_view, event_outcomes_view, event_summary_view
 from app.utils import login_required
 
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.before_request
+def start_background_tasks():
+    # Requests are only served by worker processes, after any fork
+    ensure_scheduler()
+
+@app.after_request
+def record_request_duration(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        # Label by the URL rule, not the path, so /ivr/<node> or /dial_status/<job_id> stay one series each
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        http_request_seconds.observe(time.perf_counter() - started, route=route, method=request.method,
+                                     status=response.status_code)
+    return response
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     return login_view()
@@ -61,6 +86,26 @@ def trigger_initial_call():
 def trigger_reminder_call():
     return trigger_reminder_call_view()
 
+@app.route('/dial_status/<job_id>', methods=['GET'])
+# @login_required
+def dial_status(job_id):
+    return dial_status_view(job_id)
+
+@app.route('/event_outcomes/<event_id>', methods=['GET'])
+@login_required
+def event_outcomes(event_id):
+    return event_outcomes_view(event_id)
+
+@app.route('/event_summary/<int:event_id>', methods=['GET'])
+@login_required
+def event_summary(event_id):
+    return event_summary_view(event_id)
+
+@app.route('/metrics', methods=['GET'])
+# @login_required
+def metrics():
+    return metrics_view()
+
 @app.route("/voice", methods=['GET', 'POST'])
 # @login_required
 def voice():
@@ -81,6 +126,11 @@ def gather2():
 def gather3():
     return gather3_view()
 
+@app.route("/ivr/<node>", methods=['GET', 'POST'])
+# @login_required
+def ivr(node):
+    return ivr_view(node)
+
 @app.route("/status", methods=['POST'])
 # @login_required
 def status():
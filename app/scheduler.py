@@ -12,16 +12,56 @@ Description:
 Schedules and manages periodic tasks. Typically used to run tasks at regular intervals, such as sending reminders or processing data.
 
 Content Overview:
-Task Scheduling: Defines and schedules tasks.
-Task Execution: Runs tasks based on the schedule and handles task execution.
+Task Scheduling: Runs the blob-to-database update on a jittered interval, and soon after a change is signalled.
+Change Signals: Update requests of every worker are counted in a MySQL table, which the leader polls every
+blob_update_poll_seconds, so a change signalled to any worker wakes the leader.
+Task Execution: Runs are never overlapping; failed runs are retried with exponential backoff.
+Call Archive: The leader also compacts closed days of the call log into Parquet (see call_archive.py), at most
+once per call_archive_interval_seconds, if pyarrow is installed.
+Leader Election: Only the worker process holding a MySQL advisory lock (GET_LOCK) runs updates, however
+many gunicorn workers start the scheduler.
+Startup: The scheduler thread is started in worker processes only, after the fork (gunicorn's post_fork hook
+in gunicorn.conf.py, or the first request a worker serves), never on import, so the master process of a
+pre-forking server never takes part in the election.
+
+Settings (see config.py): blob_update_interval_seconds, blob_update_jitter, blob_update_max_backoff_seconds,
+blob_update_debounce_seconds, blob_update_max_delay_seconds, blob_update_lock_name, blob_update_scheduler_enabled,
+blob_update_request_table, blob_update_poll_seconds, call_archive_enabled, call_archive_interval_seconds and call_archive_max_days_per_run.
 
 """
 
 
-import schedule
+import logging
+import os
+import random
 import threading
 import time
+import mysql.connector
 import app.db_update as db_update
+import app.call_archive as call_archive
+from app.db_connect import db_cursor
+from app.config import (get_db_config, blob_update_scheduler_enabled, blob_update_interval_seconds, blob_update_jitter, blob_update_max_backoff_seconds,
+                        blob_update_debounce_seconds, blob_update_max_delay_seconds, blob_update_lock_name,
+                        blob_update_request_table, blob_update_poll_seconds,
+                        call_archive_enabled, call_archive_interval_seconds, call_archive_max_days_per_run)
+
+# Set by request_blob_update, consumed by the scheduler thread
+update_requested = threading.Event()
+scheduler_lock = threading.Lock()
+scheduler_thread = None
+scheduler_pid = None
+
+# time.monotonic() of the last call archive compaction started by this process
+last_archive_run = None
+
+# Dedicated connection holding the advisory lock while this process is the leader
+leader_conn = None
+# Lock connections inherited through fork; kept referenced so they are never closed from the child
+inherited_conns = []
+
+# Count of update requests in the shared table when the leader last polled it (None until it first does)
+seen_requests = None
+request_table_ready = False
 
 # Call to the python script which will update the database from blob
 def run_blob_update():
@@ -29,41 +69,281 @@ def run_blob_update():
     Executes the `blob_update` script to synchronize the database with the latest data from blob storage.
 
     This function serves as a wrapper that calls the main function of the `blob_update` module.
-    It is typically scheduled to run periodically to keep the database updated with new data from
-    the blob storage.
+
+    Returns:
+    - bool: True if the run succeeded, False if it raised.
+    """
+    try:
+        db_update.main()
+        return True
+    except Exception as e:
+        # Keep the scheduler thread alive when a run fails
+        logging.error(f"Error in blob update: {e}")
+        return False
+
+
+def run_call_archive():
+    """
+    Compacts the closed days of the call log into the Parquet archive, if the last compaction of this process
+    is at least `call_archive_interval_seconds` old.
+
+    Skipped when the archive is disabled or pyarrow is not installed. A failure is logged and does not
+    affect the blob update backoff.
+    """
+    global last_archive_run
+    if not call_archive_enabled or call_archive.pq is None:
+        return
+    if last_archive_run is not None and time.monotonic() - last_archive_run < call_archive_interval_seconds:
+        return
+    last_archive_run = time.monotonic()
+    try:
+        call_archive.compact_closed_days(max_days=call_archive_max_days_per_run)
+    except Exception as e:
+        logging.error(f"Error in call archive compaction: {e}")
+
+
+def is_leader():
+    """
+    Checks that this process still holds the advisory lock, acquiring it if nobody holds it.
+
+    The lock lives as long as the MySQL session that took it, so it is held on a dedicated connection
+    outside the pool (pooled connections reset their session when returned). If that connection is lost,
+    the server releases the lock and another worker can take over.
+
+    Returns:
+    - bool: True if this process is the leader.
+    """
+    global leader_conn
+    try:
+        if leader_conn is not None:
+            cursor = leader_conn.cursor()
+            cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (blob_update_lock_name,))
+            held = cursor.fetchone()[0] == 1
+            cursor.close()
+            if held:
+                return True
+            release_leadership()
+
+        conn = mysql.connector.connect(**get_db_config())
+        cursor = conn.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (blob_update_lock_name,))
+        acquired = cursor.fetchone()[0] == 1
+        cursor.close()
+        if not acquired:
+            conn.close()
+            return False
+        leader_conn = conn
+        logging.info(f"Process {os.getpid()} is now the blob update leader.")
+        return True
+    except mysql.connector.Error as e:
+        logging.error(f"Error checking blob update leadership: {e}")
+        release_leadership()
+        return False
+
+
+def release_leadership():
+    """
+    Gives up the advisory lock by closing the connection holding it.
+    """
+    global leader_conn, seen_requests
+    if leader_conn is not None:
+        try:
+            leader_conn.close()
+        except mysql.connector.Error:
+            pass
+        leader_conn = None
+    seen_requests = None
+
+
+def _prepare_request_table(cursor):
+    """
+    Creates the update request table on first use in this process.
+    """
+    global request_table_ready
+    if request_table_ready:
+        return
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {blob_update_request_table} (
+            Name VARCHAR(64) PRIMARY KEY,
+            Requests BIGINT NOT NULL
+        )
+    ''')
+    request_table_ready = True
+
+
+def shared_request_pending():
+    """
+    Tells whether another worker has requested an update since the leader last looked.
+
+    The first poll after taking over leadership only records the count: the new leader runs at once anyway.
+    """
+    global seen_requests
+    try:
+        with db_cursor() as cursor:
+            _prepare_request_table(cursor)
+            cursor.execute(f'SELECT Requests FROM {blob_update_request_table} WHERE Name = %s',
+                           (blob_update_lock_name,))
+            row = cursor.fetchone()
+    except Exception as e:
+        logging.error(f"Error polling blob update requests: {e}")
+        return False
+    count = row[0] if row else 0
+    pending = seen_requests is not None and count != seen_requests
+    seen_requests = count
+    return pending
+
+
+def next_delay(failures):
     """
-    db_update.main()
+    Returns the number of seconds to wait before the next scheduled run.
 
-# Five minutes based scheduler for blob_update.py run
-def schedule_blob_update():
+    The interval is spread by +/- `blob_update_jitter` so that workers started together do not poll in
+    lockstep, and doubles with each consecutive failure up to `blob_update_max_backoff_seconds`.
     """
-    Schedules the `run_blob_update` function to execute every 5 minutes.
+    delay = blob_update_interval_seconds
+    if failures:
+        delay = min(blob_update_interval_seconds * 2 ** failures, blob_update_max_backoff_seconds)
+    return delay * random.uniform(1 - blob_update_jitter, 1 + blob_update_jitter)
 
-    This function uses the `schedule` library to set up a recurring task that calls `run_blob_update`.
-    It enters an infinite loop where it continuously checks for pending scheduled tasks and executes them.
-    The sleep interval is set to 1 second to reduce CPU usage.
 
-    This scheduling mechanism ensures that the database is regularly updated with data from blob storage.
+def publish_update_request():
+    """
+    Counts an update request in the shared table, where the leader picks it up on its next poll.
+    """
+    try:
+        with db_cursor() as cursor:
+            _prepare_request_table(cursor)
+            cursor.execute(
+                f'''INSERT INTO {blob_update_request_table} (Name, Requests) VALUES (%s, 1)
+                    ON DUPLICATE KEY UPDATE Requests = Requests + 1''',
+                (blob_update_lock_name,)
+            )
+    except Exception as e:
+        logging.error(f"Error publishing blob update request: {e}")
 
-    Note:
-    - Ensure that the `schedule` and `time` libraries are imported.
-    - This function is intended to be run in a separate thread to avoid blocking the main program.
+
+def wait_for_request(timeout):
     """
-    schedule.every(2).minutes.do(run_blob_update)
-    print("It is updating the blob")
+    Waits up to `timeout` seconds for an update request and consumes it.
+
+    A request is either signalled in this process or, while this process is the leader, counted in the shared
+    table by another worker, which is polled every `blob_update_poll_seconds`.
+
+    Returns:
+    - bool: True if a request arrived, False if the timeout expired.
+    """
+    deadline = time.monotonic() + timeout
     while True:
-        schedule.run_pending()
-        time.sleep(1)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        leading = leader_conn is not None
+        if update_requested.wait(min(remaining, blob_update_poll_seconds) if leading else remaining):
+            update_requested.clear()
+            return True
+        if leading and shared_request_pending():
+            return True
+
+
+def wait_for_trigger(timeout):
+    """
+    Waits for the next run: either the timeout expires or an update is requested.
+
+    A request is debounced: the wait continues until no new request has arrived for
+    `blob_update_debounce_seconds`, but at most `blob_update_max_delay_seconds` after the first one, so a
+    burst of completed calls results in a single run.
+
+    Returns:
+    - bool: True if the wait ended because of a request.
+    """
+    if not wait_for_request(timeout):
+        return False
+    first_request = time.monotonic()
+    while True:
+        if not wait_for_request(blob_update_debounce_seconds):
+            return True
+        if time.monotonic() - first_request >= blob_update_max_delay_seconds:
+            return True
+
+
+def scheduler_loop():
+    """
+    Runs the blob update whenever it is due, as long as this process is the leader.
+
+    Runs happen on this single thread, so they never overlap within a process, and only the leader runs
+    them, so they never overlap across processes. A run is due after the jittered interval or after a
+    debounced update request. A request signalled to another worker is handed on at once: that worker
+    tries to take over leadership, and if another process leads, counts the request in the shared table
+    for the leader. Each run starts with cheap change checks (see db_update.main): an ETag check
+    of the daily blob and a listing of the day's call log manifests, so polling unchanged logs downloads nothing.
+    """
+    failures = 0
+    while True:
+        if leader_conn is None:
+            requested = wait_for_request(next_delay(failures))
+        else:
+            requested = wait_for_trigger(next_delay(failures))
+        if not is_leader():
+            failures = 0
+            if requested:
+                publish_update_request()
+            continue
+        if run_blob_update():
+            failures = 0
+        else:
+            failures += 1
+        run_call_archive()
 
 
 def start_scheduler():
-    update_thread = threading.Thread(target=schedule_blob_update)
-    update_thread.daemon = True
-    update_thread.start()
+    """
+    Starts the scheduler thread of this process, if it is not running yet.
+
+    Safe to call from every worker process: only the leader runs updates. The thread is re-created after
+    a fork.
+    """
+    global scheduler_thread, scheduler_pid, leader_conn
+    with scheduler_lock:
+        if scheduler_thread is not None and scheduler_thread.is_alive() and scheduler_pid == os.getpid():
+            return
+        if scheduler_pid != os.getpid() and leader_conn is not None:
+            # The lock connection belongs to the parent process
+            inherited_conns.append(leader_conn)
+            leader_conn = None
+        scheduler_thread = threading.Thread(target=scheduler_loop, name='blob-update-scheduler')
+        scheduler_thread.daemon = True
+        scheduler_thread.start()
+        scheduler_pid = os.getpid()
+
+
+def ensure_scheduler():
+    """
+    Starts the scheduler thread in this worker process, unless BLOB_UPDATE_SCHEDULER_ENABLED is false.
+
+    Called from gunicorn's post_fork hook and before every request, so it returns at once when the thread
+    of this process is already running.
+    """
+    if blob_update_scheduler_enabled and scheduler_pid != os.getpid():
+        start_scheduler()
+
+
+def request_blob_update():
+    """
+    Asks for the database to be updated from blob storage soon, without waiting for it.
+
+    Used by webhooks (e.g. a completed call) so that a burst of completions results in one update
+    instead of one update per call. Only signals this process's scheduler thread, so the webhook does no
+    database work. If this process is not the leader, the thread tries to take over leadership, or else
+    counts the request in the shared table, which wakes the leader within `blob_update_poll_seconds`.
+    Does nothing when the scheduler is disabled.
+    """
+    if not blob_update_scheduler_enabled:
+        return
+    ensure_scheduler()
+    update_requested.set()
 
 
 if __name__ == "__main__":
-    # Start the scheduler in a separate daemon thread to allow it to run in the background.
-    update_thread = threading.Thread(target=schedule_blob_update)
-    update_thread.daemon = False
-    update_thread.start()
+    # Run the scheduler in the foreground
+    logging.basicConfig(level=logging.INFO)
+    scheduler_loop()
@@ -22,44 +22,28 @@ Call Functionality: Initiates calls, handles responses, and logs results.
 from datetime import datetime
 import urllib.parse
 import logging
+import time
 import uuid
 from twilio.twiml.voice_response import VoiceResponse, Gather
-from .config import account_sid, auth_token, connect_str, container_name,ngrok_url,twilio_number,client
+from .config import twilio_number, get_base_url, get_twilio_client
 # from .blob_operations import append_to_blob, write_csv_header
-from .blob_operations import write_csv_header, append_to_blob
+from .event_journal import log_call_event
+from .call_log import partition_blob_name
+from .call_store import call_guid_map, save_call_context
+from .metrics import twilio_api_seconds
 
 # Set up logging
 logging.basicConfig(level=logging.DEBUG)
 
-call_guid_map = {}
 
-
-# blob / csv file name
-def get_current_csv_blob_name():
-    """
-    Generates the blob name for the CSV file based on the current date.
-
-    Returns:
-    - str: The name of the CSV file, formatted as 'call_status_DD_MM_YYYY.csv', 
-      where 'DD', 'MM', and 'YYYY' are the current day, month, and year respectively.
-
-    This function creates a file name that includes the current date, ensuring that each day's data
-    is stored in a separate CSV file in Azure Blob Storage.
+def place_call(attendee_phonenumber, attendee_name, event_name, event_summary, event_date, event_venue, call_type, event_id, eventTime):
     """
-    date_str = datetime.now().strftime('%d_%m_%Y')
-    file_name = f'call_status_{date_str}.csv'
-    return file_name
+    Places a phone call using Twilio's API and logs it to the call status CSV.
 
-
-
-
-def make_call(attendee_phonenumber, attendee_name, event_name, event_summary, event_date, event_venue, call_type, event_id, eventTime):
-    """
-    Initiates a phone call using Twilio's API to notify an attendee about an event.
-
-    This function generates a unique identifier for the call, constructs the appropriate URL 
-    based on the call type (initial or reminder), and makes the call using Twilio's API. 
-    It logs the call details to a CSV file and handles any exceptions that occur during the process.
+    This function generates a unique identifier for the call, stores the attendee and event details
+    as the call context under it, constructs the appropriate URL based on the call type (initial or
+    reminder) carrying only the GUID and the event ID, and makes the call using Twilio's API.
+    Unlike `make_call`, errors are raised to the caller, which lets the dialer count failures.
 
     Args:
         attendee_phonenumber (str): The phone number of the attendee to call.
@@ -73,36 +57,42 @@ def make_call(attendee_phonenumber, attendee_name, event_name, event_summary, ev
         eventTime (str): The time of the event.
 
     Returns:
-        str: A message indicating the result of the call initiation.
+        str: The Twilio Call SID of the new call.
+
+    Raises:
+        ValueError: If the call type is not 'initial' or 'reminder'.
+        TwilioRestException: If Twilio rejects the call.
     """
+    guid = str(uuid.uuid4())  # Generate a new GUID for this call
+    base_url = f'{get_base_url()}/'
+    if call_type == 'initial':
+        url = base_url + 'voice'
+    elif call_type == 'reminder':
+        url = base_url + 'reminder'
+    else:
+        raise ValueError(f"Invalid call type: {call_type}")
+
+    # Store the call context first: the webhooks only receive the GUID and may arrive before create() returns
+    save_call_context(guid, {
+        'name': str(attendee_name),
+        'event': str(event_name),
+        'summary': str(event_summary),
+        'date': str(event_date),
+        'venue': str(event_venue),
+        'eventId': str(event_id),
+        'eventTime': str(eventTime),
+        'attendee_phonenumber': str(attendee_phonenumber),
+        'call_type': call_type,
+    })
+    # The event travels with the GUID, so the webhooks partition their rows by it without the stored context
+    encoded_params = urllib.parse.urlencode({'guid': guid, 'eventId': str(event_id)})
+    full_url = f"{url}?{encoded_params}"
+    logging.debug(f"full_url {full_url}")
+    status_callback_url = f'{base_url}status?{encoded_params}'
+    # Make the call
+    started = time.perf_counter()
     try:
-        guid = str(uuid.uuid4())  # Generate a new GUID for this call
-        base_url = f'{ngrok_url}/'
-        if call_type == 'initial':
-            url = base_url + 'voice'
-        elif call_type == 'reminder':
-            url = base_url + 'reminder'
-        else:
-            return "Invalid call type."
-
-        # Encode query parameters
-        query_params = {
-            'name': attendee_name,
-            'event': event_name,
-            'summary': event_summary,
-            'date': event_date,
-            'venue': event_venue,
-            'eventId': event_id,
-            'eventTime': eventTime,
-            'attendee_phonenumber': attendee_phonenumber
-        }
-        encoded_params = urllib.parse.urlencode(query_params)
-        full_url = f"{url}?{encoded_params}"
-        print('full_url',full_url)
-        status_callback_url = f'{base_url}/status'
-        print('status_callback_url',status_callback_url)
-        # Make the call
-        call = client.calls.create(
+        call = get_twilio_client().calls.create(
             to=attendee_phonenumber,
             from_=twilio_number,
             url=full_url,
@@ -111,21 +101,50 @@ def make_call(attendee_phonenumber, attendee_name, event_name, event_summary, ev
             status_callback_method='POST',
             method='POST'
         )
+    except Exception:
+        twilio_api_seconds.observe(time.perf_counter() - started, operation='calls.create', outcome='error')
+        raise
+    twilio_api_seconds.observe(time.perf_counter() - started, operation='calls.create', outcome='success')
+
+    # Store the GUID in the shared CallSid -> GUID store; Gather actions post without it and find it by CallSid
+    call_guid_map[call.sid] = guid
+
+    # Log the initial call to the CSV part of the event. The event name, summary, time and venue columns stay
+    # empty: db_update and the archive join them from the registration table by event ID
+    csv_blob_name = partition_blob_name(event_id)
+    data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,,{attendee_name},{event_date},,,,,{call_type}\n"
+    log_call_event(csv_blob_name, data)
+
+    return call.sid
 
-        # Store the GUID in the dictionary
-        call_guid_map[call.sid] = guid
 
-        # Log the initial call to the CSV
-        csv_blob_name = get_current_csv_blob_name()
-        write_csv_header(csv_blob_name)
-        data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,,{attendee_name},{event_date},{event_name},{event_summary},{eventTime},{event_venue},{call_type}\n"
-        append_to_blob(csv_blob_name, data)
+def make_call(attendee_phonenumber, attendee_name, event_name, event_summary, event_date, event_venue, call_type, event_id, eventTime):
+    """
+    Initiates a phone call using Twilio's API to notify an attendee about an event.
 
-        # Run the blob update script (if needed)
-        # subprocess.run(['python', 'blob_update.py'])
+    This function wraps `place_call` and handles any exceptions that occur during the process,
+    returning a message instead of raising.
 
-        return f"Call initiated. Call SID: {call.sid}"
+    Args:
+        attendee_phonenumber (str): The phone number of the attendee to call.
+        attendee_name (str): The name of the attendee.
+        event_name (str): The name of the event.
+        event_summary (str): A brief summary of the event.
+        event_date (str): The date of the event.
+        event_venue (str): The venue of the event.
+        call_type (str): The type of call (either 'initial' or 'reminder').
+        event_id (str): The unique identifier for the event.
+        eventTime (str): The time of the event.
 
+    Returns:
+        str: A message indicating the result of the call initiation.
+    """
+    try:
+        call_sid = place_call(attendee_phonenumber, attendee_name, event_name, event_summary, event_date,
+                              event_venue, call_type, event_id, eventTime)
+        return f"Call initiated. Call SID: {call_sid}"
+    except ValueError:
+        return "Invalid call type."
     except Exception as e:
         logging.error(f"Error in make_call: {e}")
-        return "An error occurred while making the call."
\ No newline at end of file
+        return "An error occurred while making the call."
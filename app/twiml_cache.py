@@ -0,0 +1,185 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+twiml_cache.py
+Description:
+Renders the TwiML documents returned by the voice webhooks. The documents are built with Twilio's
+VoiceResponse once and then served from a cache, so a webhook only does string work while Twilio waits.
+
+Content Overview:
+Static Prompts: Prompts that never change (e.g. the IVR flow's pickup question) are serialized once per process.
+Event Templates: Prompts that mention the event are compiled once per event into the XML before and after
+the attendee's first name; a call then only escapes and inserts the name.
+Cache: The compiled event templates are kept in an LRU cache of twiml_cache_size entries.
+Call Parameters: `add_action_params` adds the call's identifiers to the Gather actions of a cached document, so
+the key press webhook carries them without a cache entry per call.
+
+"""
+
+import re
+import threading
+import urllib.parse
+from collections import OrderedDict
+from xml.sax.saxutils import escape
+from twilio.twiml.voice_response import VoiceResponse, Gather
+from .config import voice_change, twiml_cache_size
+
+# Stands in for the first name while a template is compiled; contains no characters XML would escape
+FIRST_NAME_TOKEN = '__CALLBOT_FIRST_NAME__'
+
+
+def _say(text):
+    resp = VoiceResponse()
+    resp.say(text, voice=voice_change)
+    return resp
+
+
+def _gather(action, text):
+    resp = VoiceResponse()
+    gather = Gather(action=action, num_digits=1)
+    gather.say(text, voice=voice_change)
+    resp.append(gather)
+    return resp
+
+
+# Builders of the static responses that are not part of the IVR flow, by name
+STATIC_NODES = {
+    'error': lambda: _say("An application error occurred."),
+}
+
+static_cache = {}
+
+template_cache = OrderedDict()
+template_lock = threading.Lock()
+
+
+def static_twiml(node):
+    """
+    Returns the TwiML of a static response.
+
+    Args:
+        node (str): A key of `STATIC_NODES`.
+
+    Returns:
+        str: The serialized TwiML document.
+    """
+    xml = static_cache.get(node)
+    if xml is None:
+        xml = static_cache[node] = str(STATIC_NODES[node]())
+    return xml
+
+
+def prompt_twiml(key, text, action=None):
+    """
+    Returns the TwiML of a fixed prompt, serializing it on first use.
+
+    Args:
+        key (tuple): Identifies the prompt in the cache, e.g. ('ivr', node name).
+        text (str): The text to say.
+        action (str, optional): If given, the prompt is wrapped in a one-digit Gather posting to this URL.
+
+    Returns:
+        str: The serialized TwiML document.
+    """
+    xml = static_cache.get(key)
+    if xml is None:
+        xml = static_cache[key] = str(_gather(action, text) if action else _say(text))
+    return xml
+
+
+def compile_template(resp):
+    """
+    Serializes a VoiceResponse containing `FIRST_NAME_TOKEN` and splits it around the token.
+
+    Returns:
+        tuple: (prefix, suffix), the XML before and after the first name.
+    """
+    prefix, _, suffix = str(resp).partition(FIRST_NAME_TOKEN)
+    return prefix, suffix
+
+
+def fill_template(template, first_name):
+    """
+    Renders a compiled template for one attendee.
+
+    Args:
+        template (tuple): (prefix, suffix) as returned by `compile_template`.
+        first_name (str): The attendee's first name; it is XML-escaped here.
+
+    Returns:
+        str: The TwiML document.
+    """
+    prefix, suffix = template
+    return prefix + escape(first_name) + suffix
+
+
+# The action attribute of a Gather whose URL has no query string yet
+GATHER_ACTION_PATTERN = re.compile(r'(<Gather\b[^>]*?\baction=")([^"?]*)(")')
+
+
+def add_action_params(xml, params):
+    """
+    Adds query parameters to the action URL of every Gather in a TwiML document.
+
+    Args:
+        xml (str): The TwiML document, e.g. from the cache.
+        params (dict): The parameters; those whose value is empty are left out.
+
+    Returns:
+        str: The TwiML document with the parameters in its Gather actions.
+    """
+    query = urllib.parse.urlencode({name: value for name, value in params.items() if value})
+    if not query:
+        return xml
+    return GATHER_ACTION_PATTERN.sub(lambda match: f"{match.group(1)}{match.group(2)}?{escape(query)}{match.group(3)}", xml)
+
+
+def cached_template(key, builder):
+    """
+    Returns the compiled template for the given key, compiling it with `builder` on a cache miss.
+
+    Args:
+        key (tuple): Identifies the template, e.g. the prompt and the event details it contains.
+        builder (callable): Returns a VoiceResponse containing `FIRST_NAME_TOKEN`.
+    """
+    with template_lock:
+        template = template_cache.get(key)
+        if template is not None:
+            template_cache.move_to_end(key)
+            return template
+    template = compile_template(builder())
+    with template_lock:
+        template_cache[key] = template
+        while len(template_cache) > twiml_cache_size:
+            template_cache.popitem(last=False)
+    return template
+
+
+def invitation_twiml(first_name, event_id, event_name, event_date, event_time, event_venue, event_summary, action):
+    """
+    Returns the TwiML of the initial invitation, asking the attendee to accept or request a callback.
+
+    The key press is posted to `action`, the webhook of the IVR flow's start node.
+    """
+    key = ('invitation', action, event_id, event_name, event_date, event_time, event_venue, event_summary)
+    template = cached_template(key, lambda: _gather(
+        action,
+        f"Hello {FIRST_NAME_TOKEN}, This is the Open GOV Bot calling on behalf of the organizing committee for an event. We are delighted to invite you to our upcoming event, {event_name}! Taking place on {event_date} at {event_time} Malaysia Standard Time. This event promises to be an insightful experience held at {event_venue}. Here's a brief overview: {event_summary}. We believe your presence will add immense value, and we would be honored to have you with us. To confirm your attendance, please press 1. If you need a callback for more details, press 2."
+    ))
+    return fill_template(template, first_name)
+
+
+def reminder_twiml(first_name, event_id, event_name, event_date, event_time, event_venue):
+    """
+    Returns the TwiML of the reminder call.
+    """
+    key = ('reminder', event_id, event_name, event_date, event_time, event_venue)
+    template = cached_template(key, lambda: _say(
+        f"Hello {FIRST_NAME_TOKEN}, as a valued registered participant, this is a reminder from the OpenGov call bot regarding the upcoming event, {event_name}. scheduled date {event_date} at {event_time} Malaysia Standard Time. To be held at {event_venue}. Thank you."
+    ))
+    return fill_template(template, first_name)
@@ -17,12 +17,14 @@ File Handling: Functions for file processing and conversion.
 """
 
 from datetime import datetime
+import re
 import threading
 from werkzeug.utils import secure_filename
 import logging
 from flask import request
 from .blob_operations import write_csv_header
 from .twilio_calls import call_guid_map
+from .call_log import get_current_csv_blob_name
 import csv
 from .config import twilio_number
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
@@ -76,21 +78,46 @@ def login_required(f):
     # Return the wrapper function, effectively applying the decorator.
     return decorated_function
 
-# blob / csv file name
-def get_current_csv_blob_name():
+def is_valid_singapore_mobile(number):
     """
-    Generates the blob name for the CSV file based on the current date.
+    Check if the given number is a valid Singapore mobile number.
+    A valid Singapore mobile number starts with '65' followed by 8 digits.
+
+    Args:
+    number (str): The mobile number to validate.
 
     Returns:
-    - str: The name of the CSV file, formatted as 'call_status_DD_MM_YYYY.csv', 
-      where 'DD', 'MM', and 'YYYY' are the current day, month, and year respectively.
+    bool: True if the number is valid, False otherwise.
+    """
+    pattern = r'^65\d{8}$'
+    return bool(re.match(pattern, str(number)))
+
+def normalize_singapore_mobile(number):
+    """
+    Normalizes a phone number as typed in an attendee list to the `65XXXXXXXX` form.
 
-    This function creates a file name that includes the current date, ensuring that each day's data
-    is stored in a separate CSV file in Azure Blob Storage.
+    Spaces, dashes, brackets and a leading '+' are removed, a trailing '.0' left by spreadsheet number
+    cells is dropped, and the country code is added to bare 8-digit numbers starting with 8 or 9.
+
+    Args:
+    number (str or int or float): The phone number to normalize.
+
+    Returns:
+    str or None: The normalized number, or None if it is not a valid Singapore mobile number.
     """
-    date_str = datetime.now().strftime('%d_%m_%Y')
-    file_name = f'call_status_{date_str}.csv'
-    return file_name
+    if number is None:
+        return None
+    if isinstance(number, float):
+        if not number.is_integer():
+            return None
+        number = int(number)
+    text = str(number).strip()
+    if text.endswith('.0'):
+        text = text[:-2]
+    digits = re.sub(r'[\s\-()]', '', text).lstrip('+')
+    if len(digits) == 8 and digits[0] in '89':
+        digits = '65' + digits
+    return digits if is_valid_singapore_mobile(digits) else None
 
 def upload_blob(file_name, data):
     """
@@ -17,24 +17,31 @@ Response Generation: Returns HTML templates or JSON responses.
 
 """
 
-import re
+import hashlib
+import time
 import logging
 from flask import flash, redirect, request, Response, jsonify, render_template, session, url_for
 
-from app.models import User
-from .db_connect import get_db_connection, create_table_if_not_exists
-from .twilio_calls import make_call,call_guid_map
+from .db_connect import (db_connection, db_cursor, create_table_if_not_exists, ensure_attendee_table,
+                         iter_event_attendees, count_event_attendees, get_latest_acceptance_ids, iter_acceptances)
+from .twilio_calls import call_guid_map
+from .call_store import call_context_map, get_call_context
+from .dialer import start_dial_job, get_dial_job
+from .metrics import render_metrics
+from .call_archive import outcome_counts
+from .db_update import BUCKET_RULES, check_table_exists
+from .event_cache import get_event_list, invalidate_event_list, search_events, paginate
 from .utils import secure_filename, log_response
-import pandas as pd
-from .utils import get_current_csv_blob_name, log_response
-from .blob_operations import write_csv_header, append_to_blob
-from twilio.twiml.voice_response import VoiceResponse, Gather
-from datetime import datetime
-from .config import twilio_number, voice_change, registration_table
-from .db_update import main
+from .attendee_import import open_attendee_rows, import_attendees, AttendeeFileError
+from .call_log import partition_blob_name
+from .event_journal import log_call_event
+from .twiml_cache import static_twiml, invitation_twiml, reminder_twiml, add_action_params
+from .ivr_flow import flow as ivr_flow, node_url as ivr_node_url, handle_input as handle_ivr_input, record_node_timing
+from datetime import datetime, timedelta
+from .config import twilio_number, registration_table, summary_table, event_list_max_per_page
+from .scheduler import request_blob_update
 from werkzeug.security import generate_password_hash, check_password_hash
 from app.models import User,db_temp
-import logging
 
 logging.basicConfig(level=logging.INFO)
 
@@ -51,8 +58,8 @@ def index_view():
     Renders the main HTML page and fetches events from the database.
 
     This function checks if the database table has been initialized and if not,
-    it creates the table. It then fetches the list of events from the database 
-    and passes them to the HTML template to be rendered.
+    it creates the table. It then fetches the list of events from the event list
+    cache and passes them to the HTML template to be rendered.
 
     Returns:
         The rendered HTML template with the list of events.
@@ -62,15 +69,11 @@ def index_view():
         create_table_if_not_exists()
         table_initialized = True
 
-    # Fetch events from the database
-    conn = get_db_connection()
-    if conn:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(f"SELECT eventID, eventName, eventLocation, eventDate FROM {registration_table}")
-        events = cursor.fetchall()
-        cursor.close()
-        conn.close()
-    else:
+    # Fetch events from the event list cache
+    try:
+        events = get_event_list()['events']
+    except Exception as e:
+        logging.error(f'Error fetching events: {e}')
         events = []
 
     return render_template('callbotUI_V6.html', events=events)
@@ -81,24 +84,38 @@ def get_events_view():
     """
     API endpoint to get the list of events.
 
-    This function fetches the list of events from the database and returns them 
-    as a JSON response.
+    This function returns the cached list of events as a JSON response. The optional query parameters
+    `q` (search in event name and location), `page` and `per_page` select a subset of the list; without
+    them every event is returned. The response carries an ETag and a Last-Modified header, and a request
+    whose If-None-Match / If-Modified-Since header still matches gets an empty 304 response.
 
     Returns:
-        JSON response containing the list of events.
-    """
-    conn = get_db_connection()
-    if conn:
-        cursor = conn.cursor(dictionary=True)
-        cursor.execute(f"SELECT eventID, eventName, eventLocation, eventDate FROM {registration_table}")
-        events = cursor.fetchall()
-        cursor.close()
-        conn.close()
-        return jsonify({"events": events})
-        # return render_template('callbotUI_V6.html', events=events)
-    else:
+        JSON response containing the list of events, the number of matching events and the paging parameters.
+    """
+    try:
+        event_list = get_event_list()
+    except Exception as e:
+        logging.error(f'Error fetching events: {e}')
         return jsonify({"events": []})
-        # return render_template('callbotUI_V6.html', events=events)
+
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', None, type=int)
+    if per_page is not None:
+        per_page = min(max(per_page, 1), event_list_max_per_page)
+
+    events = search_events(event_list['events'], query)
+    response = jsonify({"events": paginate(events, page, per_page), "total": len(events),
+                        "page": page, "per_page": per_page})
+
+    # The ETag covers both the event list and the parameters selecting the part of it returned
+    selection = f"{query}|{page}|{per_page}" if (query or per_page) else ''
+    response.set_etag(f"{event_list['etag']}-{hashlib.md5(selection.encode('utf-8')).hexdigest()[:8]}"
+                      if selection else event_list['etag'])
+    if event_list['last_modified']:
+        response.last_modified = event_list['last_modified']
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
 
 
 # @app.route('/save_event', methods=['POST'])
@@ -107,8 +124,9 @@ def save_event_view():
     Saves event details into the database.
 
     This function saves the event details provided in the request form into the database.
-    It performs input validation, checks for duplicate event names, and processes the 
-    attendees file to extract attendee information.
+    It performs input validation, checks for duplicate event names, and streams the attendees
+    file into the attendee table, validating and normalizing each attendee's phone number.
+    The response includes an import report listing the rejected rows.
 
     Returns:
         Renders the callbotUI_V6.html with appropriate status and messages.
@@ -156,43 +174,47 @@ def save_event_view():
         if len(event_location) > 250:
             return jsonify(status='error', message='Event Location must not exceed 250 characters.')
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        ensure_attendee_table()
 
-        # Check for duplicate event name
-        cursor.execute("SELECT COUNT(*) FROM callbot_event_registration WHERE eventName = %s", (event_name,))
-        if cursor.fetchone()[0] > 0:
-            cursor.close()
-            conn.close()
-            return jsonify(status='error', message='Event Name already exists.')
+        with db_connection() as conn:
+            cursor = conn.cursor()
+
+            # Check for duplicate event name
+            cursor.execute("SELECT COUNT(*) FROM callbot_event_registration WHERE eventName = %s", (event_name,))
+            if cursor.fetchone()[0] > 0:
+                cursor.close()
+                return jsonify(status='error', message='Event Name already exists.')
 
-        attendees = []
-        if attendees_file:
             file_extension = secure_filename(attendees_file.filename).split('.')[-1].lower()
             logging.info(f'File extension: {file_extension}')
-            if file_extension == 'xlsx':
-                df = pd.read_excel(attendees_file, engine='openpyxl')
-            elif file_extension == 'csv':
-                df = pd.read_csv(attendees_file)
-            else:
-                return jsonify(status='error', message='Unsupported file format. Please upload a .csv or .xlsx file.')
-
-            attendees = df.to_dict('records')
-
-        attendees_data = ';'.join([f"{attendee['attendeeName']}:{attendee['attendeePhone']}" for attendee in attendees])
-        # logging.info(f'Attendees data: {attendees_data}')
+            try:
+                attendee_rows = open_attendee_rows(attendees_file.stream, file_extension)
+            except AttendeeFileError as e:
+                cursor.close()
+                return jsonify(status='error', message=str(e))
 
-        cursor.execute(
-            "INSERT INTO callbot_event_registration (eventName, eventLocation, eventSummary, eventDate, eventTime, attendees) VALUES (%s, %s, %s, %s, %s, %s)",
-            (event_name, event_location, event_summary, event_date, event_time, attendees_data)
-        )
-        conn.commit()
-        event_id = cursor.lastrowid
+            # Attendees live in the attendee table; the legacy attendees column is left empty
+            cursor.execute(
+                "INSERT INTO callbot_event_registration (eventName, eventLocation, eventSummary, eventDate, eventTime, attendees) VALUES (%s, %s, %s, %s, %s, %s)",
+                (event_name, event_location, event_summary, event_date, event_time, '')
+            )
+            event_id = cursor.lastrowid
+            report = import_attendees(cursor, event_id, attendee_rows)
+            logging.info(f"Event {event_id}: imported {report['imported']} of {report['rows']} attendee rows "
+                         f"({report['duplicates']} duplicates, {report['invalid']} invalid).")
 
-        cursor.close()
-        conn.close()
+            if report['imported'] == 0:
+                conn.rollback()
+                cursor.close()
+                return jsonify(status='error', message='The attendees file contains no valid attendees.', report=report)
+            conn.commit()
+            cursor.close()
+            invalidate_event_list()
 
-        return jsonify(status='success', message='Event saved successfully', event_id=event_id)
+            message = 'Event saved successfully'
+            if report['invalid']:
+                message += f" ({report['invalid']} attendee rows were rejected)"
+            return jsonify(status='success', message=message, event_id=event_id, report=report)
 
     except KeyError as e:
         logging.error(f'Missing form field: {e.args[0]}')
@@ -201,391 +223,324 @@ def save_event_view():
         logging.error(f'Error occurred: {str(e)}')
         return jsonify(status='error', message='An error occurred while saving the event. Please try again.')
     
-def is_valid_singapore_mobile(number):
-    """
-    Check if the given number is a valid Singapore mobile number.
-    A valid Singapore mobile number starts with '65' followed by 8 digits.
-
-    Args:
-    number (str): The mobile number to validate.
-
-    Returns:
-    bool: True if the number is valid, False otherwise.
-    """
-    pattern = r'^65\d{8}$'
-    return bool(re.match(pattern, str(number)))
-
 # @app.route('/trigger_initial_call', methods=['POST'])
 def trigger_initial_call_view():
     """
     Triggers the initial call to attendees of a specific event.
 
-    This function retrieves event details and attendee information from the database using the event ID
-    provided in the request. It then makes a call to each attendee with the event details using the 
-    `make_call` function.
+    This function retrieves event details from the database using the event ID provided in the request.
+    It then hands one call per attendee to the background dialer, which reads the attendees from the
+    attendee table page by page and places the calls concurrently within the Twilio rate limit. The dial
+    job ID is returned without waiting.
 
     Returns:
-        JSON response with appropriate status and messages.
+        JSON response with appropriate status and messages, including the `job_id` on success.
     """
     try:
         event_id = request.form['event_id']
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            
-            # Retrieve event details from the database
-            cursor.execute(f"SELECT * FROM {registration_table} WHERE eventID = %s", (event_id,))
-            event = cursor.fetchone()
+        ensure_attendee_table()
 
-            if event:
-                # Parse attendees from the event details
-                attendees = event[6].split(';')
-                attendees = [{'attendeeName': a.split(':')[0], 'attendeePhone': a.split(':')[1]} for a in attendees]
-
-                event_details = {
-                    'eventName': event[1],
-                    'eventSummary': event[3],
-                    'eventLocation': event[2],
-                    'eventDate': event[4],
-                    'eventTime': event[5],
-                    'attendees': attendees,
-                    'event_id': event_id
-                }
-
-                # Convert the attendees list to a DataFrame
-                df_attendees = pd.DataFrame(attendees)
-
-                # Loop over each attendee and make the call
-                for idx, row in df_attendees.iterrows():
-                    make_call(
-                        attendee_phonenumber=row["attendeePhone"],
-                        attendee_name=row["attendeeName"],
-                        event_date=event_details.get('eventDate'),
-                        event_name=event_details.get('eventName'),
-                        event_summary=event_details.get('eventSummary'),
-                        event_venue=event_details.get('eventLocation'),
-                        eventTime=event_details.get('eventTime'),
-                        call_type="initial",
-                        event_id=event_details.get('event_id')
-                    )
+        # Retrieve event details from the database
+        with db_cursor(dictionary=True) as cursor:
+            cursor.execute(
+                f"SELECT eventName, eventLocation, eventSummary, eventDate, eventTime FROM {registration_table} WHERE eventID = %s",
+                (event_id,)
+            )
+            event = cursor.fetchone()
 
-                cursor.close()
-                conn.close()
+        if not event:
+            return jsonify(status='error', message='Event not found')
+
+        # Attendees are read page by page from the attendee table while the dialer consumes the calls
+        calls = (
+            {
+                'attendee_phonenumber': attendee['attendeePhone'],
+                'attendee_name': attendee['attendeeName'],
+                'event_date': event['eventDate'],
+                'event_name': event['eventName'],
+                'event_summary': event['eventSummary'],
+                'event_venue': event['eventLocation'],
+                'eventTime': event['eventTime'],
+                'call_type': 'initial',
+                'event_id': event_id
+            }
+            for attendee in iter_event_attendees(event_id)
+        )
+        job_id = start_dial_job(calls, description=f"initial calls for event {event_id}",
+                                total=count_event_attendees(event_id))
 
-                return jsonify(status='success', message='Initial call triggered successfully')
-            else:
-                cursor.close()
-                conn.close()
-                return jsonify(status='error', message='Event not found')
-        else:
-            return jsonify(status='error', message='Could not establish a connection to the database')
+        return jsonify(status='success', message='Initial call triggered successfully', job_id=job_id)
     except Exception as e:
         logging.error(f'Error occurred: {str(e)}')
         return jsonify(status='error', message='An error occurred while triggering the initial call. Please try again.')
 
 # @app.route('/trigger_reminder_call', methods=['POST'])
-from flask import request, jsonify
-import pandas as pd
-import logging
-
-logging.basicConfig(level=logging.INFO)
-
 def trigger_reminder_call_view():
     """
     Triggers reminder calls for attendees who have accepted the initial call invitation.
 
-    This function retrieves the list of attendees who accepted the initial call invitation for a specific event
-    from the database. It then makes a reminder call to each attendee with the event details using the 
-    `make_call` function.
+    This function looks up the latest acceptance of each recipient of a specific event in the database,
+    so every attendee is reminded once even if they accepted more than once. The rows are streamed in
+    batches into the background dialer, and the dial job ID is returned without waiting for the calls
+    to be placed.
 
     Returns:
-        JSON response indicating the status of the operation.
+        JSON response indicating the status of the operation, including the `job_id` on success.
     """
     try:
         event_id = request.form['event_id']
-        conn = get_db_connection()
-        if conn:
-            cursor = conn.cursor()
-            
-            # Retrieve attendees who accepted the initial call from the database
-            cursor.execute("SELECT * FROM callbot_response_accepted WHERE Event_ID = %s", (event_id,))
-            results = cursor.fetchall()
-            column_names = [desc[0] for desc in cursor.description]  # Get column names from cursor description
-            
-            cursor.close()
-            conn.close()
-            
-            if results:
-                # Create DataFrame and clean it to remove duplicate recipient numbers
-                df = pd.DataFrame(results, columns=column_names)
-                df_cleaned = df.drop_duplicates(subset=['Recipient_Number'])
-                df_cleaned['Event_Time'] = df_cleaned['Event_Time'].astype(str).apply(lambda x: x.split(" ")[-1])
-
-                # Loop over each attendee and make the reminder call
-                for idx, row in df_cleaned.iterrows():
-                    make_call(
-                        attendee_phonenumber=row["Recipient_Number"],
-                        attendee_name=row["Attendee_Name"],
-                        event_name=row["Event_Name"],
-                        event_summary=row["Event_Summary"],
-                        event_date=row["Event_Date"],
-                        event_venue=row["Event_Venue"],
-                        call_type='reminder',
-                        event_id=row["Event_ID"],
-                        eventTime=row["Event_Time"]
-                    )
-                
-                return jsonify(status='success', message='Reminder call triggered successfully')
-            else:
-                return jsonify(status='error', message='No attendees found for this event')
-        else:
-            return jsonify(status='error', message='Could not establish a connection to the database')
+
+        # Latest acceptance per recipient, resolved in SQL
+        callback_ids = get_latest_acceptance_ids(event_id)
+        if not callback_ids:
+            return jsonify(status='error', message='No attendees found for this event')
+
+        # Hand the reminder calls to the background dialer, which reads the rows batch by batch
+        calls = (
+            {
+                'attendee_phonenumber': row["Recipient_Number"],
+                'attendee_name': row["Attendee_Name"],
+                'event_name': row["Event_Name"],
+                'event_summary': row["Event_Summary"],
+                'event_date': row["Event_Date"],
+                'event_venue': row["Event_Venue"],
+                'call_type': 'reminder',
+                'event_id': row["Event_ID"],
+                'eventTime': row["Event_Time"]
+            }
+            for row in iter_acceptances(callback_ids)
+        )
+        job_id = start_dial_job(calls, description=f"reminder calls for event {event_id}", total=len(callback_ids))
+
+        return jsonify(status='success', message='Reminder call triggered successfully', job_id=job_id)
     except Exception as e:
         logging.error(f'Error occurred: {str(e)}')
         return jsonify(status='error', message='An error occurred while triggering the reminder call. Please try again.')
 
 
-def voice_view():
+def dial_status_view(job_id):
     """
-    Handles the Twilio voice response for initial event invitations.
+    API endpoint reporting the progress of a dial job started by a trigger request.
 
-    This function processes the request from Twilio, gathers necessary event and attendee 
-    information from query parameters, and initiates a Twilio voice response that provides 
-    details about the event and prompts the attendee to accept the invitation or request a callback.
+    Args:
+        job_id (str): The job ID returned by the trigger request.
 
     Returns:
-        str: The Twilio VoiceResponse object as a string.
+        JSON response with the job counters and status, or a 404 error if the job is unknown.
     """
-    try:
-        attendee_name = request.args.get('name', 'Attendee')
-        event_name = request.args.get('event', 'Event')
-        event_summary = request.args.get('summary', 'Summary')
-        event_date = request.args.get('date', 'the scheduled date')
-        event_venue = request.args.get('venue', 'the designated venue')
-        event_id = request.args.get('eventId', 'eventId')
-        eventTime = request.args.get('eventTime', 'eventTime')
-        attendee_phonenumber = request.args.get('attendee_phonenumber', 'attendee_phonenumber')
-        first_name = attendee_name.split()[0]
-        call_sid = request.values.get('CallSid')
-        guid = call_guid_map.get(call_sid)
-        resp = VoiceResponse()
-        gather = Gather(action='/gather', num_digits=1)
-        gather.say(
-            f"Hello {first_name}, This is the Open GOV Bot calling on behalf of the organizing committee for an event. We are delighted to invite you to our upcoming event, {event_name}! Taking place on {event_date} at {eventTime} Malaysia Standard Time. This event promises to be an insightful experience held at {event_venue}. Heres a brief overview: {event_summary}. We believe your presence will add immense value, and we would be honored to have you with us. To confirm your attendance, please press 1. If you need a callback for more details, press 2.",
-            voice=voice_change
-        )
-
-        csv_blob_name = get_current_csv_blob_name()
-        write_csv_header(csv_blob_name)
-        data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,InVoice,,{event_date},{event_name},{event_summary},{eventTime},{event_venue},\n"
-        append_to_blob(csv_blob_name, data)
+    job = get_dial_job(job_id)
+    if job is None:
+        return jsonify(status='error', message='Dial job not found'), 404
+    return jsonify(status='success', job=job)
 
-        resp.append(gather)
-        return str(resp)
-    except Exception as e:
-        logging.error(f"Error in /voice: {e}")
-        return str(VoiceResponse().say("An application error occurred.", voice=voice_change))
 
-def gather_view():
+def event_outcomes_view(event_id):
     """
-    Handles the response from the call recipient and initiates further actions based on the response.
+    API endpoint counting the calls of an event per outcome over a range of days of the Parquet call archive.
 
-    This function processes the digit input from the call recipient, prompts further questions, and logs the
-    responses to a CSV file. It offers options to accept the invitation or request a callback, and handles invalid inputs.
+    Query parameters `start` and `end` (YYYY-MM-DD, inclusive) default to the last 90 days. Days that have not
+    been archived yet are not counted.
 
-    Returns:
-        str: The Twilio VoiceResponse object as a string.
-    """
-    attendee_name = request.args.get('name', 'Attendee')
-    event_name = request.args.get('event', 'Event')
-    event_summary = request.args.get('summary', 'Summary')
-    event_date = request.args.get('date', 'the scheduled date')
-    event_venue = request.args.get('venue', 'the designated venue')
-    event_id = request.args.get('eventId', 'eventId')
-    event_time = request.args.get('eventTime', 'eventTime')
-    attendee_phonenumber = request.args.get('attendee_phonenumber', 'attendee_phonenumber')
-    first_name = attendee_name.split()[0]
+    Args:
+        event_id (str): The event.
 
+    Returns:
+        JSON response with the counts, a 400 error for an invalid range, or a 503 error if the archive is not
+        available.
+    """
     try:
-        digit = request.values.get('Digits')
-        resp = VoiceResponse()
-        call_sid = request.values.get('CallSid')
-        guid = call_guid_map.get(call_sid)
-
-        if digit == '1':
-            gather = Gather(action='/gather2', num_digits=1)
-            gather.say(
-                "Thank you for accepting the invitation. Would you like to utilize our pickup and drop-off service for this event? If yes, press 1. If no, press 2.",
-                voice=voice_change
-            )
-            resp.append(gather)
-
-            csv_blob_name = get_current_csv_blob_name()
-            write_csv_header(csv_blob_name)
-            data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,Invite Accepted,,{event_date},{event_name},{event_summary},{event_time},{event_venue},\n"
-            append_to_blob(csv_blob_name, data)
-
-            log_response('Invite Accepted')
-        elif digit == '2':
-            resp.say(
-                "You have requested a callback. We will reach out to you later. Thank you and Good day.",
-                voice=voice_change
-            )
+        end = datetime.strptime(request.args['end'], '%Y-%m-%d').date() if 'end' in request.args else datetime.now().date()
+        start = datetime.strptime(request.args['start'], '%Y-%m-%d').date() if 'start' in request.args else end - timedelta(days=89)
+        counts = outcome_counts(event_id, start, end)
+    except ValueError as e:
+        return jsonify(status='error', message=str(e)), 400
+    except RuntimeError as e:
+        logging.error(f"Event outcome query failed: {e}")
+        return jsonify(status='error', message='Call archive not available'), 503
+    return jsonify(status='success', **counts)
 
-            csv_blob_name = get_current_csv_blob_name()
-            write_csv_header(csv_blob_name)
-            data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,Request Callback,,{event_date},{event_name},{event_summary},{event_time},{event_venue},\n"
-            append_to_blob(csv_blob_name, data)
 
-            log_response('Request Callback')
-        else:
-            resp.say("You did not press a valid option.", voice=voice_change)
+def event_summary_view(event_id):
+    """
+    API endpoint returning the number of calls of an event per outcome, as maintained by db_update in the
+    event summary table.
 
-            csv_blob_name = get_current_csv_blob_name()
-            write_csv_header(csv_blob_name)
-            data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,Invalid option,,{event_date},{event_name},{event_summary},{event_time},{event_venue},\n"
-            append_to_blob(csv_blob_name, data)
+    Args:
+        event_id (int): The event.
 
-        return str(resp)
-    except Exception as e:
-        logging.error(f"Error in /gather: {e}")
-        return str(VoiceResponse().say("An application error occurred.", voice=voice_change))
+    Returns:
+        JSON response with the calls per outcome (0 for outcomes without calls) and the time of the last
+        update, which is null if no call of the event has been ingested yet. Until db_update has created
+        the summary table, every outcome is 0.
+    """
+    rows = []
+    with db_connection() as conn:
+        if check_table_exists(conn, summary_table):
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute(f"SELECT Outcome, Calls, Last_Updated FROM {summary_table} WHERE Event_ID = %s",
+                           (event_id,))
+            rows = cursor.fetchall()
+            cursor.close()
+    outcomes = {label: 0 for _, _, _, label in BUCKET_RULES}
+    outcomes.update({row['Outcome']: row['Calls'] for row in rows})
+    last_updated = max((row['Last_Updated'] for row in rows if row['Last_Updated']), default=None)
+    return jsonify(status='success', event_id=event_id, outcomes=outcomes,
+                   last_updated=str(last_updated) if last_updated else None)
 
 
-def gather2_view():
+def metrics_view():
     """
-    Handles the next response from the call recipient regarding pickup and drop-off service.
+    Exposes the application metrics (request, blob, db_update, dialer and Twilio latencies) of all worker
+    processes in the Prometheus text format.
+    """
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+
+# Defaults used when neither a stored context nor the URL provides a value
+CALL_CONTEXT_DEFAULTS = {
+    'name': 'Attendee',
+    'event': 'Event',
+    'summary': 'Summary',
+    'date': 'the scheduled date',
+    'venue': 'the designated venue',
+    'eventId': '',
+    'eventTime': 'eventTime',
+    'attendee_phonenumber': 'attendee_phonenumber',
+}
+
+def resolve_call_context():
+    """
+    Returns the GUID and the context of the call a Twilio webhook belongs to.
+
+    The GUID is taken from the `guid` URL parameter, or looked up by CallSid for Gather actions of calls
+    placed without it. The context is read from the call context store. Calls placed before contexts were
+    stored carry their details in the URL instead, which is used as a fallback.
 
-    This function processes the digit input to determine if the recipient wants to use the pickup and drop-off service,
-    and prompts for further details if accepted. It logs the responses to a CSV file.
+    The `eventId` URL parameter, set on every webhook URL of a call, wins over the stored context, so the
+    rows of a call land in the partition of its event even when the context cannot be read.
 
     Returns:
-        str: The Twilio VoiceResponse object as a string.
-    """
-    attendee_name = request.args.get('name', 'Attendee')
-    event_name = request.args.get('event', 'Event')
-    event_summary = request.args.get('summary', 'Summary')
-    event_date = request.args.get('date', 'the scheduled date')
-    event_venue = request.args.get('venue', 'the designated venue')
-    event_id = request.args.get('eventId', 'eventId')
-    event_time = request.args.get('eventTime', 'eventTime')
-    attendee_phonenumber = request.args.get('attendee_phonenumber', 'attendee_phonenumber')
-    first_name = attendee_name.split()[0]
+        tuple: (guid, context), where `guid` may be None and `context` has every key of CALL_CONTEXT_DEFAULTS.
+    """
+    guid = request.args.get('guid') or call_guid_map.get(request.values.get('CallSid'))
+    stored = get_call_context(guid) if guid else None
+    source = stored if stored is not None else request.args
+    context = {key: source.get(key) or default for key, default in CALL_CONTEXT_DEFAULTS.items()}
+    context['eventId'] = request.args.get('eventId') or context['eventId']
+    return guid, context
 
-    try:
-        digit = request.values.get('Digits')
-        resp = VoiceResponse()
-        call_sid = request.values.get('CallSid')
-        guid = call_guid_map.get(call_sid)
-
-        if digit == '1':
-            gather = Gather(action='/gather3', num_digits=1)
-            gather.say(
-                "To arrange the pickup and drop-off service, please specify your preferred address. For office address, press 1. For home address, press 2.",
-                voice=voice_change
-            )
-            resp.append(gather)
-
-            csv_blob_name = get_current_csv_blob_name()
-            write_csv_header(csv_blob_name)
-            data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,Pickup and Drop Accepted,,{event_date},{event_name},{event_summary},{event_time},{event_venue},\n"
-            append_to_blob(csv_blob_name, data)
-
-            log_response('Pickup and Drop Accepted')
-        elif digit == '2':
-            resp.say(
-                "You have declined the pickup and drop-off service. Thank you & Good day.",
-                voice=voice_change
-            )
+def call_params(guid, context):
+    """
+    Returns the URL parameters identifying a call, added to the Gather actions of its TwiML.
+    """
+    return {'guid': guid, 'eventId': context['eventId']}
 
-            csv_blob_name = get_current_csv_blob_name()
-            write_csv_header(csv_blob_name)
-            data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,Pickup and Drop Declined,,{event_date},{event_name},{event_summary},{event_time},{event_venue},\n"
-            append_to_blob(csv_blob_name, data)
+def webhook_row(guid, context, response):
+    """
+    Formats the CSV row logged by a webhook.
 
-            log_response('Pickup and Drop Declined')
-        else:
-            resp.say("You did not press a valid option.", voice=voice_change)
+    The event details are left out: they are stored once per call in the call context and in the row
+    written when the call was placed, which is the row the bucket tables are built from.
+    """
+    return (f"{guid},{context['eventId']},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},"
+            f"{context['attendee_phonenumber']},initiated,{response},,,,,,,\n")
 
-            csv_blob_name = get_current_csv_blob_name()
-            write_csv_header(csv_blob_name)
-            data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,Invalid option,,{event_date},{event_name},{event_summary},{event_time},{event_venue},\n"
-            append_to_blob(csv_blob_name, data)
+def voice_view():
+    """
+    Handles the Twilio voice response for initial event invitations.
+
+    This function processes the request from Twilio, looks up the event and attendee information
+    of the call by its GUID, and initiates a Twilio voice response that provides 
+    details about the event and prompts the attendee to accept the invitation or request a callback.
 
-        return str(resp)
+    Returns:
+        str: The TwiML response as a string.
+    """
+    try:
+        guid, context = resolve_call_context()
+        first_name = context['name'].split()[0]
+        csv_blob_name = partition_blob_name(context['eventId'])
+        log_call_event(csv_blob_name, webhook_row(guid, context, 'InVoice'))
+
+        twiml = invitation_twiml(first_name, context['eventId'], context['event'], context['date'], context['eventTime'],
+                                 context['venue'], context['summary'], action=ivr_node_url(ivr_flow['start']))
+        return add_action_params(twiml, call_params(guid, context))
     except Exception as e:
-        logging.error(f"Error in /gather2: {e}")
-        return str(VoiceResponse().say("An application error occurred.", voice=voice_change))
+        logging.error(f"Error in /voice: {e}")
+        return static_twiml('error')
 
-def gather3_view():
+def ivr_view(node):
     """
-    Handles the final response from the call recipient regarding the preferred address for pickup and drop-off service.
+    Handles a key press on a node of the IVR flow.
 
-    This function processes the digit input to confirm the preferred address for pickup and drop-off service,
-    and logs the responses to a CSV file.
+    This function resolves the digit entered on the given node through the IVR flow (see ivr_flow.py),
+    logs the outcome of the transition to the CSV file and returns the TwiML of the next node. A digit
+    without a transition is logged as an invalid option. The time spent on each node is recorded.
+
+    Args:
+        node (str): The name of the node whose prompt the digit was entered on.
 
     Returns:
-        str: The Twilio VoiceResponse object as a string.
-    """
-    attendee_name = request.args.get('name', 'Attendee')
-    event_name = request.args.get('event', 'Event')
-    event_summary = request.args.get('summary', 'Summary')
-    event_date = request.args.get('date', 'the scheduled date')
-    event_venue = request.args.get('venue', 'the designated venue')
-    event_id = request.args.get('eventId', 'eventId')
-    event_time = request.args.get('eventTime', 'eventTime')
-    attendee_phonenumber = request.args.get('attendee_phonenumber', 'attendee_phonenumber')
-    first_name = attendee_name.split()[0]
+        str: The TwiML response as a string.
+    """
+    if node not in ivr_flow['nodes']:
+        return Response(status=404, response="Unknown IVR node.")
+    started = time.perf_counter()
 
     try:
         digit = request.values.get('Digits')
-        resp = VoiceResponse()
-        call_sid = request.values.get('CallSid')
-        guid = call_guid_map.get(call_sid)
-
-        if digit == '1':
-            resp.say(
-                "You have chosen the office address for pickup and drop-off. Thank you & Good day.",
-                voice=voice_change
-            )
+        guid, context = resolve_call_context()
 
-            csv_blob_name = get_current_csv_blob_name()
-            write_csv_header(csv_blob_name)
-            data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,Office Address,,{event_date},{event_name},{event_summary},{event_time},{event_venue},\n"
-            append_to_blob(csv_blob_name, data)
+        outcome, twiml, valid = handle_ivr_input(node, digit)
 
-            log_response('Office Address')
-        elif digit == '2':
-            resp.say(
-                "You have chosen the home address for pickup and drop-off. Thank you & Good day.",
-                voice=voice_change
-            )
+        csv_blob_name = partition_blob_name(context['eventId'])
+        log_call_event(csv_blob_name, webhook_row(guid, context, outcome))
 
-            csv_blob_name = get_current_csv_blob_name()
-            write_csv_header(csv_blob_name)
-            data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,Home Address,,{event_date},{event_name},{event_summary},{event_time},{event_venue},\n"
-            append_to_blob(csv_blob_name, data)
+        if valid:
+            log_response(outcome)
 
-            log_response('Home Address')
-        else:
-            resp.say("You did not press a valid option.", voice=voice_change)
+        return add_action_params(twiml, call_params(guid, context))
+    except Exception as e:
+        logging.error(f"Error in /ivr/{node}: {e}")
+        return static_twiml('error')
+    finally:
+        record_node_timing(node, time.perf_counter() - started)
 
-            csv_blob_name = get_current_csv_blob_name()
-            write_csv_header(csv_blob_name)
-            data = f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},{attendee_phonenumber},initiated,Invalid option,,{event_date},{event_name},{event_summary},{event_time},{event_venue},\n"
-            append_to_blob(csv_blob_name, data)
+def gather_view():
+    """
+    Handles the response to the initial invitation. Kept for calls whose TwiML still posts to /gather.
 
-        return str(resp)
-    except Exception as e:
-        logging.error(f"Error in /gather3: {e}")
-        return str(VoiceResponse().say("An application error occurred.", voice=voice_change))
+    Returns:
+        str: The TwiML response as a string.
+    """
+    return ivr_view('invitation')
+
+
+def gather2_view():
+    """
+    Handles the response to the pickup and drop-off question. Kept for calls whose TwiML still posts to /gather2.
+
+    Returns:
+        str: The TwiML response as a string.
+    """
+    return ivr_view('accepted')
+
+def gather3_view():
+    """
+    Handles the preferred pickup address. Kept for calls whose TwiML still posts to /gather3.
+
+    Returns:
+        str: The TwiML response as a string.
+    """
+    return ivr_view('pickup_accepted')
 
 def status_view():
     """
     Handles POST requests to the /status endpoint to log and update the status of a call.
 
-    Retrieves the call status and call SID from the request, logs this information, and maps the call SID 
-    to a GUID. If the GUID is found, it logs the status update in a CSV file. If not, it returns a 404 response.
+    Retrieves the call status and call SID from the request, logs this information, and takes the call's GUID
+    from the status callback URL (or maps the call SID to a GUID). If the GUID is found, it logs the status update in a CSV file. If not, it returns a 404 response.
+    When the call has completed, a database update is requested from the background worker rather than run inline.
     In case of any errors during processing, it returns a 500 response.
 
     Returns:
@@ -600,25 +555,27 @@ def status_view():
         # Log the received call status and SID
         logging.info(f"Call status: {call_status}, Call SID: {call_sid}")
 
-        # Retrieve the GUID associated with the call SID
-        guid = call_guid_map.get(call_sid)  # Lookup the GUID for the given call SID
+        # Retrieve the GUID from the status callback URL, or from the call SID for calls placed without it
+        guid = request.args.get('guid') or call_guid_map.get(call_sid)
 
         if not guid:
             # If GUID not found, log a warning and return a 404 response
             logging.warning(f"GUID not found for Call SID: {call_sid}")
             return Response(status=404, response="GUID not found.")
 
-        # Prepare the CSV blob name and write the status update to the CSV file
-        csv_blob_name = get_current_csv_blob_name()  # Get the name of the current CSV blob
-        write_csv_header(csv_blob_name)  # Ensure the CSV header is written if necessary
+        # Prepare the CSV blob name and queue the status update for the CSV file. The event comes from the
+        # status callback URL; the stored context is only read for calls placed without it there.
+        event_id = request.args.get('eventId') or (get_call_context(guid) or {}).get('eventId')
+        csv_blob_name = partition_blob_name(event_id)  # The CSV part of the call's event
 
         # Create a data string with GUID, timestamp, Twilio number, recipient number, and call status
         data = f"{guid},,{timestamp},{twilio_number},{request.values.get('To')},{call_status},\n"
-        append_to_blob(csv_blob_name, data)  # Append the data string to the CSV blob
+        log_call_event(csv_blob_name, data)  # Queue the data string for the CSV blob
 
         if call_status == 'completed':
-            main()
-            logging.info(f"db updated successfully")
+            call_guid_map.mark_completed(call_sid)
+            call_context_map.mark_completed(guid)
+            request_blob_update()  # Coalesced with other completions, runs in the background
 
         # Return a 200 OK response indicating success
         return Response(status=200)
@@ -632,53 +589,29 @@ def reminder_view():
         """
     Handles requests to send a voice reminder about an upcoming event to a specified attendee.
 
-    Retrieves event and attendee details from the request parameters, constructs a voice message
-    using Twilio's VoiceResponse, and logs the reminder details in a CSV file. If an error occurs,
+    Retrieves event and attendee details from the context of the call, constructs a voice message
+    from the cached TwiML template of the event, and logs the reminder details in a CSV file. If an error occurs,
     it logs the error and returns a voice response indicating an application error.
 
     Returns:
-        str: Twilio VoiceResponse object as a string.
+        str: The TwiML response as a string.
     """
         try:
-            # Retrieve event and attendee details from the request
-            attendee_name = request.args.get('name', 'Attendee')  # Attendee's name
-            event_name = request.args.get('event', 'Event')  # Event name
-            event_date = request.args.get('date', 'the scheduled date')  # Event date
-            call_sid = request.values.get('CallSid')  # Call SID from the request
-            event_time = request.args.get('eventTime', 'eventTime')  # Event time
-            event_summary = request.args.get('summary', 'Summary')  # Event summary
-            event_venue = request.args.get('venue', 'the designated venue')  # Event venue
-            event_id = request.args.get('eventId', 'eventId')  # Event ID
-            attendee_phonenumber = request.args.get('attendee_phonenumber', 'attendee_phonenumber')  # Attendee's phone number
-    
-            # Retrieve the GUID associated with the call SID
-            guid = call_guid_map.get(call_sid)  # Lookup the GUID for the given call SID
-            first_name = attendee_name.split()[0]  # Extract the first name of the attendee
+            # Retrieve the GUID and the event and attendee details of the call
+            guid, context = resolve_call_context()
+            first_name = context['name'].split()[0]  # Extract the first name of the attendee
     
-            # Create a Twilio VoiceResponse for the reminder
-            resp = VoiceResponse()
-            resp.say(
-                f"Hello {first_name}, as a valued registered participant, this is a reminder from the OpenGov call bot regarding the upcoming event, {event_name}. scheduled date {event_date} at {event_time} Malaysia Standard Time. To be held at {event_venue}. Thank you.",
-                voice=voice_change
-            )
-    
-            # Prepare the CSV blob name and write the reminder data to the CSV file
-            csv_blob_name = get_current_csv_blob_name()  # Get the name of the current CSV blob
-            write_csv_header(csv_blob_name)  # Ensure the CSV header is written if necessary
-    
-            # Create a data string with all event and attendee details
-            data = (
-                f"{guid},{event_id},{datetime.now().strftime('%Y-%m-%d %H:%M:%S')},{twilio_number},"
-                f"{attendee_phonenumber},initiated,Reminder Completed,,{event_date},{event_name},"
-                f"{event_summary},{event_time},{event_venue},\n"
-            )
-            append_to_blob(csv_blob_name, data)  # Append the data string to the CSV blob
+            # Prepare the CSV blob name and queue the reminder row for the CSV file
+            csv_blob_name = partition_blob_name(context['eventId'])  # The CSV part of the call's event
+            log_call_event(csv_blob_name, webhook_row(guid, context, 'Reminder Completed'))
     
-            return str(resp)  # Return the Twilio VoiceResponse as a string
+            # Render the reminder from the cached template for this event
+            return reminder_twiml(first_name, context['eventId'], context['event'], context['date'],
+                                  context['eventTime'], context['venue'])
         except Exception as e:
             # Log any exceptions that occur and return a voice response indicating an error
             logging.error(f"Error in /reminder: {e}")
-            return str(VoiceResponse().say("An application error occurred.", voice=voice_change))
+            return static_twiml('error')
     
 #Login,signup and logout logic
 def home_view():
@@ -0,0 +1,19 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+"""
+__init__.py
+Description:
+Offline performance tools for the call bot. They run the application in-process against the local stand-ins
+of fakes.py, so they need neither Azure, Twilio nor MySQL, and report their results as JSON.
+
+Content Overview:
+fakes.py: Stand-ins for Blob Storage, Twilio and MySQL, and their installation into `app`.
+report.py: Latency statistics and the JSON results envelope.
+run_benchmarks.py: Benchmarks of db_update ingest, make_call dispatch and the webhooks.
+webhook_storm.py: Load generator replaying bursts of Twilio webhooks at a target rate.
+
+"""
@@ -0,0 +1,447 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+fakes.py
+Description:
+In-process stand-ins for the external services of the application, so that it can be imported, driven and
+measured without Azure Key Vault, Blob Storage, Twilio or MySQL.
+
+Content Overview:
+Environment: `configure_environment` sets the variables that must be in place before `app` is imported
+(secrets from the environment, in-memory call store, no scheduler thread).
+Blob Storage: A container kept in a local directory, answering the BlobClient calls made by the application.
+Twilio: A client recording every call it is asked to create, with an optional simulated API latency.
+MySQL: A connection pool handing out SQLite connections, translating the MySQL statements the application
+issues (AUTO_INCREMENT, INSERT IGNORE, ON DUPLICATE KEY UPDATE, inline indexes, information_schema lookups).
+Installation: `install_fakes` plugs the stand-ins into the shared clients and the connection pool of `app`.
+
+The SQL translation covers the statements used by the application, not MySQL in general.
+
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+from azure.core import MatchConditions
+from azure.core.exceptions import HttpResponseError, ResourceExistsError, ResourceNotFoundError
+from azure.storage.blob import BlobType
+
+# sqlite3 cannot bind numpy scalars, which the pandas based ingest passes to executemany
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.int32, int)
+sqlite3.register_adapter(np.bool_, bool)
+
+
+def configure_environment(workdir):
+    """
+    Sets the environment variables that make `app` importable offline. Must be called before importing `app`.
+
+    Args:
+        workdir (str): Directory for the local files (application database, journal spill files).
+    """
+    os.makedirs(workdir, exist_ok=True)
+    defaults = {
+        'CALLBOT_SECRET_SOURCE': 'env',
+        'CALL_STORE_BACKEND': 'memory',
+        'BLOB_UPDATE_SCHEDULER_ENABLED': 'false',
+        'JOURNAL_SPILL_DIR': os.path.join(workdir, 'journal'),
+        'SECRET_TWILIOACCOUNTSID1': 'ACbenchmark',
+        'SECRET_TWILIOAUTHTOKEN': 'benchmark',
+        'SECRET_APPSECRETKEY': 'benchmark',
+        'SECRET_CONNECTSTRBLOB': 'UseDevelopmentStorage=true',
+        'SECRET_DBURL': 'localhost',
+        'SECRET_DBUSER': 'benchmark',
+        'SECRET_DBPASSWORD': 'benchmark',
+        'SECRET_PRODURL': 'https://callbot.invalid/',
+        'SECRET_INITAPPCONFIG': f"sqlite:///{os.path.join(os.path.abspath(workdir), 'app.db')}",
+    }
+    for name, value in defaults.items():
+        os.environ.setdefault(name, value)
+
+
+#-------------------------------------------------------------------------------------------------------
+# Blob Storage
+#-------------------------------------------------------------------------------------------------------
+
+class FileBlobServiceClient:
+    """
+    Stand-in for azure.storage.blob.BlobServiceClient keeping each container in a local directory.
+
+    Args:
+        root (str): Directory holding one sub-directory per container.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+
+    def get_blob_client(self, container, blob):
+        return FileBlobClient(self, container, blob)
+
+    def get_container_client(self, container):
+        return FileContainerClient(self, container)
+
+
+class FileContainerClient:
+    """
+    Stand-in for azure.storage.blob.ContainerClient.
+    """
+
+    def __init__(self, service, container):
+        self.service = service
+        self.container = container
+
+    def get_blob_client(self, blob):
+        return FileBlobClient(self.service, self.container, blob)
+
+    def list_blobs(self, name_starts_with=''):
+        """
+        Yields the properties of the blobs in the container whose name starts with the prefix, by name.
+        """
+        base = os.path.join(self.service.root, self.container)
+        names = []
+        for directory, _, files in os.walk(base):
+            for file_name in files:
+                if not file_name.endswith('.blobtype'):
+                    names.append(os.path.relpath(os.path.join(directory, file_name), base).replace(os.sep, '/'))
+        for name in sorted(names):
+            if name.startswith(name_starts_with or ''):
+                yield self.get_blob_client(name).get_blob_properties()
+
+
+class FileBlobClient:
+    """
+    Stand-in for azure.storage.blob.BlobClient. Appends are atomic within the process.
+    """
+
+    def __init__(self, service, container, blob):
+        self.service = service
+        self.container = container
+        self.blob_name = blob
+        self.path = os.path.join(service.root, container, *blob.split('/'))
+
+    def _type_path(self):
+        return self.path + '.blobtype'
+
+    def _write(self, data, mode, blob_type):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, mode) as f:
+            f.write(data)
+        if blob_type is not None:
+            with open(self._type_path(), 'w') as f:
+                f.write(blob_type)
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def get_blob_properties(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f"Blob {self.blob_name} not found")
+        try:
+            with open(self._type_path()) as f:
+                blob_type = BlobType(f.read())
+        except FileNotFoundError:
+            blob_type = BlobType.BLOCKBLOB
+        return SimpleNamespace(name=self.blob_name, size=stat.st_size, etag=f'"{stat.st_size}-{stat.st_mtime_ns}"',
+                               blob_type=blob_type, last_modified=stat.st_mtime)
+
+    def create_append_blob(self, match_condition=None, **kwargs):
+        with self.service.lock:
+            if self.exists() and match_condition == MatchConditions.IfMissing:
+                raise ResourceExistsError(f"Blob {self.blob_name} already exists")
+            self._write(b'', 'wb', BlobType.APPENDBLOB.value)
+
+    def append_block(self, data, **kwargs):
+        payload = data.encode('utf-8') if isinstance(data, str) else data
+        with self.service.lock:
+            if not self.exists():
+                raise ResourceNotFoundError(f"Blob {self.blob_name} not found")
+            if self.get_blob_properties().blob_type != BlobType.APPENDBLOB:
+                error = HttpResponseError(f"Blob {self.blob_name} is not an append blob")
+                error.error_code = 'InvalidBlobType'
+                raise error
+            self._write(payload, 'ab', None)
+        return {}
+
+    def upload_blob(self, data, blob_type=BlobType.BLOCKBLOB, overwrite=False, **kwargs):
+        payload = data.encode('utf-8') if isinstance(data, str) else data
+        blob_type = BlobType(blob_type)
+        with self.service.lock:
+            if self.exists() and not overwrite:
+                if blob_type != BlobType.APPENDBLOB:
+                    raise ResourceExistsError(f"Blob {self.blob_name} already exists")
+                self._write(payload, 'ab', None)
+            else:
+                self._write(payload, 'wb', blob_type.value)
+        return {}
+
+    def download_blob(self, offset=None, length=None, **kwargs):
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset or 0)
+                data = f.read() if length is None else f.read(length)
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f"Blob {self.blob_name} not found")
+        return SimpleNamespace(readall=lambda: data)
+
+    def delete_blob(self, **kwargs):
+        with self.service.lock:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                raise ResourceNotFoundError(f"Blob {self.blob_name} not found")
+            if os.path.exists(self._type_path()):
+                os.remove(self._type_path())
+
+
+#-------------------------------------------------------------------------------------------------------
+# Twilio
+#-------------------------------------------------------------------------------------------------------
+
+class RecordingTwilioClient:
+    """
+    Stand-in for twilio.rest.Client whose `calls.create` records the request and returns a new CallSid.
+
+    Args:
+        latency (float, optional): Seconds each API call takes, to simulate the round trip to Twilio.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.created = []
+        self.lock = threading.Lock()
+        self.calls = SimpleNamespace(create=self.create_call)
+
+    def create_call(self, **kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        call = SimpleNamespace(sid=f"CA{uuid.uuid4().hex}", **kwargs)
+        with self.lock:
+            self.created.append(call)
+        return call
+
+
+#-------------------------------------------------------------------------------------------------------
+# MySQL
+#-------------------------------------------------------------------------------------------------------
+
+INLINE_INDEX = re.compile(r'^\s*(UNIQUE\s+(?:KEY|INDEX)|UNIQUE|INDEX|KEY)\s+(\w+)\s*\(([^)]*)\)\s*,?\s*$',
+                          re.IGNORECASE | re.MULTILINE)
+ALTER_ADD_INDEX = re.compile(r'^\s*ALTER\s+TABLE\s+(\w+)\s+ADD\s+(UNIQUE\s+)?(?:INDEX|KEY)\s+(\w+)\s*\(([^)]*)\)\s*$',
+                             re.IGNORECASE)
+CREATE_TABLE = re.compile(r'CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE)
+ON_DUPLICATE = re.compile(r'ON\s+DUPLICATE\s+KEY\s+UPDATE\s+(.*)$', re.IGNORECASE | re.DOTALL)
+
+
+def index_name(table, name):
+    # SQLite index names are global to the database, MySQL ones are per table
+    return f"{table}__{name}"
+
+
+def translate_sql(sql):
+    """
+    Rewrites a MySQL statement used by the application into one or more SQLite statements.
+
+    Returns:
+        list: The SQLite statements, to be run in order; parameters apply to the first one.
+    """
+    sql = sql.replace('%s', '?').replace('%%', '%')
+    sql = re.sub(r'\bINSERT\s+IGNORE\b', 'INSERT OR IGNORE', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bINT\s+AUTO_INCREMENT\s+PRIMARY\s+KEY\b', 'INTEGER PRIMARY KEY AUTOINCREMENT', sql,
+                 flags=re.IGNORECASE)
+    sql = re.sub(r'\bON\s+UPDATE\s+CURRENT_TIMESTAMP\b', '', sql, flags=re.IGNORECASE)
+    sql = re.sub(r"\bTIME_FORMAT\(([^,]+),\s*'[^']*'\)", r'\1', sql, flags=re.IGNORECASE)
+    sql = re.sub(r'\bNOW\(\)', 'CURRENT_TIMESTAMP', sql, flags=re.IGNORECASE)
+
+    alter = ALTER_ADD_INDEX.match(sql)
+    if alter:
+        table, unique, name, columns = alter.groups()
+        return [f"CREATE {'UNIQUE ' if unique else ''}INDEX IF NOT EXISTS {index_name(table, name)} ON {table} ({columns})"]
+
+    duplicate = ON_DUPLICATE.search(sql)
+    if duplicate:
+        updates = re.sub(r'\bVALUES\((\w+)\)', r'excluded.\1', duplicate.group(1), flags=re.IGNORECASE)
+        sql = sql[:duplicate.start()] + 'ON CONFLICT DO UPDATE SET ' + updates
+
+    create = CREATE_TABLE.search(sql)
+    if not create:
+        return [sql]
+    table = create.group(1)
+    statements = []
+    for kind, name, columns in INLINE_INDEX.findall(sql):
+        unique = 'UNIQUE ' if kind.upper().startswith('UNIQUE') else ''
+        statements.append(f"CREATE {unique}INDEX IF NOT EXISTS {index_name(table, name)} ON {table} ({columns})")
+    sql = INLINE_INDEX.sub('', sql)
+    sql = re.sub(r',\s*\)\s*$', '\n)', sql.strip())
+    return [sql] + statements
+
+
+class SQLiteCursor:
+    """
+    Stand-in for a mysql.connector cursor over a SQLite connection.
+    """
+
+    def __init__(self, conn, dictionary=False):
+        self.conn = conn
+        self.dictionary = dictionary
+        self.cursor = conn.cursor()
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _rows(self, rows):
+        if not self.dictionary:
+            return [tuple(row) for row in rows]
+        columns = [column[0] for column in self.cursor.description or ()]
+        return [dict(zip(columns, row)) for row in rows]
+
+    def execute(self, sql, params=()):
+        if 'information_schema.statistics' in sql:
+            _, table, name = params
+            statements = ["SELECT COUNT(*) FROM sqlite_master WHERE type = 'index' AND name = ?"]
+            params = (index_name(table, name),)
+        elif 'information_schema.tables' in sql:
+            _, table = params
+            statements = ["SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?"]
+            params = (table,)
+        else:
+            statements = translate_sql(sql)
+        create = CREATE_TABLE.search(statements[0])
+        if create and self.conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                        (create.group(1),)).fetchone():
+            # Like MySQL, CREATE TABLE IF NOT EXISTS leaves the indexes of an existing table alone
+            statements = statements[:1]
+        self.cursor.execute(statements[0], tuple(params or ()))
+        self.rowcount = self.cursor.rowcount
+        self.lastrowid = self.cursor.lastrowid
+        for statement in statements[1:]:
+            self.conn.execute(statement)
+
+    def executemany(self, sql, seq_of_params):
+        self.cursor.executemany(translate_sql(sql)[0], [tuple(params) for params in seq_of_params])
+        self.rowcount = self.cursor.rowcount
+
+    def fetchone(self):
+        row = self.cursor.fetchone()
+        return None if row is None else self._rows([row])[0]
+
+    def fetchall(self):
+        return self._rows(self.cursor.fetchall())
+
+    def fetchmany(self, size=1):
+        return self._rows(self.cursor.fetchmany(size))
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def close(self):
+        self.cursor.close()
+
+
+class SQLiteConnection:
+    """
+    Stand-in for a pooled mysql.connector connection backed by a SQLite database file.
+    """
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+
+    def cursor(self, dictionary=False, **kwargs):
+        return SQLiteCursor(self.conn, dictionary=dictionary)
+
+    def ping(self, **kwargs):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def commit(self):
+        self.conn.commit()
+
+    def rollback(self):
+        self.conn.rollback()
+
+    def close(self):
+        self.conn.close()
+
+
+class SQLitePool:
+    """
+    Stand-in for mysql.connector.pooling.MySQLConnectionPool handing out SQLite connections to one file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def get_connection(self):
+        return SQLiteConnection(self.path)
+
+
+#-------------------------------------------------------------------------------------------------------
+# Installation
+#-------------------------------------------------------------------------------------------------------
+
+def install_fakes(workdir, twilio_latency=0.0):
+    """
+    Points the application at fresh stand-ins rooted in `workdir` and clears the caches tied to the old ones.
+
+    `app` must have been imported after `configure_environment`. May be called again, with a new directory,
+    to start from empty storage and an empty database.
+
+    Args:
+        workdir (str): Directory for the blob container and the SQLite database.
+        twilio_latency (float, optional): Simulated latency of each Twilio API call in seconds.
+
+    Returns:
+        SimpleNamespace: The installed `blob_service`, `twilio` client and database `db_path`.
+    """
+    import app.config as config
+    import app.db_connect as db_connect
+    import app.db_update as db_update
+    import app.blob_operations as blob_operations
+    import app.call_log as call_log
+    import app.dialer as dialer
+    import app.scheduler as scheduler
+
+    os.makedirs(workdir, exist_ok=True)
+    fakes = SimpleNamespace(
+        blob_service=FileBlobServiceClient(os.path.join(workdir, 'blobs')),
+        twilio=RecordingTwilioClient(twilio_latency),
+        db_path=os.path.join(workdir, 'mysql.db'),
+    )
+    with config.clients_lock:
+        config.shared_clients['blob'] = fakes.blob_service
+        config.shared_clients['twilio'] = fakes.twilio
+    with db_connect.db_pool_lock:
+        db_connect.db_pool = SQLitePool(fakes.db_path)
+        db_connect.db_pool_pid = os.getpid()
+    db_connect.attendee_table_ready = False
+
+    blob_operations.append_blobs_ready.clear()
+    blob_operations.legacy_blob_targets.clear()
+    db_update.prepared_tables.clear()
+    db_update.blob_properties.clear()
+    db_update.manifest_states.clear()
+    call_log.written_parts.clear()
+    call_log.manifest_versions.clear()
+    call_log.uploaded_versions.clear()
+    dialer.rate_limiter.table_ready = False
+    dialer._job_table_ready = False
+    scheduler.request_table_ready = False
+    # Ingest is driven explicitly by the benchmarks; webhooks only signal the (idle) scheduler thread
+    scheduler.is_leader = lambda: False
+    return fakes
@@ -0,0 +1,109 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+report.py
+Description:
+Summary statistics and the JSON envelope shared by the benchmark and load-generation tools.
+
+Content Overview:
+Statistics: Latency percentiles of a list of samples.
+Results: The run metadata (time, Python, platform, git commit) wrapped around the results, written as JSON.
+
+"""
+
+import json
+import math
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+# Bumped when the layout of the JSON results changes, so stored results can be compared safely
+RESULTS_FORMAT_VERSION = 1
+
+
+def percentile(sorted_values, fraction):
+    """
+    Returns the given percentile (0..1) of a sorted list using the nearest-rank method.
+    """
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize_latencies(samples):
+    """
+    Summarizes latency samples in seconds.
+
+    Returns:
+        dict: count, mean, p50, p90, p95, p99 and max, in milliseconds.
+    """
+    values = sorted(samples)
+    if not values:
+        return {'count': 0}
+    to_ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        'count': len(values),
+        'mean_ms': to_ms(sum(values) / len(values)),
+        'p50_ms': to_ms(percentile(values, 0.50)),
+        'p90_ms': to_ms(percentile(values, 0.90)),
+        'p95_ms': to_ms(percentile(values, 0.95)),
+        'p99_ms': to_ms(percentile(values, 0.99)),
+        'max_ms': to_ms(values[-1]),
+    }
+
+
+def git_commit():
+    """
+    Returns the commit of the working tree, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def new_workdir(prefix='callbot-bench-'):
+    """
+    Creates a temporary working directory for the fake backends.
+    """
+    return tempfile.mkdtemp(prefix=prefix)
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat(timespec='seconds')
+
+
+def build_results(tool, started_at, settings, results):
+    """
+    Wraps results with the metadata needed to compare runs across releases.
+    """
+    return {
+        'tool': tool,
+        'format_version': RESULTS_FORMAT_VERSION,
+        'started_at': started_at,
+        'git_commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': settings,
+        'results': results,
+    }
+
+
+def write_json(results, path=None):
+    """
+    Writes results as JSON to a file, or to stdout if no path is given.
+    """
+    text = json.dumps(results, indent=2, default=str)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
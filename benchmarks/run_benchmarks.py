@@ -0,0 +1,301 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+run_benchmarks.py
+Description:
+Measures the hot paths of the application against the local stand-ins of benchmarks/fakes.py and writes the
+results as JSON, so they can be stored and compared from release to release.
+
+Content Overview:
+db_update: Ingest time of `db_update.main()` for a day of N call log rows spread over the parts of 10 events
+(full run), for the rows appended after it (incremental run) and for unchanged parts, with the time spent in
+each ingest stage.
+make_call: Dispatch rate of `make_call` with a recording Twilio client and an optional simulated API latency.
+Webhooks: Throughput and latency of the /voice -> /gather -> /status sequence of a call, per route.
+
+Usage:
+    python -m benchmarks.run_benchmarks --output results.json
+    python -m benchmarks.run_benchmarks --only db_update --day-sizes 1000 10000 100000
+
+"""
+
+import argparse
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+
+from .fakes import configure_environment, install_fakes
+from .report import build_results, new_workdir, summarize_latencies, utc_now, write_json
+
+BENCHMARKS = ('db_update', 'make_call', 'webhooks')
+
+# Responses cycled through by the synthetic calls; None stands for a call that was not answered
+SYNTHETIC_OUTCOMES = ['Invite Accepted', 'Request Callback', 'Pickup and Drop Accepted', 'Pickup and Drop Declined',
+                      'Invalid option', None]
+
+TWILIO_NUMBER = '+6560000000'
+
+
+def synthetic_call_rows(index, event_count=10):
+    """
+    Returns the four CSV rows logged for one call: the row written by make_call, the /voice row, the key press
+    or the ringing status, and the final status.
+    """
+    guid = str(uuid.uuid4())
+    event_id = index % event_count + 1
+    phone = f'65{80000000 + index}'
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    outcome = SYNTHETIC_OUTCOMES[index % len(SYNTHETIC_OUTCOMES)]
+    call_type = 'reminder' if index % 10 == 9 else 'initial'
+    rows = [
+        f"{guid},{event_id},{now},{TWILIO_NUMBER},{phone},initiated,,Attendee {index},2030-01-01,,,,,{call_type}\n",
+    ]
+    if outcome is None:
+        rows.append(f"{guid},,{now},{TWILIO_NUMBER},{phone},ringing,\n")
+        rows.append(f"{guid},,{now},{TWILIO_NUMBER},{phone},no-answer,\n")
+    else:
+        rows.append(f"{guid},{event_id},{now},{TWILIO_NUMBER},{phone},initiated,InVoice,,,,,,,\n")
+        rows.append(f"{guid},{event_id},{now},{TWILIO_NUMBER},{phone},initiated,{outcome},,,,,,,\n")
+    rows.append(f"{guid},,{now},{TWILIO_NUMBER},{phone},completed,\n")
+    return rows
+
+
+def synthetic_parts(first_call, rows):
+    """
+    Returns `rows` rows (rounded up to whole calls), starting with call number `first_call`, grouped by the
+    call log part of their event, and the number of the next call.
+    """
+    from app.call_log import partition_blob_name
+
+    parts = {}
+    count = 0
+    index = first_call
+    while count < rows:
+        call_rows = synthetic_call_rows(index)
+        parts.setdefault(partition_blob_name(call_rows[0].split(',')[1]), []).extend(call_rows)
+        count += len(call_rows)
+        index += 1
+    return {part: ''.join(lines) for part, lines in parts.items()}, index
+
+
+def append_parts(parts):
+    """
+    Writes rows to their parts and publishes them in the manifest, as the event journal does.
+    """
+    from app.blob_operations import append_to_blob, write_csv_header
+    from app.call_log import record_appends
+
+    appended = {}
+    for part, text in parts.items():
+        write_csv_header(part)
+        append_to_blob(part, text)
+        appended[part] = len(text.encode('utf-8'))
+    record_appends(appended)
+
+
+def register_synthetic_events(event_count=10):
+    """
+    Registers the events of the synthetic calls, whose details db_update joins to the rows written by make_call.
+    """
+    from app.config import registration_table
+    from app.db_connect import create_table_if_not_exists, db_cursor
+
+    create_table_if_not_exists()
+    with db_cursor() as cursor:
+        cursor.executemany(
+            f"""INSERT IGNORE INTO {registration_table} (eventID, eventName, eventLocation, eventSummary, eventDate,
+                    eventTime, attendees) VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+            [(event_id, f'Event {event_id}', f'Venue {event_id}', f'Summary of event {event_id}', '2030-01-01',
+              '10:00:00', '') for event_id in range(1, event_count + 1)]
+        )
+
+
+def stage_totals():
+    """
+    Returns the total seconds recorded so far per db_update stage.
+    """
+    from app.metrics import db_update_stage_seconds
+    with db_update_stage_seconds.lock:
+        return {key[0]: series['sum'] for key, series in db_update_stage_seconds.series.items()}
+
+
+def count_bucket_rows(db_path):
+    import sqlite3
+    from app.db_update import BUCKET_RULES
+    conn = sqlite3.connect(db_path)
+    try:
+        return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0] for table, _, _, _ in BUCKET_RULES}
+    finally:
+        conn.close()
+
+
+def timed_ingest():
+    """
+    Runs `db_update.main()` once and returns its duration and the seconds spent in each stage.
+    """
+    import app.db_update as db_update
+    before = stage_totals()
+    started = time.perf_counter()
+    db_update.main()
+    seconds = time.perf_counter() - started
+    after = stage_totals()
+    stages = {stage: round(total - before.get(stage, 0.0), 6) for stage, total in after.items()
+              if total - before.get(stage, 0.0) > 0}
+    return {'seconds': round(seconds, 6), 'stages': stages}
+
+
+def bench_db_update(workdir, day_sizes, incremental_fraction):
+    """
+    Measures the ingest of a day of call log rows of each size into the bucket tables.
+    """
+    import app.call_log as call_log
+
+    results = []
+    for rows in day_sizes:
+        fakes = install_fakes(os.path.join(workdir, f'db_update_{rows}'))
+        register_synthetic_events()
+        day, next_call = synthetic_parts(0, rows)
+        append_parts(day)
+
+        full = timed_ingest()
+        appended, _ = synthetic_parts(next_call, max(int(rows * incremental_fraction), 4))
+        append_parts(appended)
+        incremental = timed_ingest()
+        unchanged = timed_ingest()
+
+        day_rows = sum(text.count('\n') for text in day.values())
+        results.append({
+            'rows': day_rows,
+            'appended_rows': sum(text.count('\n') for text in appended.values()),
+            'parts': len(day),
+            'blob_bytes': sum(properties.size for properties in fakes.blob_service.get_container_client(
+                call_log.container_name).list_blobs(name_starts_with=call_log.call_log_prefix)),
+            'full': dict(full, rows_per_second=round(day_rows / full['seconds'], 1)),
+            'incremental': incremental,
+            'unchanged': unchanged,
+            'inserted_rows': count_bucket_rows(fakes.db_path),
+        })
+    return results
+
+
+def bench_make_call(workdir, calls, twilio_latency):
+    """
+    Measures how fast `make_call` dispatches calls, one after the other.
+    """
+    from app.twilio_calls import make_call
+
+    fakes = install_fakes(os.path.join(workdir, 'make_call'), twilio_latency=twilio_latency)
+    latencies = []
+    started = time.perf_counter()
+    for index in range(calls):
+        call_started = time.perf_counter()
+        make_call(f'65{80000000 + index}', f'Attendee {index}', 'Event', 'Summary', '2030-01-01', 'Venue',
+                  'initial', index % 10 + 1, '10:00:00')
+        latencies.append(time.perf_counter() - call_started)
+    seconds = time.perf_counter() - started
+    return {
+        'calls': calls,
+        'placed': len(fakes.twilio.created),
+        'seconds': round(seconds, 6),
+        'calls_per_second': round(calls / seconds, 1),
+        'latency': summarize_latencies(latencies),
+    }
+
+
+def bench_webhooks(workdir, calls):
+    """
+    Measures the webhooks Twilio calls during one answered call, using the Flask test client.
+
+    The calls are placed first (not measured), so every webhook finds the stored context of its call.
+    """
+    from app import app as flask_app
+    import app.routes  # noqa: F401 (registers the routes)
+    from app.call_store import call_guid_map
+    from app.twilio_calls import place_call
+
+    install_fakes(os.path.join(workdir, 'webhooks'))
+    placed = []
+    for index in range(calls):
+        phone = f'65{80000000 + index}'
+        call_sid = place_call(phone, f'Attendee {index}', 'Event', 'Summary', '2030-01-01', 'Venue', 'initial',
+                              index % 10 + 1, '10:00:00')
+        placed.append((call_sid, call_guid_map.get(call_sid), phone))
+
+    client = flask_app.test_client()
+    latencies = {'/voice': [], '/gather': [], '/status': []}
+    errors = {route: 0 for route in latencies}
+    started = time.perf_counter()
+    for call_sid, guid, phone in placed:
+        sequence = [
+            ('/voice', f'/voice?guid={guid}', {'CallSid': call_sid}),
+            ('/gather', '/gather', {'CallSid': call_sid, 'Digits': '1'}),
+            ('/status', f'/status?guid={guid}', {'CallSid': call_sid, 'CallStatus': 'completed', 'To': phone}),
+        ]
+        for route, url, form in sequence:
+            request_started = time.perf_counter()
+            response = client.post(url, data=form)
+            latencies[route].append(time.perf_counter() - request_started)
+            if response.status_code >= 400 or b'application error' in response.data:
+                errors[route] += 1
+    seconds = time.perf_counter() - started
+    requests = sum(len(samples) for samples in latencies.values())
+    return {
+        'calls': calls,
+        'requests': requests,
+        'seconds': round(seconds, 6),
+        'requests_per_second': round(requests / seconds, 1),
+        'routes': {route: dict(summarize_latencies(samples), errors=errors[route])
+                   for route, samples in latencies.items()},
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the call bot against local stand-ins.")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS),
+                        help="Benchmarks to run (default: all).")
+    parser.add_argument('--day-sizes', nargs='+', type=int, default=[1000, 10000, 100000],
+                        help="Rows in the daily CSV for the db_update benchmark.")
+    parser.add_argument('--incremental-fraction', type=float, default=0.01,
+                        help="Rows appended before the incremental db_update run, as a fraction of the day.")
+    parser.add_argument('--calls', type=int, default=1000, help="Calls placed by the make_call benchmark.")
+    parser.add_argument('--twilio-latency-ms', type=float, default=0.0,
+                        help="Simulated latency of each Twilio API call.")
+    parser.add_argument('--webhook-calls', type=int, default=500,
+                        help="Calls whose webhook sequence is replayed by the webhooks benchmark.")
+    parser.add_argument('--workdir', help="Directory for the stand-in storage (default: a new temporary directory).")
+    parser.add_argument('--output', help="Write the JSON results to this file instead of stdout.")
+    parser.add_argument('--log-level', default='CRITICAL', help="Log level of the application while measuring.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started_at = utc_now()
+    workdir = args.workdir or new_workdir()
+    configure_environment(workdir)
+
+    import app  # noqa: F401 (the environment must be configured first)
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    results = {}
+    if 'db_update' in args.only:
+        results['db_update'] = bench_db_update(workdir, args.day_sizes, args.incremental_fraction)
+    if 'make_call' in args.only:
+        results['make_call'] = bench_make_call(workdir, args.calls, args.twilio_latency_ms / 1000)
+    if 'webhooks' in args.only:
+        results['webhooks'] = bench_webhooks(workdir, args.webhook_calls)
+
+    settings = {key: value for key, value in vars(args).items() if key not in ('output', 'log_level')}
+    settings['workdir'] = workdir
+    write_json(build_results('run_benchmarks', started_at, settings, results), args.output)
+
+
+if __name__ == '__main__':
+    main()
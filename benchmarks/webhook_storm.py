@@ -0,0 +1,252 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+webhook_storm.py
+Description:
+Reproduces the burst of Twilio webhooks that arrives when the calls of a campaign complete within minutes, by
+replaying callback sequences against the Flask app at a target request rate, and reports latency percentiles
+and error rates per route.
+
+Content Overview:
+Sequences: Synthesized per call (status initiated/ringing/answered, /voice, the key presses of the IVR menus,
+then completed or no-answer), or read from a JSON lines recording.
+Correlation: One call is placed per recorded CallSid through `place_call`, with the stand-in Twilio client,
+and every request of the sequence carries that call's new CallSid and GUID.
+Pacing: Requests are sent in their natural order at `--rate` requests per second by `--workers` threads.
+All requests of a call go to the same worker, so a call's webhooks never overtake each other.
+Report: Per route count, error rate and latency percentiles, plus how far sending fell behind schedule.
+
+Each line of a recording is a JSON object: {"path": "/status", "params": {"CallSid": "CA...", "CallStatus":
+"completed", "To": "6581234567"}}. `--record` writes the synthesized storm in this format.
+
+Usage:
+    python -m benchmarks.webhook_storm --calls 2000 --rate 400 --output storm.json
+    python -m benchmarks.webhook_storm --replay storm.jsonl --rate 1000
+
+"""
+
+import argparse
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+from collections import defaultdict
+
+from .fakes import configure_environment, install_fakes
+from .report import build_results, new_workdir, summarize_latencies, utc_now, write_json
+
+# Key press webhooks, by IVR node, for the routes of the flow and the legacy /gather* routes
+GATHER_ROUTES = {
+    'flow': {'invitation': '/ivr/invitation', 'accepted': '/ivr/accepted', 'pickup_accepted': '/ivr/pickup_accepted'},
+    'legacy': {'invitation': '/gather', 'accepted': '/gather2', 'pickup_accepted': '/gather3'},
+}
+
+# Routes whose URL carries the call's GUID, as set by place_call
+GUID_ROUTES = ('/voice', '/status')
+
+
+def synthesize_call(call_sid, phone, gather_routes, rng):
+    """
+    Returns the webhooks of one call as (seconds after dialling, path, params) tuples.
+
+    A fifth of the calls are not answered. Answered calls press keys through the IVR menus; a few press an
+    invalid key.
+    """
+    status = lambda at, call_status: (at, '/status', {'CallSid': call_sid, 'CallStatus': call_status, 'To': phone})
+    events = [status(0.0, 'initiated'), status(1.0, 'ringing')]
+    if rng.random() < 0.2:
+        events.append(status(30.0, 'no-answer'))
+        return events
+
+    at = 1.0 + rng.uniform(2, 10)
+    events.append(status(at, 'answered'))
+    events.append((at + 0.1, '/voice', {'CallSid': call_sid, 'To': phone}))
+    for node in ('invitation', 'accepted', 'pickup_accepted'):
+        at += rng.uniform(10, 25)
+        digit = rng.choice('12') if rng.random() > 0.05 else '9'
+        events.append((at, gather_routes[node], {'CallSid': call_sid, 'Digits': digit}))
+        if digit != '1':
+            break
+    events.append(status(at + rng.uniform(2, 5), 'completed'))
+    return events
+
+
+def synthesize_storm(calls, window, gather_routes, seed):
+    """
+    Returns the webhooks of `calls` calls dialled uniformly over `window` seconds, in the order Twilio
+    would send them, as {'path', 'params'} dicts.
+    """
+    rng = random.Random(seed)
+    timed = []
+    for index in range(calls):
+        call_sid = f'CArecorded{index:08d}'
+        started = rng.uniform(0, window)
+        for at, path, params in synthesize_call(call_sid, f'65{80000000 + index}', gather_routes, rng):
+            timed.append((started + at, path, params))
+    timed.sort(key=lambda event: event[0])
+    return [{'path': path, 'params': params} for _, path, params in timed]
+
+
+def read_recording(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_recording(events, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        for event in events:
+            f.write(json.dumps(event) + '\n')
+
+
+def place_calls(events):
+    """
+    Places one call per CallSid of the storm and returns the new CallSid and GUID of each, by recorded CallSid.
+    """
+    from app.call_store import call_guid_map
+    from app.twilio_calls import place_call
+
+    calls = {}
+    for event in events:
+        recorded_sid = event['params'].get('CallSid')
+        if not recorded_sid or recorded_sid in calls:
+            continue
+        index = len(calls)
+        phone = event['params'].get('To') or f'65{80000000 + index}'
+        call_sid = place_call(phone, f'Attendee {index}', 'Event', 'Summary', '2030-01-01', 'Venue', 'initial',
+                              index % 10 + 1, '10:00:00')
+        calls[recorded_sid] = (call_sid, call_guid_map.get(call_sid))
+    return calls
+
+
+def correlate(event, calls):
+    """
+    Returns the URL and form of a recorded webhook, rewritten for the call placed in its place.
+    """
+    params = dict(event['params'])
+    call_sid, guid = calls.get(params.get('CallSid'), (None, None))
+    if call_sid:
+        params['CallSid'] = call_sid
+    url = event['path']
+    if guid and url in GUID_ROUTES:
+        url = f'{url}?guid={guid}'
+    return url, params
+
+
+def run_storm(flask_app, events, calls, rate, workers):
+    """
+    Sends the events at `rate` requests per second and returns the samples per route and the sending lag.
+    """
+    per_worker = [queue.Queue() for _ in range(workers)]
+    for index, event in enumerate(events):
+        # A call's webhooks always go to the same worker, in order
+        worker = hash(event['params'].get('CallSid')) % workers
+        per_worker[worker].put((index / rate, event))
+    for worker_queue in per_worker:
+        worker_queue.put(None)
+
+    latencies = defaultdict(list)
+    errors = defaultdict(int)
+    status_codes = defaultdict(int)
+    lags = []
+    lock = threading.Lock()
+    started = time.perf_counter() + 0.1
+
+    def work(worker_queue):
+        client = flask_app.test_client()
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                return
+            due, event = item
+            delay = started + due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            url, form = correlate(event, calls)
+            sent = time.perf_counter()
+            response = client.post(url, data=form)
+            elapsed = time.perf_counter() - sent
+            failed = response.status_code >= 400 or b'application error' in response.data
+            with lock:
+                latencies[event['path']].append(elapsed)
+                lags.append(max(sent - started - due, 0.0))
+                status_codes[response.status_code] += 1
+                if failed:
+                    errors[event['path']] += 1
+
+    threads = [threading.Thread(target=work, args=(worker_queue,), daemon=True) for worker_queue in per_worker]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    return latencies, errors, status_codes, lags, seconds
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Replays a storm of Twilio webhooks against the Flask app.")
+    parser.add_argument('--replay', help="JSON lines recording of webhooks to replay instead of synthesizing.")
+    parser.add_argument('--record', help="Write the synthesized webhooks to this JSON lines file.")
+    parser.add_argument('--calls', type=int, default=1000, help="Calls to synthesize.")
+    parser.add_argument('--window', type=float, default=300.0,
+                        help="Seconds over which the synthesized calls were dialled; sets how their webhooks interleave.")
+    parser.add_argument('--rate', type=float, default=200.0, help="Target requests per second.")
+    parser.add_argument('--workers', type=int, default=8, help="Concurrent senders.")
+    parser.add_argument('--gather-routes', choices=sorted(GATHER_ROUTES), default='flow',
+                        help="Post key presses to the IVR flow routes or to the legacy /gather* routes.")
+    parser.add_argument('--seed', type=int, default=1, help="Seed of the synthesized storm.")
+    parser.add_argument('--workdir', help="Directory for the stand-in storage (default: a new temporary directory).")
+    parser.add_argument('--output', help="Write the JSON report to this file instead of stdout.")
+    parser.add_argument('--log-level', default='CRITICAL', help="Log level of the application during the storm.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    started_at = utc_now()
+    workdir = args.workdir or new_workdir('callbot-storm-')
+    configure_environment(workdir)
+
+    from app import app as flask_app  # the environment must be configured first
+    import app.routes  # noqa: F401 (registers the routes)
+    logging.getLogger().setLevel(args.log_level.upper())
+    install_fakes(os.path.join(workdir, 'storm'))
+
+    if args.replay:
+        events = read_recording(args.replay)
+    else:
+        events = synthesize_storm(args.calls, args.window, GATHER_ROUTES[args.gather_routes], args.seed)
+        if args.record:
+            write_recording(events, args.record)
+    calls = place_calls(events)
+
+    latencies, errors, status_codes, lags, seconds = run_storm(flask_app, events, calls, args.rate, args.workers)
+    requests = sum(len(samples) for samples in latencies.values())
+    results = {
+        'calls': len(calls),
+        'requests': requests,
+        'seconds': round(seconds, 6),
+        'target_rate': args.rate,
+        'achieved_rate': round(requests / seconds, 1) if seconds else None,
+        'errors': sum(errors.values()),
+        'error_rate': round(sum(errors.values()) / requests, 6) if requests else None,
+        'status_codes': {str(code): count for code, count in sorted(status_codes.items())},
+        'schedule_lag': summarize_latencies(lags),
+        'routes': {route: dict(summarize_latencies(samples), errors=errors[route],
+                               error_rate=round(errors[route] / len(samples), 6))
+                   for route, samples in sorted(latencies.items())},
+    }
+    settings = {key: value for key, value in vars(args).items() if key not in ('output', 'log_level')}
+    settings['workdir'] = workdir
+    write_json(build_results('webhook_storm', started_at, settings, results), args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,28 @@
+#-------------------------------------------------------------------------------------------------------#
+# Copyright (c) 2023 by <Company/Name>                                                                  #
+#                                                                                                       #
+# Licensed under the MIT License                                                                        #
+#                                                                                                       #
+#-------------------------------------------------------------------------------------------------------#
+
+"""
+gunicorn.conf.py
+Description:
+Server hooks read by gunicorn from the working directory (or with `-c gunicorn.conf.py`).
+
+Content Overview:
+on_starting: Empties METRICS_DIR, so the metrics of an earlier server run are not added to this one.
+post_fork: Starts the blob update scheduler in every worker process, after the fork, so it also runs in
+workers that have not served a request yet. The master process never starts it, also with `--preload`.
+
+"""
+
+
+def on_starting(server):
+    from app.metrics import clear_metrics_dir
+    clear_metrics_dir()
+
+
+def post_fork(server, worker):
+    from app.scheduler import ensure_scheduler
+    ensure_scheduler()
@@ -32,8 +32,11 @@ run.py: Launches the Flask application server.
 """
 
 from app import app
+from app.metrics import clear_metrics_dir
 
 if __name__ == '__main__':
+    # Start the metrics of this run from zero if METRICS_DIR is set
+    clear_metrics_dir()
     app.run(debug=True)
     # app.run(port=8000)
 